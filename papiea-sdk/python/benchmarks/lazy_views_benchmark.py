@@ -0,0 +1,83 @@
+# Compares decoding a filter response into AttributeDicts with decoding
+# it into lazy views, for scan code reading metadata.uuid and spec.name
+# of every entity. Reports CPU time and peak memory of each decoder.
+#
+# Usage: python3 benchmarks/lazy_views_benchmark.py [entities] [iterations]
+import json
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from papiea.codec import JsonCodec, OrjsonCodec, orjson
+
+OBJECTS_PER_BUCKET = 10
+
+
+def make_page(count: int) -> bytes:
+    entities = []
+    for i in range(count):
+        objects = [
+            {"name": f"object-{j}", "reference": {"uuid": str(uuid.uuid4()), "kind": "object"}}
+            for j in range(OBJECTS_PER_BUCKET)
+        ]
+        entities.append({
+            "metadata": {
+                "uuid": str(uuid.uuid4()),
+                "kind": "bucket",
+                "spec_version": 3,
+                "created_at": "2021-01-01T00:00:00.000Z",
+                "extension": {"owner": "benchmark"},
+            },
+            "spec": {"name": f"bucket-{i}", "objects": objects},
+            "status": {"name": f"bucket-{i}", "objects": objects},
+        })
+    return json.dumps({"results": entities, "entity_count": count}).encode("utf-8")
+
+
+def scan(res) -> int:
+    names = 0
+    for entity in res.results:
+        if entity.metadata.uuid and entity.spec.name:
+            names += 1
+    return names
+
+
+def measure_cpu(decode, page: bytes, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        scan(decode(page))
+    return (time.perf_counter() - start) / iterations
+
+
+def measure_memory(decode, page: bytes) -> int:
+    tracemalloc.start()
+    res = decode(page)
+    scan(res)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main(count: int, iterations: int) -> None:
+    page = make_page(count)
+    print(f"{count} entities, {len(page) / 1024:.0f} KiB response")
+    decoders = [
+        ("attrs (json_loads_attrs)", JsonCodec().loads_attrs),
+        ("lazy views (json)", JsonCodec().loads_view),
+    ]
+    if orjson is not None:
+        decoders.append(("lazy views (orjson)", OrjsonCodec().loads_view))
+    for name, decode in decoders:
+        cpu = measure_cpu(decode, page, iterations)
+        peak = measure_memory(decode, page)
+        print(f"{name}: {cpu * 1000:.2f}ms per page, peak memory {peak / 1024 / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    main(count, iterations)
@@ -0,0 +1,97 @@
+# Compares EntityCRUD.get round-trip latency over TCP and over a UNIX
+# domain socket against a stub engine running in the same process.
+#
+# Usage: python3 benchmarks/uds_benchmark.py [iterations] [concurrency]
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from urllib.parse import quote
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from papiea.api import connection_pools
+from papiea.client import EntityCRUD
+from papiea.core import AttributeDict
+
+PREFIX = "benchmark"
+VERSION = "0.1.0"
+KIND = "bucket"
+ENTITY_UUID = "a6e3a1f4-6a2e-4c1b-9a4d-3f2d5c7b8e90"
+
+ENTITY = {
+    "metadata": {"uuid": ENTITY_UUID, "kind": KIND, "spec_version": 1},
+    "spec": {"name": "benchmark-bucket", "objects": []},
+    "status": {"name": "benchmark-bucket", "objects": []},
+}
+
+
+async def get_entity(request: web.Request) -> web.Response:
+    return web.json_response(ENTITY)
+
+
+async def start_stub_engine(socket_path: str):
+    app = web.Application()
+    app.router.add_get(f"/services/{PREFIX}/{VERSION}/{KIND}/{{uuid}}", get_entity)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    tcp_site = web.TCPSite(runner, "127.0.0.1", 0)
+    await tcp_site.start()
+    await web.UnixSite(runner, socket_path).start()
+    port = tcp_site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}", "unix://" + quote(socket_path, safe="")
+
+
+async def measure(papiea_url: str, iterations: int, concurrency: int) -> list:
+    client = EntityCRUD(papiea_url, PREFIX, VERSION, KIND)
+    # Concurrent workers read the same entity, coalescing would answer
+    # most of them without a round trip
+    client.api_instance.coalesce_gets = False
+    ref = AttributeDict(uuid=ENTITY_UUID, kind=KIND)
+    latencies = []
+
+    async def worker(count: int):
+        for _ in range(count):
+            start = time.perf_counter()
+            await client.get(ref)
+            latencies.append(time.perf_counter() - start)
+
+    # Warm up connections so that connect time is not measured
+    await asyncio.gather(*[client.get(ref) for _ in range(concurrency)])
+    await asyncio.gather(*[worker(iterations // concurrency) for _ in range(concurrency)])
+    return latencies
+
+
+def report(name: str, latencies: list, elapsed: float) -> None:
+    latencies = sorted(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(
+        f"{name}: {len(latencies)} requests in {elapsed:.2f}s, "
+        f"{len(latencies) / elapsed:.0f} req/s, "
+        f"mean {statistics.mean(latencies) * 1000:.3f}ms, "
+        f"median {statistics.median(latencies) * 1000:.3f}ms, "
+        f"p99 {p99 * 1000:.3f}ms"
+    )
+
+
+async def main(iterations: int, concurrency: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        runner, tcp_url, unix_url = await start_stub_engine(os.path.join(tmp_dir, "engine.sock"))
+        try:
+            for name, url in (("TCP", tcp_url), ("UDS", unix_url)):
+                start = time.perf_counter()
+                latencies = await measure(url, iterations, concurrency)
+                report(name, latencies, time.perf_counter() - start)
+        finally:
+            await connection_pools.close()
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    asyncio.run(main(iterations, concurrency))
@@ -0,0 +1,103 @@
+import asyncio
+import pytest
+
+from aiohttp import ClientSession, web
+
+from papiea.admission import AdmissionControl
+from papiea.timeouts import remaining_time
+
+from e2e_tests.local_engine import start_server
+
+
+async def serve(admission: AdmissionControl, handler, timeout=None):
+    app = web.Application()
+    app.router.add_post("/callback", admission.wrap(handler, timeout))
+    return await start_server(app)
+
+
+class TestAdmissionControl:
+    @pytest.mark.asyncio
+    async def test_queue_wait_counts_toward_the_callback_timeout(self):
+        admission = AdmissionControl(max_in_flight=1, max_queue_wait=10)
+        remaining = []
+
+        async def handler(request):
+            remaining.append(remaining_time())
+            await asyncio.sleep(0.3)
+            return web.json_response({})
+
+        runner, url = await serve(admission, handler, timeout=1.0)
+        try:
+            async with ClientSession() as session:
+                responses = await asyncio.gather(*[
+                    session.post(url + "/callback") for _ in range(2)
+                ])
+            assert [resp.status for resp in responses] == [200, 200]
+            first, second = sorted(remaining, reverse=True)
+            assert first > 0.9
+            assert second < 0.75
+        finally:
+            await runner.cleanup()
+
+    @pytest.mark.asyncio
+    async def test_queued_past_the_callback_timeout_is_rejected(self):
+        admission = AdmissionControl(max_in_flight=1, max_queue_wait=10)
+
+        async def handler(request):
+            await asyncio.sleep(0.5)
+            return web.json_response({})
+
+        runner, url = await serve(admission, handler, timeout=0.2)
+        try:
+            async with ClientSession() as session:
+                start = asyncio.get_running_loop().time()
+                responses = await asyncio.gather(*[
+                    session.post(url + "/callback") for _ in range(2)
+                ])
+                rejected = [resp for resp in responses if resp.status == 503]
+                assert len(rejected) == 1
+                assert asyncio.get_running_loop().time() - start < 1.0
+                assert admission.stats.rejected == 1
+        finally:
+            await runner.cleanup()
+
+    @pytest.mark.asyncio
+    async def test_full_queue_is_rejected_with_retry_after(self):
+        admission = AdmissionControl(max_in_flight=1, max_queue=1, max_queue_wait=None)
+        release = asyncio.Event()
+
+        async def handler(request):
+            await release.wait()
+            return web.json_response({})
+
+        runner, url = await serve(admission, handler)
+        try:
+            async with ClientSession() as session:
+                running = asyncio.ensure_future(session.post(url + "/callback"))
+                queued = asyncio.ensure_future(session.post(url + "/callback"))
+                while admission.queue_depth < 1:
+                    await asyncio.sleep(0.01)
+                rejected = await session.post(url + "/callback")
+                assert rejected.status == 503
+                assert int(rejected.headers["Retry-After"]) >= admission.min_retry_after
+                body = await rejected.json()
+                assert "queue is full" in body["message"]
+                release.set()
+                assert [(await fut).status for fut in (running, queued)] == [200, 200]
+            snapshot = admission.snapshot()
+            assert snapshot["admitted"] == 2
+            assert snapshot["rejected"] == 1
+            assert snapshot["in_flight"] == 0 and snapshot["queue_depth"] == 0
+        finally:
+            release.set()
+            await runner.cleanup()
+
+    def test_retry_after_follows_the_backlog(self):
+        admission = AdmissionControl(max_in_flight=2, min_retry_after=1, max_retry_after=30)
+        assert admission.retry_after() == 1
+        for _ in range(10):
+            admission.stats.service_time.observe(4.0)
+        # Queue of one, two at a time at 4s each
+        assert admission.retry_after() == 2
+        admission.max_retry_after = 1
+        assert admission.retry_after() == 1
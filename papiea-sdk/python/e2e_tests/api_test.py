@@ -0,0 +1,330 @@
+import asyncio
+import json
+import logging
+import pytest
+
+from aiohttp import web
+
+from papiea.api import ApiInstance, ConnectionPool, PoolConfig
+from papiea.limits import ConcurrencyLimiter
+from papiea.python_sdk_exceptions import ApiException, CircuitOpenException, DeadlineExceededException
+from papiea.retry import CircuitBreaker, RetryBudget, RetryPolicy
+from papiea.timeouts import RequestTimeout, deadline_scope
+
+from e2e_tests.local_engine import start_server
+
+logger = logging.getLogger(__name__)
+
+
+def get_api(url: str, timeout: RequestTimeout = RequestTimeout(), config: PoolConfig = None) -> ApiInstance:
+    # A pool of its own so that tests do not share sessions or limiters
+    return ApiInstance(url, timeout, logger=logger, pool=ConnectionPool(url, config or PoolConfig()))
+
+
+def failing_app(statuses: list):
+    # Answers with the given statuses in turn, then with 200, and
+    # records the methods of the requests it got
+    app = web.Application()
+    requests = []
+
+    async def handle(request):
+        requests.append(request.method)
+        status = statuses.pop(0) if statuses else 200
+        if status == 200:
+            return web.json_response({"ok": True})
+        return web.Response(status=status, text="unavailable")
+
+    app.router.add_route("*", "/items", handle)
+    return app, requests
+
+
+FAST_RETRIES = RetryPolicy(max_attempts=3, backoff_base=0.001, backoff_max=0.001)
+
+
+# Tests of the engine client against a local server, no engine needed
+class TestApiInstance:
+    @pytest.mark.asyncio
+    async def test_stream_outlives_request_total(self):
+        async def handle(request):
+            resp = web.StreamResponse(headers={"Content-Type": "application/json"})
+            await resp.prepare(request)
+            await resp.write(b'{"results": [')
+            for i in range(400):
+                if i % 50 == 0:
+                    await asyncio.sleep(0.1)
+                await resp.write((b"," if i else b"") + json.dumps({"i": i}).encode())
+            await resp.write(b'], "entity_count": 400}')
+            await resp.write_eof()
+            return resp
+
+        app = web.Application()
+        app.router.add_get("/items", handle)
+        runner, url = await start_server(app)
+        api = get_api(url, RequestTimeout(total=0.3))
+        try:
+            items = [item async for item in api.stream("get", "items")]
+            assert [item.i for item in items] == list(range(400))
+        finally:
+            await api.pool.close()
+            await runner.cleanup()
+
+    @pytest.mark.asyncio
+    async def test_stream_stalled_read_times_out(self):
+        async def handle(request):
+            resp = web.StreamResponse(headers={"Content-Type": "application/json"})
+            await resp.prepare(request)
+            await resp.write(b'{"results": [{"i": 0}')
+            await asyncio.sleep(1)
+            await resp.write(b'], "entity_count": 1}')
+            return resp
+
+        app = web.Application()
+        app.router.add_get("/items", handle)
+        runner, url = await start_server(app)
+        api = get_api(url, RequestTimeout(total=0.3))
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                async for _ in api.stream("get", "items"):
+                    pass
+        finally:
+            await api.pool.close()
+            await runner.cleanup()
+
+    @pytest.mark.asyncio
+    async def test_concurrent_gets_are_coalesced(self):
+        requests = []
+
+        async def handle(request):
+            requests.append(request.headers.get("Authorization"))
+            await asyncio.sleep(0.05)
+            return web.json_response({"uuid": "1", "spec": {"tags": ["a"]}})
+
+        app = web.Application()
+        app.router.add_get("/items/1", handle)
+        runner, url = await start_server(app)
+        api = get_api(url)
+        try:
+            results = await asyncio.gather(*[api.get("items/1") for _ in range(10)])
+            assert len(requests) == 1
+            # Every caller decodes its own copy
+            results[0].spec.tags.append("b")
+            assert all(res.spec.tags == ["a"] for res in results[1:])
+            # Not shared across credentials, nor with later requests
+            await asyncio.gather(api.get("items/1", {"Authorization": "Bearer a"}), api.get("items/1"))
+            assert len(requests) == 3
+            api.coalesce_gets = False
+            await asyncio.gather(api.get("items/1"), api.get("items/1"))
+            assert len(requests) == 5
+            assert api.pool.single_flight.in_flight == 0
+        finally:
+            await api.pool.close()
+            await runner.cleanup()
+
+    @pytest.mark.asyncio
+    async def test_coalesced_get_keeps_callers_deadlines(self):
+        requests = 0
+
+        async def handle(request):
+            nonlocal requests
+            requests += 1
+            await asyncio.sleep(0.3)
+            return web.json_response({"uuid": "1"})
+
+        app = web.Application()
+        app.router.add_get("/items/1", handle)
+        runner, url = await start_server(app)
+        api = get_api(url, RequestTimeout(total=5))
+
+        async def get_with_deadline():
+            with deadline_scope(0.1):
+                return await api.get("items/1")
+
+        try:
+            short, unbounded = await asyncio.gather(
+                get_with_deadline(), api.get("items/1"), return_exceptions=True
+            )
+            assert isinstance(short, DeadlineExceededException)
+            assert unbounded.uuid == "1"
+            assert requests == 1
+            # Callers with other timeouts do not share the request
+            await asyncio.gather(api.get("items/1"), api.get("items/1", timeout=RequestTimeout(total=10)))
+            assert requests == 3
+        finally:
+            await api.pool.close()
+            await runner.cleanup()
+
+    def test_limiters_are_per_loop(self):
+        pool = ConnectionPool("http://127.0.0.1", PoolConfig(limiter_factory=ConcurrencyLimiter))
+
+        async def get_limiters():
+            return pool.limiter, pool.limiter
+
+        first, same = asyncio.run(get_limiters())
+        second, _ = asyncio.run(get_limiters())
+        assert first is same
+        assert first is not second
+        assert len(pool._limiters) == 1
+
+    @pytest.mark.asyncio
+    async def test_last_client_closes_session(self):
+        async def handle(request):
+            return web.json_response({"uuid": "1"})
+
+        app = web.Application()
+        app.router.add_get("/items/1", handle)
+        runner, url = await start_server(app)
+        pool = ConnectionPool(url, PoolConfig())
+        first = ApiInstance(url, logger=logger, pool=pool)
+        second = ApiInstance(url, logger=logger, pool=pool)
+        try:
+            await first.get("items/1")
+            await second.get("items/1")
+            session = pool.session
+            await first.close()
+            assert not session.closed
+            await second.get("items/1")
+            await second.close()
+            assert session.closed
+            # Reopened on the next use
+            await first.get("items/1")
+            assert not pool.session.closed
+            await first.close()
+            assert pool.session is not session
+        finally:
+            await pool.close()
+            await runner.cleanup()
+
+    def test_session_of_closed_loop_is_discarded(self):
+        async def handle(request):
+            return web.json_response({"uuid": "1"})
+
+        async def use_and_leave_open():
+            app = web.Application()
+            app.router.add_get("/items/1", handle)
+            runner, url = await start_server(app)
+            pool = ConnectionPool(url, PoolConfig())
+            await ApiInstance(url, logger=logger, pool=pool).get("items/1")
+            await runner.cleanup()
+            return pool, pool.session
+
+        pool, session = asyncio.run(use_and_leave_open())
+
+        async def reuse():
+            return pool.session
+
+        try:
+            assert asyncio.run(reuse()) is not session
+            assert session.connector is None or session.connector.closed
+        finally:
+            asyncio.run(pool.close())
+
+
+class TestRetries:
+    @pytest.mark.asyncio
+    async def test_retryable_statuses(self):
+        app, requests = failing_app([503, 502])
+        runner, url = await start_server(app)
+        api = get_api(url, config=PoolConfig(retry_policy=FAST_RETRIES))
+        try:
+            assert (await api.get("items")).ok
+            assert requests == ["GET"] * 3
+        finally:
+            await api.pool.close()
+            await runner.cleanup()
+
+    @pytest.mark.asyncio
+    async def test_non_retryable_status(self):
+        app, requests = failing_app([500])
+        runner, url = await start_server(app)
+        api = get_api(url, config=PoolConfig(retry_policy=FAST_RETRIES))
+        try:
+            with pytest.raises(ApiException) as error:
+                await api.get("items")
+            assert error.value.status == 500
+            assert requests == ["GET"]
+        finally:
+            await api.pool.close()
+            await runner.cleanup()
+
+    @pytest.mark.asyncio
+    async def test_writes_are_not_retried_once_sent(self):
+        app, requests = failing_app([503, 503, 503])
+        runner, url = await start_server(app)
+        api = get_api(url, config=PoolConfig(retry_policy=FAST_RETRIES))
+        try:
+            with pytest.raises(ApiException):
+                await api.post("items", {"a": 1})
+            with pytest.raises(ApiException):
+                await api.put("items", {"a": 1})
+            assert requests == ["POST", "PUT"]
+            # Unless the caller says the write is safe to repeat
+            assert (await api.patch("items", {"a": 1}, idempotent=True)).ok
+            assert requests == ["POST", "PUT", "PATCH", "PATCH"]
+        finally:
+            await api.pool.close()
+            await runner.cleanup()
+
+    @pytest.mark.asyncio
+    async def test_retry_budget_exhaustion(self):
+        app, requests = failing_app([503] * 10)
+        runner, url = await start_server(app)
+        policy = RetryPolicy(max_attempts=5, backoff_base=0.001, backoff_max=0.001)
+        api = get_api(url, config=PoolConfig(retry_policy=policy, breaker_failure_threshold=100))
+        api.pool.retry_budget = RetryBudget(ratio=0, min_retries_per_sec=0, max_tokens=1)
+        try:
+            with pytest.raises(ApiException):
+                await api.get("items")
+            assert len(requests) == 2
+            with pytest.raises(ApiException):
+                await api.get("items")
+            assert len(requests) == 3
+        finally:
+            await api.pool.close()
+            await runner.cleanup()
+
+    @pytest.mark.asyncio
+    async def test_circuit_breaker_transitions(self):
+        app, requests = failing_app([503, 503, 503])
+        runner, url = await start_server(app)
+        config = PoolConfig(
+            retry_policy=RetryPolicy(max_attempts=1),
+            breaker_failure_threshold=2,
+            breaker_reset_timeout=0.1,
+        )
+        api = get_api(url, config=config)
+        breaker = api.pool.circuit_breaker
+        try:
+            for _ in range(2):
+                with pytest.raises(ApiException):
+                    await api.get("items")
+            assert breaker.state == CircuitBreaker.Open
+            with pytest.raises(CircuitOpenException):
+                await api.get("items")
+            assert len(requests) == 2
+            # A single probe once the reset timeout passed, its failure
+            # opens the breaker again
+            await asyncio.sleep(0.15)
+            with pytest.raises(ApiException):
+                await api.get("items")
+            assert breaker.state == CircuitBreaker.Open
+            await asyncio.sleep(0.15)
+            assert (await api.get("items")).ok
+            assert breaker.state == CircuitBreaker.Closed
+            assert len(requests) == 4
+        finally:
+            await api.pool.close()
+            await runner.cleanup()
+
+    @pytest.mark.asyncio
+    async def test_open_circuit_keeps_the_error_that_opened_it(self):
+        app, requests = failing_app([503])
+        runner, url = await start_server(app)
+        api = get_api(url, config=PoolConfig(retry_policy=FAST_RETRIES, breaker_failure_threshold=1))
+        try:
+            with pytest.raises(CircuitOpenException) as error:
+                await api.get("items")
+            assert isinstance(error.value.__cause__, ApiException)
+            assert error.value.__cause__.status == 503
+        finally:
+            await api.pool.close()
+            await runner.cleanup()
@@ -0,0 +1,147 @@
+import asyncio
+import pytest
+
+from papiea.bulk import ErrorPolicy, run_bulk
+from papiea.client import GET_MANY_CHUNK_SIZE, EntityCRUD
+from papiea.core import AttributeDict
+
+from e2e_tests.local_engine import PREFIX, VERSION, LocalEngine
+
+
+def count(engine: LocalEngine, method: str, path: str = "") -> int:
+    return len([r for r in engine.requests if r[0] == method and r[1].split("?")[0].endswith(path)])
+
+
+async def collect(results) -> list:
+    return [res async for res in results]
+
+
+class TestRunBulk:
+    @pytest.mark.asyncio
+    async def test_partial_failures(self):
+        async def operation(item):
+            await asyncio.sleep(0.001 * (10 - item))
+            if item % 3 == 0:
+                raise ValueError(f"item {item}")
+            return item * 10
+
+        results = await collect(run_bulk(range(10), operation, concurrency=4))
+        assert sorted(res.index for res in results) == list(range(10))
+        for res in results:
+            assert res.item == res.index
+            if res.index % 3 == 0:
+                assert not res.ok and str(res.error) == f"item {res.index}"
+                with pytest.raises(ValueError):
+                    res.unwrap()
+            else:
+                assert res.unwrap() == res.index * 10
+
+    @pytest.mark.asyncio
+    async def test_results_in_completion_order(self):
+        async def operation(item):
+            await asyncio.sleep(item)
+            return item
+
+        results = await collect(run_bulk([0.2, 0.0, 0.1], operation))
+        assert [res.index for res in results] == [1, 2, 0]
+
+    @pytest.mark.asyncio
+    async def test_concurrency_and_lazy_input(self):
+        running = 0
+        peak = 0
+        taken = []
+
+        async def items():
+            for i in range(20):
+                taken.append(i)
+                yield i
+
+        async def operation(item):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return item
+
+        results = run_bulk(items(), operation, concurrency=3)
+        first = await results.__anext__()
+        assert first.index == 0
+        # Only as many items as can run were taken from the input
+        assert len(taken) <= 4
+        rest = await collect(results)
+        assert len(rest) == 19
+        assert peak == 3
+
+    @pytest.mark.asyncio
+    async def test_stop_on_error(self):
+        started = []
+
+        async def operation(item):
+            started.append(item)
+            await asyncio.sleep(0.01)
+            if item == 2:
+                raise ValueError("failed")
+            return item
+
+        results = await collect(run_bulk(range(100), operation, concurrency=4, on_error=ErrorPolicy.Stop))
+        # Items in flight finish, none is started after the failure
+        assert len(started) == len(results) < 10
+        assert [res.index for res in results if not res.ok] == [2]
+
+    @pytest.mark.asyncio
+    async def test_entity_bulk_operations(self):
+        engine = await LocalEngine().start()
+        entities = [engine.add({"i": i}) for i in range(4)]
+        client = EntityCRUD(engine.url, PREFIX, VERSION, engine.kind)
+        try:
+            updates = [(AttributeDict(uuid=e["metadata"]["uuid"], spec_version=1), {"i": 10}) for e in entities]
+            # Stale spec_version
+            updates[1][0].spec_version = 5
+            results = sorted(await collect(client.update_many(updates)), key=lambda res: res.index)
+            assert [res.ok for res in results] == [True, False, True, True]
+            assert results[1].conflict
+            refs = [AttributeDict(uuid=entities[0]["metadata"]["uuid"]), AttributeDict(uuid="missing")]
+            results = sorted(await collect(client.delete_many(refs)), key=lambda res: res.index)
+            assert results[0].ok and results[1].not_found
+            assert len(engine.entities) == 3
+        finally:
+            await client.api_instance.close()
+            await engine.stop()
+
+
+class TestGetMany:
+    @pytest.mark.asyncio
+    async def test_order_duplicates_and_missing(self):
+        engine = await LocalEngine().start()
+        entities = [engine.add({"i": i}) for i in range(5)]
+        client = EntityCRUD(engine.url, PREFIX, VERSION, engine.kind)
+        uuids = [entities[3]["metadata"]["uuid"], "missing", entities[0]["metadata"]["uuid"], entities[3]["metadata"]["uuid"]]
+        try:
+            for use_filter in (True, False):
+                results = await client.get_many([AttributeDict(uuid=uuid) for uuid in uuids], use_filter=use_filter)
+                assert [res.index for res in results] == [0, 1, 2, 3]
+                assert [res.value.spec.i if res.ok else None for res in results] == [3, None, 0, 3]
+                assert results[1].not_found
+        finally:
+            await client.api_instance.close()
+            await engine.stop()
+
+    @pytest.mark.asyncio
+    async def test_filter_chunks(self):
+        engine = await LocalEngine().start()
+        entities = [engine.add({"i": i}) for i in range(GET_MANY_CHUNK_SIZE + 50)]
+        client = EntityCRUD(engine.url, PREFIX, VERSION, engine.kind)
+        try:
+            results = await client.get_many([AttributeDict(uuid=e["metadata"]["uuid"]) for e in entities])
+            assert all(res.ok for res in results)
+            assert [res.value.spec.i for res in results] == list(range(len(entities)))
+            assert count(engine, "POST", "/filter") == 2
+            assert count(engine, "GET") == 0
+            # Lookups by uuid when filtering is off
+            await client.get_many([AttributeDict(uuid=e["metadata"]["uuid"]) for e in entities[:10]], use_filter=False)
+            assert count(engine, "POST", "/filter") == 2
+            assert count(engine, "GET") == 10
+        finally:
+            await client.api_instance.close()
+            await engine.stop()
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import pytest
+
+from papiea.cache import EntityCache, QueryCache
+from papiea.client import EntityCRUD
+from papiea.core import AttributeDict
+from papiea.python_sdk_exceptions import EntityNotFoundException
+from papiea.timeouts import RequestTimeout
+
+from e2e_tests.local_engine import PREFIX, VERSION, LocalEngine
+
+
+def entity_body(uuid: str, spec_version: int) -> bytes:
+    return json.dumps({"metadata": {"uuid": uuid, "spec_version": spec_version}, "spec": {}}).encode()
+
+
+class Source(object):
+    # fetch for the caches, counting the calls made
+    def __init__(self, spec_version: int = 1, delay: float = 0.0):
+        self.spec_version = spec_version
+        self.delay = delay
+        self.calls = 0
+        self.missing = False
+
+    async def fetch(self, uuid: str) -> bytes:
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.missing:
+            raise EntityNotFoundException(f"Entity {uuid} not found", None, None)
+        return entity_body(uuid, self.spec_version)
+
+
+async def cached_get(cache: EntityCache, source: Source, uuid: str = "u1", max_staleness=None):
+    return await cache.get(uuid, lambda: source.fetch(uuid), json.loads, max_staleness)
+
+
+class TestEntityCache:
+    @pytest.mark.asyncio
+    async def test_ttl(self):
+        cache = EntityCache(ttl=0.1)
+        source = Source()
+        for _ in range(3):
+            await cached_get(cache, source)
+        assert source.calls == 1
+        await asyncio.sleep(0.15)
+        await cached_get(cache, source)
+        assert source.calls == 2
+        assert cache.stats.expired == 1
+        # max_staleness is checked on top of the ttl
+        await cached_get(cache, source, max_staleness=0)
+        assert source.calls == 3
+
+    @pytest.mark.asyncio
+    async def test_hits_are_separate_copies(self):
+        cache = EntityCache()
+        source = Source()
+        first = await cached_get(cache, source)
+        first["spec"]["changed"] = True
+        assert "changed" not in (await cached_get(cache, source))["spec"]
+
+    @pytest.mark.asyncio
+    async def test_negative_ttl(self):
+        cache = EntityCache(negative_ttl=0.1)
+        source = Source()
+        source.missing = True
+        for _ in range(2):
+            with pytest.raises(EntityNotFoundException):
+                await cached_get(cache, source)
+        assert source.calls == 1
+        assert cache.stats.negative_hits == 1
+        source.missing = False
+        await asyncio.sleep(0.15)
+        assert (await cached_get(cache, source))["metadata"]["uuid"] == "u1"
+
+    @pytest.mark.asyncio
+    async def test_lru_eviction(self):
+        cache = EntityCache(max_size=2)
+        source = Source()
+        for uuid in ("a", "b", "a", "c"):
+            await cached_get(cache, source, uuid)
+        assert len(cache) == 2
+        assert cache.stats.evictions == 1
+        calls = source.calls
+        # b was the least recently used
+        await cached_get(cache, source, "a")
+        await cached_get(cache, source, "c")
+        assert source.calls == calls
+        await cached_get(cache, source, "b")
+        assert source.calls == calls + 1
+
+    @pytest.mark.asyncio
+    async def test_read_in_flight_during_invalidation_is_not_stored(self):
+        cache = EntityCache()
+        source = Source(delay=0.05)
+        reading = asyncio.ensure_future(cached_get(cache, source))
+        await asyncio.sleep(0.01)
+        cache.invalidate("u1")
+        await reading
+        assert len(cache) == 0
+        await cached_get(cache, source)
+        assert len(cache) == 1
+
+    def test_older_spec_version_does_not_replace(self):
+        cache = EntityCache()
+        cache.store("u1", "u1", entity_body("u1", 3), 3, 10, 0)
+        cache.store("u1", "u1", entity_body("u1", 2), 2, 10, 0)
+        assert cache.lookup("u1").spec_version == 3
+
+
+class TestClientCaches:
+    @pytest.mark.asyncio
+    async def test_writes_invalidate_cached_entities(self):
+        engine = await LocalEngine().start()
+        entity = engine.add({"name": "a"})
+        uuid = entity["metadata"]["uuid"]
+        cache = EntityCache(ttl=30)
+        client = EntityCRUD(engine.url, PREFIX, VERSION, engine.kind, cache=cache)
+        # Writes through any client of the process invalidate
+        other = EntityCRUD(engine.url, PREFIX, VERSION, engine.kind)
+        try:
+            assert (await client.get(AttributeDict(uuid=uuid))).spec.name == "a"
+            await client.get(AttributeDict(uuid=uuid))
+            assert cache.stats.hits == 1
+            await other.update(AttributeDict(uuid=uuid, spec_version=1), {"name": "b"})
+            assert (await client.get(AttributeDict(uuid=uuid))).spec.name == "b"
+            # Failed writes invalidate as well, they may have gone through
+            with pytest.raises(Exception):
+                await other.update(AttributeDict(uuid=uuid, spec_version=1), {"name": "c"})
+            assert cache.lookup(uuid) is None
+            await other.delete(AttributeDict(uuid=uuid))
+            with pytest.raises(EntityNotFoundException):
+                await client.get(AttributeDict(uuid=uuid))
+        finally:
+            await client.api_instance.close()
+            await other.api_instance.close()
+            await engine.stop()
+
+    @pytest.mark.asyncio
+    async def test_create_with_meta_invalidates_when_the_response_is_lost(self):
+        engine = await LocalEngine().start()
+        engine.add({"name": "a"})
+        cache = EntityCache(negative_ttl=30)
+        query_cache = QueryCache(ttl=30)
+        client = EntityCRUD(engine.url, PREFIX, VERSION, engine.kind, cache=cache, query_cache=query_cache)
+        try:
+            res = await client.filter({"spec": {"name": "a"}})
+            assert res.entity_count == 1
+            with pytest.raises(Exception):
+                await client.get(AttributeDict(uuid="new"))
+            # The engine creates the entity but the response never arrives
+            engine.delay = 0.5
+            with pytest.raises(Exception):
+                await client.create_with_meta(
+                    AttributeDict(uuid="new"), {"name": "a"}, timeout=RequestTimeout(total=0.1)
+                )
+            engine.delay = 0.0
+            res = await client.filter({"spec": {"name": "a"}})
+            assert res.entity_count == 2
+            entity = await client.get(AttributeDict(uuid="new"))
+            assert entity.spec.name == "a"
+        finally:
+            await client.api_instance.close()
+            await engine.stop()
+
+    @pytest.mark.asyncio
+    async def test_query_cache_keeps_provider_versions_apart(self):
+        old = await LocalEngine(version="0.1.0").start()
+        new = await LocalEngine(version="0.2.0").start()
+        old.add({"name": "a", "version": 1})
+        new.add({"name": "a", "version": 2})
+        query_cache = QueryCache(ttl=30)
+        old_client = EntityCRUD(old.url, PREFIX, "0.1.0", "bucket", query_cache=query_cache)
+        new_client = EntityCRUD(new.url, PREFIX, "0.2.0", "bucket", query_cache=query_cache)
+        try:
+            for _ in range(2):
+                res = await old_client.filter({"spec": {"name": "a"}})
+                assert [entity.spec.version for entity in res.results] == [1]
+                res = await new_client.filter({"spec": {"name": "a"}})
+                assert [entity.spec.version for entity in res.results] == [2]
+            assert query_cache.stats.hits == 2
+        finally:
+            await old_client.api_instance.close()
+            await new_client.api_instance.close()
+            await old.stop()
+            await new.stop()
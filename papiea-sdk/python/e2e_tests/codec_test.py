@@ -0,0 +1,103 @@
+import json
+import logging
+import pytest
+
+from aiohttp import web
+
+from papiea.api import ApiInstance, ConnectionPool, PoolConfig
+from papiea.codec import ItemsStreamParser, JsonCodec, OrjsonCodec
+
+from e2e_tests.local_engine import start_server
+
+logger = logging.getLogger(__name__)
+
+ITEMS = [
+    {"name": 'quote " and {brace} [bracket]', "results": [1, 2]},
+    {"name": "escaped \\\" backslash \\\\", "path": "c:\\dir\\"},
+    {"nested": [[1, [2, 3]], {"a": [{"b": "]"}]}], "unicode": "\u00e9\u4e2d"},
+    [{"array": "item"}],
+    {},
+]
+DOCUMENT = json.dumps({
+    "note": "the results field comes later",
+    "other": {"results": [{"not": "these"}]},
+    "results": ITEMS,
+    "entity_count": len(ITEMS),
+}).encode()
+
+
+def parse(chunks) -> list:
+    parser = ItemsStreamParser("results")
+    items = []
+    for chunk in chunks:
+        items.extend(json.loads(item) for item in parser.feed(chunk))
+    parser.close()
+    return items
+
+
+class TestItemsStreamParser:
+    def test_every_split_point(self):
+        for split in range(len(DOCUMENT) + 1):
+            assert parse([DOCUMENT[:split], DOCUMENT[split:]]) == ITEMS
+
+    def test_byte_by_byte(self):
+        assert parse([DOCUMENT[i:i + 1] for i in range(len(DOCUMENT))]) == ITEMS
+
+    def test_empty_results(self):
+        assert parse([b'{"results": [], "entity_count": 0}']) == []
+        assert parse([b'{"results"', b":[]}"]) == []
+
+    def test_empty_body(self):
+        assert parse([]) == []
+        assert parse([b""]) == []
+
+    def test_truncated_body(self):
+        end = DOCUMENT.index(b'"entity_count"')
+        for cut in range(1, end, 7):
+            with pytest.raises(Exception):
+                parse([DOCUMENT[:cut]])
+
+    def test_scalar_items_raise(self):
+        for document in (b'{"results": [{"a": 1}, 2]}', b'{"results": ["a"]}', b'{"results": [null]}'):
+            with pytest.raises(Exception):
+                parse([document])
+        # Also when the scalar is split over chunks
+        with pytest.raises(Exception):
+            parse([b'{"results": [{"a": 1}, tr', b"ue]}"])
+
+
+class TestOrjsonCodec:
+    def test_wide_integers(self):
+        pytest.importorskip("orjson")
+        codec = OrjsonCodec()
+        obj = {"small": 2 ** 63 - 1, "wide": 2 ** 70, "negative": -2 ** 64, "items": [{"n": 10 ** 30}]}
+        data = codec.dumps(obj)
+        assert data == JsonCodec().dumps(obj)
+        assert json.loads(data) == obj
+        assert codec.dumps({"n": 1}) == b'{"n":1}'
+
+    def test_unserializable_still_raises(self):
+        pytest.importorskip("orjson")
+        with pytest.raises(TypeError):
+            OrjsonCodec().dumps({"n": 2 ** 70, "o": object()})
+
+
+class TestStream:
+    @pytest.mark.asyncio
+    async def test_truncated_response_raises(self):
+        async def handle(request):
+            return web.Response(body=b'{"results": [{"a": 1}, {"a": 2}, {"a"', content_type="application/json")
+
+        app = web.Application()
+        app.router.add_get("/items", handle)
+        runner, url = await start_server(app)
+        api = ApiInstance(url, logger=logger, pool=ConnectionPool(url, PoolConfig()))
+        items = []
+        try:
+            with pytest.raises(Exception, match="ended"):
+                async for item in api.stream("get", "items"):
+                    items.append(item)
+            assert [item.a for item in items] == [1, 2]
+        finally:
+            await api.pool.close()
+            await runner.cleanup()
@@ -0,0 +1,74 @@
+import logging
+import pytest
+
+from aiohttp import ClientSession, web
+
+from papiea.api import ApiInstance, ConnectionPool, PoolConfig
+from papiea.compression import CompressionConfig, compression_middleware
+
+from e2e_tests.local_engine import start_server
+
+logger = logging.getLogger(__name__)
+
+
+class TestCompression:
+    @pytest.mark.asyncio
+    async def test_round_trip(self):
+        server_config = CompressionConfig(threshold=1024)
+        client_config = CompressionConfig(threshold=1024, encoding="deflate")
+        encodings = []
+
+        async def echo(request):
+            encodings.append(request.headers.get("Content-Encoding"))
+            return web.json_response(await request.json())
+
+        app = web.Application(middlewares=[compression_middleware(server_config)])
+        app.router.add_post("/echo", echo)
+        runner, url = await start_server(app)
+        api = ApiInstance(url, logger=logger, pool=ConnectionPool(url, PoolConfig(compression=client_config)))
+        try:
+            big = {"items": [{"name": f"item-{i}", "value": "x" * 20} for i in range(200)]}
+            res = await api.post("echo", big)
+            assert res == big
+            small = {"name": "small"}
+            res = await api.post("echo", small)
+            assert res == small
+            # Request bodies in the client's encoding, responses in the
+            # server's preferred one the client accepts
+            assert encodings == ["deflate", None]
+            server_stats = server_config.stats.snapshot()
+            assert sum(entry["compressed_count"] for entry in server_stats.values()) == 1
+            assert sum(entry["count"] for entry in server_stats.values()) == 2
+            client_stats = client_config.stats.snapshot()
+            compressed = [entry for entry in client_stats.values() if entry["compressed_count"]]
+            assert len(compressed) == 1 and compressed[0]["ratio"] < 0.5
+        finally:
+            await api.pool.close()
+            await runner.cleanup()
+
+    @pytest.mark.asyncio
+    async def test_uncompressed_without_accept_encoding(self):
+        async def big(request):
+            return web.json_response({"value": "x" * 10000})
+
+        app = web.Application(middlewares=[compression_middleware(CompressionConfig())])
+        app.router.add_get("/big", big)
+        runner, url = await start_server(app)
+        try:
+            async with ClientSession(auto_decompress=False) as session:
+                async with session.get(url + "/big", headers={"Accept-Encoding": "identity"}) as resp:
+                    assert "Content-Encoding" not in resp.headers
+                async with session.get(url + "/big", headers={"Accept-Encoding": "gzip"}) as resp:
+                    assert resp.headers["Content-Encoding"] == "gzip"
+                    assert len(await resp.read()) < 10000
+        finally:
+            await runner.cleanup()
+
+    def test_negotiate(self):
+        config = CompressionConfig(encoding="gzip")
+        assert config.negotiate("gzip, deflate") == "gzip"
+        assert config.negotiate("deflate") == "deflate"
+        assert config.negotiate("gzip;q=0, deflate") == "deflate"
+        assert config.negotiate("*") == "gzip"
+        assert config.negotiate("br") is None
+        assert config.negotiate("") is None
@@ -0,0 +1,110 @@
+import asyncio
+import pytest
+
+from papiea.client import EntityCRUD
+from papiea.conflicts import ConflictPolicy, ContentionStats
+from papiea.core import AttributeDict
+from papiea.python_sdk_exceptions import ConflictingEntityException
+from papiea.retry import RetryBudget
+
+from e2e_tests.local_engine import PREFIX, VERSION, LocalEngine
+
+FAST = dict(backoff_base=0.001, backoff_max=0.005)
+
+
+def puts(engine: LocalEngine) -> int:
+    return len([request for request in engine.requests if request[0] == "PUT"])
+
+
+class TestUpdateWith:
+    @pytest.mark.asyncio
+    async def test_concurrent_writers_all_apply(self):
+        engine = await LocalEngine().start()
+        entity = engine.add({"count": 0})
+        client = EntityCRUD(engine.url, PREFIX, VERSION, engine.kind)
+        stats = ContentionStats()
+
+        def increment(current):
+            current.spec.count += 1
+
+        try:
+            ref = AttributeDict(uuid=entity["metadata"]["uuid"])
+            policy = ConflictPolicy(max_attempts=50, **FAST)
+            await asyncio.gather(*[client.update_with(ref, increment, policy, stats) for _ in range(10)])
+            assert engine.entities[ref.uuid]["spec"]["count"] == 10
+            assert engine.entities[ref.uuid]["metadata"]["spec_version"] == 11
+            assert stats.updates == 10
+            assert stats.conflicts == puts(engine) - 10
+            assert stats.exhausted == 0
+        finally:
+            await client.api_instance.close()
+            await engine.stop()
+
+    @pytest.mark.asyncio
+    async def test_gives_up_after_max_attempts(self):
+        engine = await LocalEngine().start()
+        entity = engine.add({"count": 0})
+        uuid = entity["metadata"]["uuid"]
+        client = EntityCRUD(engine.url, PREFIX, VERSION, engine.kind)
+        stats = ContentionStats()
+
+        def increment_behind_another_writer(current):
+            # Another writer always gets in between the read and the write
+            engine.entities[uuid]["metadata"]["spec_version"] += 1
+            current.spec.count += 1
+
+        try:
+            with pytest.raises(ConflictingEntityException):
+                await client.update_with(
+                    AttributeDict(uuid=uuid), increment_behind_another_writer, ConflictPolicy(max_attempts=3, **FAST), stats
+                )
+            assert puts(engine) == 3
+            assert engine.entities[uuid]["spec"]["count"] == 0
+            assert stats.conflicts == 3
+            assert stats.exhausted == 1
+            assert stats.hot_spots()[0]["uuid"] == uuid
+        finally:
+            await client.api_instance.close()
+            await engine.stop()
+
+    @pytest.mark.asyncio
+    async def test_shared_budget_caps_retries(self):
+        engine = await LocalEngine().start()
+        entity = engine.add({"count": 0})
+        uuid = entity["metadata"]["uuid"]
+        client = EntityCRUD(engine.url, PREFIX, VERSION, engine.kind)
+
+        def increment_behind_another_writer(current):
+            engine.entities[uuid]["metadata"]["spec_version"] += 1
+            current.spec.count += 1
+
+        try:
+            budget = RetryBudget(min_retries_per_sec=0, max_tokens=2)
+            policy = ConflictPolicy(max_attempts=10, budget=budget, **FAST)
+            with pytest.raises(ConflictingEntityException):
+                await client.update_with(AttributeDict(uuid=uuid), increment_behind_another_writer, policy, ContentionStats())
+            # The first attempt and the two retries the budget allowed
+            assert puts(engine) == 3
+        finally:
+            await client.api_instance.close()
+            await engine.stop()
+
+    @pytest.mark.asyncio
+    async def test_unchanged_spec_and_known_entity(self):
+        engine = await LocalEngine().start()
+        entity = engine.add({"count": 0})
+        client = EntityCRUD(engine.url, PREFIX, VERSION, engine.kind)
+        try:
+            res = await client.update_with(AttributeDict(uuid=entity["metadata"]["uuid"]), lambda current: None)
+            assert res.watcher is None
+            assert puts(engine) == 0
+            # A full entity saves the first read
+            known = await client.get(AttributeDict(uuid=entity["metadata"]["uuid"]))
+            requests = len(engine.requests)
+            res = await client.update_with(known, lambda current: {"count": 5})
+            assert len(engine.requests) == requests + 1
+            assert res.metadata.spec_version == 2
+            assert res.watcher is not None
+        finally:
+            await client.api_instance.close()
+            await engine.stop()
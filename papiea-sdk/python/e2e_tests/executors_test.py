@@ -0,0 +1,97 @@
+import asyncio
+import os
+import pytest
+
+from multidict import CIMultiDict
+
+from papiea.executors import ExecutionMode, HandlerPools, check_handler, execute
+
+
+class FakeCtx(object):
+    provider_prefix = "test_provider"
+    provider_version = "0.1.0"
+
+    def __init__(self):
+        self.headers = CIMultiDict()
+        self.statuses = []
+
+    def remaining_time(self):
+        return None
+
+    async def update_status(self, entity_reference, status):
+        self.statuses.append((entity_reference["uuid"], status))
+
+
+# Module level so that worker processes can load them
+def update_and_fail(ctx, entity_reference):
+    ctx.update_status(entity_reference, {"state": "half done"})
+    raise ValueError("failed after the update")
+
+
+async def update_and_fail_async(ctx, entity_reference):
+    await ctx.update_status(entity_reference, {"state": "half done"})
+    raise ValueError("failed after the update")
+
+
+def update_and_return_pid(ctx, entity_reference):
+    ctx.update_status(entity_reference, {"state": "done"})
+    return os.getpid()
+
+
+class TestExecute:
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("mode,handler", [
+        (ExecutionMode.Loop, update_and_fail_async),
+        (ExecutionMode.Thread, update_and_fail),
+        (ExecutionMode.Process, update_and_fail),
+    ])
+    async def test_status_update_before_failure_is_kept(self, mode, handler):
+        pools = HandlerPools(thread_workers=1, process_workers=1)
+        ctx = FakeCtx()
+        try:
+            with pytest.raises(ValueError):
+                await execute(handler, ctx, ({"uuid": "u1"},), mode, pools)
+            assert ctx.statuses == [("u1", {"state": "half done"})]
+        finally:
+            pools.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_process_mode_runs_elsewhere(self):
+        pools = HandlerPools(process_workers=1)
+        ctx = FakeCtx()
+        try:
+            pid = await execute(update_and_return_pid, ctx, ({"uuid": "u1"},), ExecutionMode.Process, pools)
+            assert pid != os.getpid()
+            assert ctx.statuses == [("u1", {"state": "done"})]
+        finally:
+            pools.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_thread_mode_does_not_block_loop(self):
+        pools = HandlerPools(thread_workers=2)
+
+        def blocking(ctx):
+            import time
+            time.sleep(0.2)
+            return "slept"
+
+        try:
+            start = asyncio.get_running_loop().time()
+            results = await asyncio.gather(
+                execute(blocking, FakeCtx(), (), ExecutionMode.Thread, pools),
+                execute(blocking, FakeCtx(), (), ExecutionMode.Thread, pools),
+            )
+            assert results == ["slept", "slept"]
+            assert asyncio.get_running_loop().time() - start < 0.35
+        finally:
+            pools.shutdown()
+
+    def test_check_handler(self):
+        async def coroutine_handler(ctx):
+            pass
+
+        check_handler(coroutine_handler, ExecutionMode.Loop)
+        with pytest.raises(Exception):
+            check_handler(coroutine_handler, ExecutionMode.Thread)
+        with pytest.raises(Exception):
+            check_handler(update_and_fail, "elsewhere")
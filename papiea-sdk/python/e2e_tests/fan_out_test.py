@@ -0,0 +1,76 @@
+import pytest
+
+from papiea.client import EntityCRUD
+
+from e2e_tests.local_engine import PREFIX, VERSION, LocalEngine
+
+
+async def engine_with(count: int) -> LocalEngine:
+    engine = await LocalEngine().start()
+    for i in range(count):
+        engine.add({"i": i, "even": i % 2 == 0})
+    return engine
+
+
+class TestIterAll:
+    @pytest.mark.asyncio
+    async def test_all_pages_in_order(self):
+        engine = await engine_with(250)
+        engine.delay = 0.02
+        client = EntityCRUD(engine.url, PREFIX, VERSION, engine.kind)
+        try:
+            entities = [e async for e in client.iter_all(page_size=30, parallelism=3)]
+            assert [e.spec.i for e in entities] == list(range(250))
+            assert len(engine.requests) == 9
+            assert engine.peak_in_flight == 3
+        finally:
+            await client.api_instance.close()
+            await engine.stop()
+
+    @pytest.mark.asyncio
+    async def test_unordered_and_filtered(self):
+        engine = await engine_with(250)
+        client = EntityCRUD(engine.url, PREFIX, VERSION, engine.kind)
+        try:
+            entities = [e async for e in client.iter_all(page_size=30, ordered=False)]
+            assert sorted(e.spec.i for e in entities) == list(range(250))
+            entities = [e async for e in client.iter_all({"spec": {"even": True}}, page_size=30)]
+            assert [e.spec.i for e in entities] == list(range(0, 250, 2))
+            assert all(request[1].split("?")[0].endswith("/filter") for request in engine.requests[-5:])
+        finally:
+            await client.api_instance.close()
+            await engine.stop()
+
+    @pytest.mark.asyncio
+    async def test_get_all(self):
+        engine = await engine_with(100)
+        client = EntityCRUD(engine.url, PREFIX, VERSION, engine.kind)
+        try:
+            # The engine's first page only, unless all pages are asked for
+            assert len(await client.get_all()) == 30
+            entities = await client.get_all(all_pages=True, page_size=40)
+            assert [e.spec.i for e in entities] == list(range(100))
+            # Exactly a page, no request past the end
+            requests = len(engine.requests)
+            assert len(await client.get_all(all_pages=True, page_size=50)) == 100
+            assert len(engine.requests) - requests == 2
+        finally:
+            await client.api_instance.close()
+            await engine.stop()
+
+    @pytest.mark.asyncio
+    async def test_early_exit_cancels_pages(self):
+        engine = await engine_with(300)
+        engine.delay = 0.05
+        client = EntityCRUD(engine.url, PREFIX, VERSION, engine.kind)
+        try:
+            entities = client.iter_all(page_size=10, parallelism=2)
+            async for entity in entities:
+                if entity.spec.i == 5:
+                    break
+            await entities.aclose()
+            # The first page and at most the pages that were running
+            assert len(engine.requests) <= 1 + 2
+        finally:
+            await client.api_instance.close()
+            await engine.stop()
@@ -0,0 +1,79 @@
+import asyncio
+import pytest
+
+from papiea.client import IntentWatcherClient
+from papiea.core import AttributeDict, IntentfulStatus
+from papiea.python_sdk_exceptions import IntentWatcherStatusException, IntentWatcherTimeoutException
+
+from e2e_tests.local_engine import LocalEngine
+
+
+def watcher_requests(engine: LocalEngine, kind: str) -> int:
+    filters = [request for request in engine.requests if request[1].startswith("/services/intent_watcher/filter")]
+    return len(filters) if kind == "filter" else len(engine.requests) - len(filters)
+
+
+async def settle(engine: LocalEngine, watchers: list, status: str) -> None:
+    await asyncio.sleep(0.05)
+    for watcher in watchers:
+        engine.watchers[watcher["uuid"]]["status"] = status
+
+
+class TestIntentWatcherWaiter:
+    @pytest.mark.asyncio
+    async def test_few_watchers_are_read_by_uuid(self):
+        engine = await LocalEngine().start()
+        # Many watchers in progress elsewhere on the engine
+        for i in range(500):
+            engine.add_watcher(f"other-{i}")
+        watchers = [engine.add_watcher("mine") for _ in range(3)]
+        client = IntentWatcherClient(engine.url)
+        client.waiter.min_interval = 0.01
+        try:
+            settling = asyncio.ensure_future(settle(engine, watchers, IntentfulStatus.Completed_Successfully))
+            res = await client.wait_all([AttributeDict(uuid=w["uuid"]) for w in watchers], timeout_secs=5)
+            await settling
+            assert [w.status for w in res] == [IntentfulStatus.Completed_Successfully] * 3
+            assert watcher_requests(engine, "filter") == 0
+            assert client.waiter.stats.get_requests == watcher_requests(engine, "get")
+        finally:
+            await client.waiter.close()
+            await client.api_instance.close()
+            await engine.stop()
+
+    @pytest.mark.asyncio
+    async def test_many_watchers_share_the_filter(self):
+        engine = await LocalEngine().start()
+        watchers = [engine.add_watcher("mine") for _ in range(50)]
+        client = IntentWatcherClient(engine.url)
+        client.waiter.min_interval = 0.01
+        client.waiter.filter_threshold = 10
+        try:
+            settling = asyncio.ensure_future(settle(engine, watchers[:40], IntentfulStatus.Completed_Successfully))
+            failing = asyncio.ensure_future(settle(engine, watchers[40:], IntentfulStatus.Failed))
+            futures = [client.wait(AttributeDict(uuid=w["uuid"]), timeout_secs=5) for w in watchers]
+            results = await asyncio.gather(*futures, return_exceptions=True)
+            await asyncio.gather(settling, failing)
+            assert all(res.status == IntentfulStatus.Completed_Successfully for res in results[:40])
+            assert all(isinstance(res, IntentWatcherStatusException) for res in results[40:])
+            assert watcher_requests(engine, "filter") > 0
+            # Only watchers which left the in progress set are read by uuid
+            assert watcher_requests(engine, "get") <= len(watchers)
+        finally:
+            await client.waiter.close()
+            await client.api_instance.close()
+            await engine.stop()
+
+    @pytest.mark.asyncio
+    async def test_timeout(self):
+        engine = await LocalEngine().start()
+        watcher = engine.add_watcher("mine")
+        client = IntentWatcherClient(engine.url)
+        try:
+            with pytest.raises(IntentWatcherTimeoutException):
+                await client.wait(AttributeDict(uuid=watcher["uuid"]), timeout_secs=0.1)
+            assert len(client.waiter) == 0
+        finally:
+            await client.waiter.close()
+            await client.api_instance.close()
+            await engine.stop()
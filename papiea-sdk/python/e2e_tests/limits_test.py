@@ -0,0 +1,85 @@
+import asyncio
+import pytest
+import random
+
+from papiea.limits import AIMDLimiter, ConcurrencyLimiter, TokenBucket
+from papiea.python_sdk_exceptions import ConcurrencyLimitException
+
+
+def mixed_latency(rng: random.Random, slow_ratio: float) -> float:
+    # Fast GETs next to filters ten times slower, all healthy
+    return 0.02 if rng.random() < slow_ratio else 0.002
+
+
+class TestAIMDLimiter:
+    @pytest.mark.asyncio
+    async def test_sequential_mixed_latencies_keep_limit(self):
+        rng = random.Random(1)
+        for slow_ratio in (0.1, 0.5, 0.9):
+            limiter = AIMDLimiter(initial_limit=50)
+            for _ in range(3000):
+                await limiter.acquire()
+                limiter.release(mixed_latency(rng, slow_ratio))
+            assert limiter.limit == 50
+
+    @pytest.mark.asyncio
+    async def test_concurrent_mixed_latencies_do_not_shrink_limit(self):
+        rng = random.Random(2)
+        limiter = AIMDLimiter(initial_limit=20)
+        for _ in range(200):
+            for _ in range(20):
+                await limiter.acquire()
+            for _ in range(20):
+                limiter.release(mixed_latency(rng, 0.3))
+        assert limiter.limit >= 20
+
+    @pytest.mark.asyncio
+    async def test_latency_rise_shrinks_limit(self):
+        limiter = AIMDLimiter(initial_limit=20)
+        for _ in range(500):
+            await limiter.acquire()
+            limiter.release(0.002)
+        for _ in range(100):
+            await limiter.acquire()
+            limiter.release(0.05)
+        assert limiter.limit < 20
+
+    @pytest.mark.asyncio
+    async def test_failures_shrink_limit(self):
+        limiter = AIMDLimiter(initial_limit=20)
+        await limiter.acquire()
+        limiter.release(0.002, failed=True)
+        assert limiter.limit == 10
+
+    @pytest.mark.asyncio
+    async def test_explicit_threshold(self):
+        limiter = AIMDLimiter(initial_limit=20, latency_threshold=0.01)
+        await limiter.acquire()
+        limiter.release(0.005)
+        assert limiter.limit == 20
+        await limiter.acquire()
+        limiter.release(0.02)
+        assert limiter.limit == 10
+
+
+class TestConcurrencyLimiter:
+    @pytest.mark.asyncio
+    async def test_queue_full_is_rejected(self):
+        limiter = ConcurrencyLimiter(limit=1, max_queue=1, max_wait=1)
+        await limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(ConcurrencyLimitException):
+            await limiter.acquire()
+        limiter.release()
+        await waiter
+        assert limiter.in_flight == 1
+        limiter.release()
+        assert limiter.in_flight == 0
+
+    @pytest.mark.asyncio
+    async def test_token_bucket_rejects_past_max_wait(self):
+        bucket = TokenBucket(rate=10, burst=1, max_wait=0.05)
+        await bucket.acquire()
+        with pytest.raises(ConcurrencyLimitException):
+            await bucket.acquire()
@@ -0,0 +1,183 @@
+import asyncio
+import datetime
+import json
+import uuid as uuid_lib
+
+from aiohttp import web
+
+# Small in-memory stand-in for the entity and intent watcher endpoints
+# of the engine, for tests of the client side which need no engine
+
+PREFIX = "test_provider"
+VERSION = "0.1.0"
+
+
+async def start_server(app: web.Application):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def error_response(status: int, error_type: str, message: str) -> web.Response:
+    return web.json_response({"error": {"type": error_type, "message": message, "errors": []}}, status=status)
+
+
+def resolve(doc, path):
+    for key in path:
+        if not isinstance(doc, dict) or key not in doc:
+            return None
+        doc = doc[key]
+    return doc
+
+
+def flatten(value: dict, prefix: tuple, conditions: list) -> None:
+    for key, item in value.items():
+        path = prefix + tuple(key.split("."))
+        if isinstance(item, dict) and not any(k.startswith("$") for k in item):
+            flatten(item, path, conditions)
+        else:
+            conditions.append((path, item))
+
+
+def matches(entity: dict, filter_obj: dict) -> bool:
+    conditions = []
+    for key, cond in (filter_obj.get("metadata") or {}).items():
+        conditions.append((("metadata",) + tuple(key.split(".")), cond))
+    for part in ("spec", "status"):
+        flatten(filter_obj.get(part) or {}, (part,), conditions)
+    for path, cond in conditions:
+        value = resolve(entity, path)
+        if isinstance(cond, dict) and "$in" in cond:
+            if value not in cond["$in"]:
+                return False
+        elif value != cond and not (isinstance(value, list) and cond in value):
+            return False
+    return True
+
+
+class LocalEngine(object):
+    def __init__(self, kind: str = "bucket", version: str = VERSION):
+        self.kind = kind
+        self.version = version
+        self.entities = {}
+        self.deleted = {}
+        self.watchers = {}
+        # (method, path with query, body) of every request
+        self.requests = []
+        # Seconds to hold entity responses after the request took effect
+        self.delay = 0.0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._clock = datetime.datetime(2020, 1, 1)
+        self.app = web.Application()
+        self.app.router.add_route("*", "/services/intent_watcher/{tail:.*}", self.handle_watcher)
+        self.app.router.add_route("*", f"/services/{PREFIX}/{version}/{kind}{{tail:.*}}", self.handle_entity)
+        self.runner = None
+        self.url = None
+
+    async def start(self) -> "LocalEngine":
+        self.runner, self.url = await start_server(self.app)
+        return self
+
+    async def stop(self) -> None:
+        await self.runner.cleanup()
+
+    def now(self) -> str:
+        # Distinct and increasing, like the engine's timestamps in practice
+        self._clock += datetime.timedelta(milliseconds=1)
+        return self._clock.isoformat() + "Z"
+
+    def add(self, spec: dict, status: dict = None, uuid: str = None) -> dict:
+        uuid = uuid or str(uuid_lib.uuid4())
+        entity = {
+            "metadata": {"uuid": uuid, "kind": self.kind, "spec_version": 1, "created_at": self.now()},
+            "spec": spec,
+            "status": status if status is not None else spec,
+        }
+        self.entities[uuid] = entity
+        return entity
+
+    def remove(self, uuid: str) -> dict:
+        entity = self.entities.pop(uuid)
+        entity["metadata"]["deleted_at"] = self.now()
+        self.deleted[uuid] = entity
+        return entity
+
+    def page(self, entities: list, query) -> web.Response:
+        for field_query in reversed((query.get("sort") or "").split(",")):
+            if not field_query:
+                continue
+            field, _, order = field_query.partition(":")
+            entities.sort(key=lambda e: resolve(e, tuple(field.split("."))) or "", reverse=order == "desc")
+        offset = int(query.get("offset") or 0)
+        limit = int(query.get("limit") or 30)
+        return web.json_response({"results": entities[offset:offset + limit], "entity_count": len(entities)})
+
+    async def handle_entity(self, request: web.Request) -> web.Response:
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            response = await self.entity_response(request)
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            return response
+        finally:
+            self.in_flight -= 1
+
+    async def entity_response(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        self.requests.append((request.method, request.path_qs, body))
+        data = json.loads(body) if body else {}
+        tail = request.match_info["tail"].strip("/")
+        if tail == "filter":
+            source = self.deleted if request.query.get("deleted") == "true" else self.entities
+            return self.page([e for e in source.values() if matches(e, data)], request.query)
+        if not tail:
+            if request.method == "GET":
+                return self.page(list(self.entities.values()), request.query)
+            uuid = (data.get("metadata") or {}).get("uuid")
+            if uuid in self.entities:
+                return error_response(409, "conflicting_entity_error", f"Entity {uuid} already exists")
+            entity = self.add(data["spec"], {}, uuid)
+            return web.json_response({"metadata": entity["metadata"], "spec": entity["spec"]})
+        entity = self.entities.get(tail)
+        if entity is None:
+            return error_response(404, "entity_not_found_error", f"Entity {tail} not found")
+        if request.method == "GET":
+            return web.json_response(entity)
+        if request.method == "DELETE":
+            self.remove(tail)
+            return web.Response(status=200)
+        if request.method == "PUT":
+            if data["metadata"]["spec_version"] != entity["metadata"]["spec_version"]:
+                return error_response(409, "conflicting_entity_error", "Spec version mismatch")
+            entity["metadata"]["spec_version"] += 1
+            entity["spec"] = data["spec"]
+            watcher = self.add_watcher(tail)
+            return web.json_response({"watcher": {"uuid": watcher["uuid"], "kind": "IntentWatcher"}})
+        return web.Response(status=405)
+
+    def add_watcher(self, entity_uuid: str, status: str = "Pending") -> dict:
+        watcher = {"uuid": str(uuid_lib.uuid4()), "entity_ref": {"uuid": entity_uuid}, "status": status}
+        self.watchers[watcher["uuid"]] = watcher
+        return watcher
+
+    async def handle_watcher(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        self.requests.append((request.method, request.path_qs, body))
+        tail = request.match_info["tail"].strip("/")
+        if tail == "filter":
+            data = json.loads(body) if body else {}
+            statuses = (data.get("status") or {}).get("$in")
+            watchers = [w for w in self.watchers.values() if statuses is None or w["status"] in statuses]
+            watchers.sort(key=lambda w: w["uuid"])
+            offset = int(request.query.get("offset") or 0)
+            limit = int(request.query.get("limit") or 30)
+            return web.json_response({"results": watchers[offset:offset + limit], "entity_count": len(watchers)})
+        watcher = self.watchers.get(tail)
+        if watcher is None:
+            return error_response(404, "entity_not_found_error", f"Intent watcher {tail} not found")
+        return web.json_response(watcher)
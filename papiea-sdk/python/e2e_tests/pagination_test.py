@@ -0,0 +1,118 @@
+import asyncio
+import pytest
+
+from papiea.client import EntityCRUD
+from papiea.core import AttributeDict
+from papiea.pagination import PageSizer, Paginator
+
+from e2e_tests.local_engine import PREFIX, VERSION, LocalEngine
+
+
+def page_source(total: int, latency: float = 0.0, entity_bytes: int = 100):
+    # fetch_page over range(total), recording the (limit, offset) asked
+    requests = []
+
+    async def fetch_page(limit, offset):
+        requests.append((limit, offset))
+        if latency:
+            await asyncio.sleep(latency)
+        results = list(range(offset, min(offset + limit, total)))
+        return AttributeDict(results=results, entity_count=total), len(results) * entity_bytes
+
+    return fetch_page, requests
+
+
+class TestPageSizer:
+    def test_grows_when_fast(self):
+        sizer = PageSizer(initial_size=20, max_size=1000, target_latency=0.2)
+        sizer.observe(20, 2000, 0.01)
+        assert sizer.size == 40
+        for _ in range(10):
+            sizer.observe(sizer.size, sizer.size * 100, 0.01)
+        assert sizer.size == 1000
+
+    def test_shrinks_when_slow(self):
+        sizer = PageSizer(initial_size=400, min_size=10, target_latency=0.2)
+        sizer.observe(400, 40000, 0.8)
+        assert sizer.size == 100
+        sizer.observe(100, 10000, 100)
+        assert sizer.size == 10
+        # Between half and the whole target nothing changes
+        sizer.observe(10, 1000, 0.15)
+        assert sizer.size == 10
+
+    def test_capped_by_page_bytes(self):
+        sizer = PageSizer(initial_size=100, max_size=10000, max_page_bytes=100 * 1000)
+        sizer.observe(100, 100 * 1000, 0.001)
+        assert sizer.size == 100
+        sizer.observe(0, 0, 0.001)
+        assert sizer.size == 100
+
+
+class TestPaginator:
+    @pytest.mark.asyncio
+    async def test_adaptive_pages_cover_everything_once(self):
+        fetch_page, requests = page_source(1000)
+        paginator = Paginator(fetch_page, sizer=PageSizer(initial_size=10, max_size=200))
+        items = [item async for item in paginator]
+        assert items == list(range(1000))
+        limits = [limit for limit, _ in requests]
+        assert limits[:3] == [10, 20, 40]
+        assert max(limits) == 200
+        # Offsets follow each other without gaps or overlaps
+        offsets = [offset for _, offset in requests]
+        assert offsets == [sum(limits[:i]) for i in range(len(limits))]
+        assert paginator.progress.entities == 1000
+        assert paginator.progress.total == 1000
+
+    @pytest.mark.asyncio
+    async def test_fixed_page_size(self):
+        fetch_page, requests = page_source(95)
+        paginator = Paginator(fetch_page, page_size=10, offset=5, prefetch=3)
+        items = [item async for item in paginator]
+        assert items == list(range(5, 95))
+        assert {limit for limit, _ in requests} == {10}
+        # At most prefetch pages past the last one were read ahead
+        assert len(requests) <= 9 + 3
+
+    @pytest.mark.asyncio
+    async def test_slow_pages_shrink(self):
+        fetch_page, requests = page_source(300, latency=0.05)
+        sizer = PageSizer(initial_size=100, min_size=10, target_latency=0.02)
+        items = [item async for item in Paginator(fetch_page, sizer=sizer)]
+        assert items == list(range(300))
+        assert requests[1][0] < 100
+
+    @pytest.mark.asyncio
+    async def test_early_exit_cancels_read_ahead(self):
+        fetch_page, requests = page_source(1000, latency=0.01)
+        items = Paginator(fetch_page, page_size=10, prefetch=4).iterate()
+        async for item in items:
+            if item == 15:
+                break
+        await items.aclose()
+        fetched = len(requests)
+        assert fetched <= 2 + 4
+        await asyncio.sleep(0.05)
+        assert len(requests) == fetched
+
+
+class TestEntityPagination:
+    @pytest.mark.asyncio
+    async def test_paginate_filter(self):
+        engine = await LocalEngine().start()
+        for i in range(250):
+            engine.add({"name": "even" if i % 2 == 0 else "odd", "i": i})
+        client = EntityCRUD(engine.url, PREFIX, VERSION, engine.kind)
+        progress = []
+        try:
+            paginator = client.paginate({"spec": {"name": "even"}}, on_progress=lambda p: progress.append(p.to_dict()))
+            entities = [entity async for entity in paginator]
+            assert [entity.spec.i for entity in entities] == list(range(0, 250, 2))
+            assert progress[-1]["entities"] == 125
+            assert progress[-1]["total"] == 125
+            iterate = await client.filter_iter({"spec": {"name": "odd"}})
+            assert len([entity async for entity in iterate(batch_size=7)]) == 125
+        finally:
+            await client.api_instance.close()
+            await engine.stop()
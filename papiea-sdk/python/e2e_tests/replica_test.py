@@ -0,0 +1,116 @@
+import asyncio
+import pytest
+
+from papiea.client import EntityCRUD
+from papiea.replica import UnsupportedFilter, compile_filter, matches
+
+from e2e_tests.local_engine import PREFIX, VERSION, LocalEngine
+
+ENTITY = {
+    "metadata": {"uuid": "u1", "spec_version": 2, "extension": {"owner": "alice"}},
+    "spec": {
+        "name": "a",
+        "tags": ["x", "y"],
+        "objects": [{"name": "o1", "size": 1}, {"name": "o2", "size": 2}],
+        "location": {"region": "eu", "zone": {"id": 3}},
+        "flag": True,
+    },
+}
+
+
+def check(filter_obj, exact: bool = False) -> bool:
+    return matches(ENTITY, compile_filter(filter_obj, exact))
+
+
+class TestReplicaFilters:
+    def test_nested_fields(self):
+        assert check({"spec": {"location": {"region": "eu"}}})
+        assert check({"spec": {"location": {"zone": {"id": 3}}}})
+        assert check({"spec": {"location.zone.id": 3}})
+        assert not check({"spec": {"location": {"zone": {"id": 4}}}})
+        # Exact filters compare the whole spec
+        assert not check({"spec": {"location": {"region": "eu"}}}, exact=True)
+
+    def test_arrays(self):
+        assert check({"spec": {"tags": "x"}})
+        assert check({"spec": {"tags": ["x", "y"]}})
+        assert not check({"spec": {"tags": ["y", "x"]}})
+        assert check({"spec": {"objects": {"name": "o2"}}})
+        assert check({"spec": {"objects.size": {"$gt": 1}}})
+        assert not check({"spec": {"objects.size": {"$gt": 2}}})
+
+    def test_operators(self):
+        assert check({"spec": {"name": {"$in": ["a", "b"]}}})
+        assert not check({"spec": {"name": {"$nin": ["a", "b"]}}})
+        assert check({"spec": {"tags": {"$in": ["z", "y"]}}})
+        assert check({"metadata": {"uuid": {"$in": ["u1", "u2"]}}})
+        assert check({"spec": {"name": {"$ne": "b"}, "missing": {"$exists": False}}})
+        assert check({"spec": {"missing": None}})
+        # True is not 1
+        assert not check({"spec": {"flag": 1}})
+        assert check({"metadata": {"extension": {"owner": "alice"}}})
+        assert not check({"metadata": {"extension": {"owner": "alice", "team": "b"}}})
+
+    def test_unsupported(self):
+        for filter_obj in (
+            {"spec": {"name": {"$regex": "a"}}},
+            {"spec": {"$or": []}},
+            {"spec": {"name": {"$in": "a"}}},
+            {"metadata": {"deleted_at": "x"}},
+        ):
+            with pytest.raises(UnsupportedFilter):
+                compile_filter(filter_obj)
+
+
+class TestEntityReplica:
+    @pytest.mark.asyncio
+    async def test_index_narrowing(self):
+        engine = await LocalEngine().start()
+        for i in range(100):
+            engine.add({"name": f"b{i % 10}", "size": i})
+        client = EntityCRUD(engine.url, PREFIX, VERSION, engine.kind)
+        replica = client.replica(["spec.name"], full_sync_interval=60)
+        try:
+            async with replica:
+                requests = len(engine.requests)
+                res = await replica.filter({"spec": {"name": "b3"}})
+                assert res.entity_count == 10
+                assert all(entity.spec.name == "b3" for entity in res.results)
+                res = await replica.filter({"spec": {"name": {"$in": ["b1", "b2"]}, "size": {"$lt": 50}}})
+                assert sorted(entity.spec.size for entity in res.results) == [1, 2, 11, 12, 21, 22, 31, 32, 41, 42]
+                # Not indexed, scans every entity
+                res = await replica.filter({"spec": {"size": 7}})
+                assert res.entity_count == 1
+                assert replica.stats.index_queries == 2
+                assert replica.stats.local_queries == 3
+                assert len(engine.requests) == requests
+        finally:
+            await client.api_instance.close()
+            await engine.stop()
+
+    @pytest.mark.asyncio
+    async def test_reset_stats_while_running(self):
+        engine = await LocalEngine().start()
+        for i in range(5):
+            engine.add({"name": f"b{i}"})
+        client = EntityCRUD(engine.url, PREFIX, VERSION, engine.kind)
+        replica = client.replica(full_sync_interval=0.05, min_interval=0.01, max_interval=0.02)
+        try:
+            async with replica:
+                replica.stats.reset()
+                assert replica.ready
+                engine.add({"name": "late"})
+                for _ in range(100):
+                    await asyncio.sleep(0.02)
+                    if len(replica) == 6 and replica.stats.full_syncs > 0:
+                        break
+                assert len(replica) == 6
+                assert replica.stats.full_syncs > 0
+                assert replica.stats.errors == 0
+                res = await replica.filter({"spec": {"name": "late"}})
+                assert res.entity_count == 1
+                assert replica.stats.remote_queries == 0
+                assert replica.snapshot()["lag"] is not None
+        finally:
+            await client.api_instance.close()
+            await engine.stop()
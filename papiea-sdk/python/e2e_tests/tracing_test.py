@@ -0,0 +1,95 @@
+import logging
+import pytest
+
+from aiohttp import web
+from multidict import CIMultiDict
+
+from papiea import tracing
+from papiea.api import ApiInstance
+from papiea.core import Action, AttributeDict
+from papiea.python_sdk_context import ProceduralCtx
+from papiea.tracing import InMemorySpanExporter, SpanContext
+
+from e2e_tests.local_engine import PREFIX, VERSION, start_server
+
+logger = logging.getLogger(__name__)
+
+ENGINE_TRACEPARENT = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+
+
+class FakeProvider(object):
+    def __init__(self, url: str):
+        self.papiea_url = url
+        self.provider_url = f"{url}/provider"
+        self.entity_url = f"{url}/services"
+        self.provider_api = ApiInstance(self.provider_url, logger=logger)
+        self.logger = logger
+
+
+async def recording_engine():
+    headers = []
+
+    async def handle(request):
+        headers.append(request.headers.copy())
+        if request.path.endswith("/check_permission"):
+            return web.json_response({"success": "Ok"})
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_route("*", "/{tail:.*}", handle)
+    runner, url = await start_server(app)
+    return runner, url, headers
+
+
+class TestTracePropagation:
+    @pytest.mark.asyncio
+    async def test_check_permission_untraced(self):
+        runner, url, headers = await recording_engine()
+        provider = FakeProvider(url)
+        ctx = ProceduralCtx(provider, PREFIX, VERSION, CIMultiDict(Authorization="Bearer token"))
+        try:
+            assert not tracing.is_active()
+            assert await ctx.check_permission([(Action.Read, AttributeDict(uuid="u1", kind="bucket"))])
+            assert "traceparent" not in headers[-1]
+        finally:
+            await provider.provider_api.close()
+            await runner.cleanup()
+
+    @pytest.mark.asyncio
+    async def test_check_permission_continues_the_callback_trace(self):
+        runner, url, headers = await recording_engine()
+        provider = FakeProvider(url)
+        ctx = ProceduralCtx(
+            provider, PREFIX, VERSION, CIMultiDict(Authorization="Bearer token", traceparent=ENGINE_TRACEPARENT)
+        )
+        exporter = tracing.add_exporter(InMemorySpanExporter())
+        try:
+            with tracing.start_span("callback", kind="server", parent=ctx.trace_context) as callback:
+                assert await ctx.check_permission([(Action.Read, AttributeDict(uuid="u1", kind="bucket"))])
+            sent = SpanContext.from_headers(headers[-1])
+            assert sent.trace_id == "0af7651916cd43dd8448eb211c80319c"
+            check = next(span for span in exporter.spans if span.name.endswith("check_permission"))
+            assert check.parent_id == callback.context.span_id
+            assert sent.span_id == check.context.span_id
+            assert check.attributes["http.status_code"] == 200
+        finally:
+            tracing.remove_exporter(exporter)
+            await provider.provider_api.close()
+            await runner.cleanup()
+
+    @pytest.mark.asyncio
+    async def test_engine_calls_carry_the_current_trace(self):
+        runner, url, headers = await recording_engine()
+        api = ApiInstance(url, logger=logger)
+        try:
+            await api.post("entity", {})
+            assert "traceparent" not in headers[-1]
+            parent = SpanContext.from_headers({"traceparent": ENGINE_TRACEPARENT})
+            with tracing.start_span("callback", kind="server", parent=parent) as callback:
+                await api.post("entity", {})
+            sent = SpanContext.from_headers(headers[-1])
+            assert sent.trace_id == parent.trace_id
+            assert sent.span_id != callback.context.span_id
+        finally:
+            await api.close()
+            await runner.cleanup()
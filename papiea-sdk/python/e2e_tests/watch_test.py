@@ -0,0 +1,111 @@
+import asyncio
+import json
+import pytest
+
+from papiea.client import EntityCRUD
+from papiea.core import AttributeDict
+from papiea.watch import WatchCursor, WatchEventType
+
+from e2e_tests.local_engine import PREFIX, VERSION, LocalEngine
+
+
+def summary(events) -> list:
+    return sorted((event.type, event.entity.spec.name) for event in events)
+
+
+class TestWatch:
+    @pytest.mark.asyncio
+    async def test_resume_from_saved_cursor(self):
+        engine = await LocalEngine().start()
+        engine.add({"name": "existing"})
+        client = EntityCRUD(engine.url, PREFIX, VERSION, engine.kind)
+        try:
+            watcher = client.watch(page_size=5)
+            events, watcher.cursor = await watcher.poll()
+            assert events == []
+            for i in range(12):
+                engine.add({"name": f"new-{i}"})
+            events, watcher.cursor = await watcher.poll()
+            assert summary(events) == sorted((WatchEventType.Created, f"new-{i}") for i in range(12))
+            # Saved, e.g. to disk, and resumed by another watcher
+            saved = json.dumps(watcher.cursor.to_dict())
+            resumed = client.watch(cursor=WatchCursor.from_dict(json.loads(saved)), page_size=5)
+            events, resumed.cursor = await resumed.poll()
+            assert events == []
+            engine.add({"name": "later"})
+            engine.remove(next(iter(engine.entities)))
+            events, resumed.cursor = await resumed.poll()
+            assert summary(events) == [(WatchEventType.Created, "later"), (WatchEventType.Deleted, "existing")]
+            events, resumed.cursor = await resumed.poll()
+            assert events == []
+        finally:
+            await client.api_instance.close()
+            await engine.stop()
+
+    @pytest.mark.asyncio
+    async def test_entities_sharing_a_timestamp(self):
+        engine = await LocalEngine().start()
+        client = EntityCRUD(engine.url, PREFIX, VERSION, engine.kind)
+        try:
+            watcher = client.watch(initial=True, page_size=2)
+            first = [engine.add({"name": name}) for name in ("a", "b", "c")]
+            for entity in first:
+                entity["metadata"]["created_at"] = first[0]["metadata"]["created_at"]
+            events, watcher.cursor = await watcher.poll()
+            assert summary(events) == [(WatchEventType.Created, name) for name in ("a", "b", "c")]
+            # Created later within the same timestamp
+            late = engine.add({"name": "d"})
+            late["metadata"]["created_at"] = first[0]["metadata"]["created_at"]
+            events, watcher.cursor = await watcher.poll()
+            assert summary(events) == [(WatchEventType.Created, "d")]
+            events, watcher.cursor = await watcher.poll()
+            assert events == []
+        finally:
+            await client.api_instance.close()
+            await engine.stop()
+
+    @pytest.mark.asyncio
+    async def test_updates(self):
+        engine = await LocalEngine().start()
+        entity = engine.add({"name": "a"})
+        client = EntityCRUD(engine.url, PREFIX, VERSION, engine.kind)
+        try:
+            watcher = client.watch(track_updates=True, update_scan_interval=0)
+            events, watcher.cursor = await watcher.poll()
+            assert events == []
+            await client.update(AttributeDict(uuid=entity["metadata"]["uuid"], spec_version=1), {"name": "b"})
+            events, watcher.cursor = await watcher.poll()
+            assert summary(events) == [(WatchEventType.Updated, "b")]
+            events, watcher.cursor = await watcher.poll()
+            assert events == []
+        finally:
+            await client.api_instance.close()
+            await engine.stop()
+
+    @pytest.mark.asyncio
+    async def test_iterate_moves_the_cursor_after_the_batch(self):
+        engine = await LocalEngine().start()
+        client = EntityCRUD(engine.url, PREFIX, VERSION, engine.kind)
+        try:
+            watcher = client.watch(initial=True, min_interval=0.01)
+            for name in ("a", "b"):
+                engine.add({"name": name})
+            events = watcher.iterate()
+            event = await events.__anext__()
+            # Stopped in the middle of the batch, the cursor still points
+            # before it and a resumed watch sees the whole batch again
+            await events.aclose()
+            resumed = client.watch(cursor=watcher.cursor, initial=True)
+            assert len((await resumed.poll())[0]) == 2
+            assert event.entity.spec.name in ("a", "b")
+            events = watcher.iterate()
+            batch = [await events.__anext__(), await events.__anext__()]
+            assert summary(batch) == [(WatchEventType.Created, "a"), (WatchEventType.Created, "b")]
+            # Once the batch was handed out only new entities follow
+            engine.add({"name": "c"})
+            event = await asyncio.wait_for(events.__anext__(), 5)
+            await events.aclose()
+            assert summary([event]) == [(WatchEventType.Created, "c")]
+        finally:
+            await client.api_instance.close()
+            await engine.stop()
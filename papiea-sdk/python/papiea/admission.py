@@ -0,0 +1,110 @@
+import math
+import time
+from typing import Awaitable, Callable, Optional
+
+from aiohttp import web
+
+from .codec import get_codec
+from .limits import ConcurrencyLimiter
+from .metrics import Histogram
+from .python_sdk_exceptions import ConcurrencyLimitException, InvocationError
+from .timeouts import deadline_scope
+
+Handler = Callable[[web.Request], Awaitable[web.Response]]
+
+
+class AdmissionStats(object):
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.admitted = 0
+        self.rejected = 0
+        # Time callbacks spent queued before their handler started
+        self.queue_wait = Histogram()
+        self.service_time = Histogram()
+
+
+class AdmissionControl(object):
+    # Bounds the callbacks the provider works on at once. Callbacks past
+    # max_in_flight wait in a FIFO queue of max_queue entries for at most
+    # max_queue_wait seconds, the rest are answered right away with a 503
+    # and a Retry-After estimated from the queue and the handler times.
+    # Any ConcurrencyLimiter can be passed instead, e.g. an AIMDLimiter.
+    def __init__(
+        self,
+        max_in_flight: int = 100,
+        max_queue: int = 1000,
+        max_queue_wait: Optional[float] = 10.0,
+        min_retry_after: int = 1,
+        max_retry_after: int = 60,
+        limiter: Optional[ConcurrencyLimiter] = None,
+    ):
+        self.limiter = limiter or ConcurrencyLimiter(max_in_flight, max_queue, max_queue_wait)
+        self.min_retry_after = min_retry_after
+        self.max_retry_after = max_retry_after
+        self.stats = AdmissionStats()
+
+    @property
+    def in_flight(self) -> int:
+        return self.limiter.in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        return self.limiter.queue_depth
+
+    def retry_after(self) -> int:
+        # Time for the queue ahead to drain at the current throughput
+        mean = self.stats.service_time.sum / self.stats.service_time.count if self.stats.service_time.count else 0.0
+        estimate = math.ceil(mean * (self.queue_depth + 1) / max(1, self.limiter.limit))
+        return max(self.min_retry_after, min(self.max_retry_after, estimate))
+
+    def reject(self, message: str) -> web.Response:
+        error = InvocationError(503, message, [])
+        return web.Response(
+            body=get_codec().dumps(error.to_response()),
+            status=503,
+            content_type="application/json",
+            headers={"Retry-After": str(self.retry_after())},
+        )
+
+    def wrap(self, handler: Handler, timeout: Optional[float] = None) -> Handler:
+        # timeout is the time budget of the callback, it starts on arrival
+        # so that the time spent queued counts toward it
+        async def admitted(request: web.Request) -> web.Response:
+            with deadline_scope(timeout):
+                return await self._admit(handler, request)
+
+        return admitted
+
+    async def _admit(self, handler: Handler, request: web.Request) -> web.Response:
+        queued_at = time.monotonic()
+        try:
+            await self.limiter.acquire()
+        except ConcurrencyLimitException as e:
+            self.stats.rejected += 1
+            return self.reject(str(e))
+        started = time.monotonic()
+        self.stats.admitted += 1
+        self.stats.queue_wait.observe(started - queued_at)
+        failed = True
+        try:
+            response = await handler(request)
+            # Handler errors come back as 500 responses, not exceptions
+            failed = response.status >= 500
+            return response
+        finally:
+            elapsed = time.monotonic() - started
+            self.stats.service_time.observe(elapsed)
+            self.limiter.release(elapsed, failed)
+
+    def snapshot(self) -> dict:
+        return dict(
+            in_flight=self.in_flight,
+            queue_depth=self.queue_depth,
+            limit=self.limiter.limit,
+            admitted=self.stats.admitted,
+            rejected=self.stats.rejected,
+            queue_wait=self.stats.queue_wait.to_dict(),
+            service_time=self.stats.service_time.to_dict(),
+        )
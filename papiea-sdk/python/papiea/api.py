@@ -1,33 +1,389 @@
-import json
+import asyncio
+import contextvars
 import logging
+import time
 from types import TracebackType
-from typing import Any, Optional, Type
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, Hashable, Optional, Set, Tuple, Type, Union
 
-from aiohttp import ClientSession, ClientTimeout
+from urllib.parse import unquote
+
+from aiohttp import BaseConnector, ClientSession, ClientTimeout, TCPConnector, UnixConnector
 from multidict import CIMultiDict
+from yarl import URL
 
+from papiea.codec import ItemsStreamParser, JsonCodec, get_codec
+from papiea.compression import CompressionConfig
+from papiea import metrics, tracing
+from papiea.limits import ConcurrencyLimiter, TokenBucket
 from papiea.python_sdk_exceptions import (
-    ApiException,
-    PapieaBaseException,
+    CircuitOpenException,
+    ConcurrencyLimitException,
+    DeadlineExceededException,
     check_response,
 )
-from papiea.utils import json_loads_attrs
+from papiea.retry import CircuitBreaker, RetryBudget, RetryPolicy
+from papiea.timeouts import RequestTimeout, remaining_time
+
+
+UNIX_SCHEMES = ("unix://", "http+unix://")
+
+
+def split_unix_url(url: str) -> Optional[Tuple[str, str]]:
+    # unix://<percent encoded socket path>/<http path>, e.g.
+    # unix://%2Fvar%2Frun%2Fpapiea.sock/services
+    for scheme in UNIX_SCHEMES:
+        if url.startswith(scheme):
+            socket_path, _, path = url[len(scheme):].partition("/")
+            return unquote(socket_path), "/" + path if path else ""
+    return None
+
+
+class SingleFlight(object):
+    # Runs at most one call per key at a time, concurrent callers with
+    # the same key wait for the result of the call already in flight
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        # Futures belong to a loop, calls from different loops never share
+        key = (asyncio.get_event_loop(), key)
+        fut = self._calls.get(key)
+        if fut is None:
+            # Started in an empty context, so that the deadline and trace
+            # span of the first caller do not apply to everybody else
+            fut = contextvars.Context().run(asyncio.ensure_future, fn())
+            self._calls[key] = fut
+            fut.add_done_callback(lambda _: self._forget(key, fut))
+        # Shielded so that a cancelled caller does not cancel the call
+        # for everybody else waiting on it, every caller waits only as
+        # long as its own deadline allows
+        remaining = remaining_time()
+        if remaining is None:
+            return await asyncio.shield(fut)
+        if remaining <= 0:
+            raise DeadlineExceededException()
+        try:
+            return await asyncio.wait_for(asyncio.shield(fut), remaining)
+        except asyncio.TimeoutError:
+            if fut.done():
+                raise
+            raise DeadlineExceededException()
+
+    def _forget(self, key: Hashable, fut: asyncio.Future) -> None:
+        if self._calls.get(key) is fut:
+            del self._calls[key]
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+
+class PoolConfig(object):
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 0,
+        keepalive_timeout: float = 30,
+        use_dns_cache: bool = True,
+        ttl_dns_cache: Optional[int] = 10,
+        prewarm: int = 0,
+        breaker_failure_threshold: int = 5,
+        breaker_reset_timeout: float = 10.0,
+        retry_budget_ratio: float = 0.2,
+        retry_budget_min_per_sec: float = 5,
+        retry_policy: Optional[RetryPolicy] = None,
+        compression: Optional[CompressionConfig] = None,
+        limiter_factory: Optional[Callable[[], ConcurrencyLimiter]] = None,
+        rate_limiter_factory: Optional[Callable[[], TokenBucket]] = None,
+    ):
+        # limit and limit_per_host of 0 mean no limit, same as in aiohttp
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.use_dns_cache = use_dns_cache
+        self.ttl_dns_cache = ttl_dns_cache
+        # Number of connections opened in advance by ConnectionPool.prewarm()
+        self.prewarm = prewarm
+        self.breaker_failure_threshold = breaker_failure_threshold
+        self.breaker_reset_timeout = breaker_reset_timeout
+        self.retry_budget_ratio = retry_budget_ratio
+        self.retry_budget_min_per_sec = retry_budget_min_per_sec
+        # Used by clients which are not given a policy of their own
+        self.retry_policy = retry_policy or RetryPolicy()
+        # Request bodies are only compressed when this is set, engine
+        # accepts gzip and deflate encoded bodies
+        self.compression = compression
+        # Factories, so that every engine host gets limiters of its own for
+        # each event loop talking to it, e.g. PoolConfig(limiter_factory=AIMDLimiter)
+        self.limiter_factory = limiter_factory
+        self.rate_limiter_factory = rate_limiter_factory
+
+
+class ConnectionPool(object):
+    # Connections to a single engine host shared by every ApiInstance
+    # talking to it. Sessions are bound to an event loop, so one session
+    # is kept per loop and created lazily on first use.
+    def __init__(self, host: str, config: PoolConfig):
+        self.host = host
+        self._sessions: Dict[asyncio.AbstractEventLoop, ClientSession] = {}
+        # Open clients per loop, the session of a loop is closed once the
+        # last of them is closed
+        self._users: Dict[asyncio.AbstractEventLoop, int] = {}
+        self.single_flight = SingleFlight()
+        self.reconfigure(config)
+
+    def reconfigure(self, config: PoolConfig) -> None:
+        self.config = config
+        self.circuit_breaker = CircuitBreaker(
+            self.host, config.breaker_failure_threshold, config.breaker_reset_timeout
+        )
+        self.retry_budget = RetryBudget(
+            config.retry_budget_ratio, config.retry_budget_min_per_sec
+        )
+        # Limiters hand their slots over through futures bound to a loop,
+        # so like sessions one of each is kept per loop
+        self._limiters: Dict[asyncio.AbstractEventLoop, ConcurrencyLimiter] = {}
+        self._rate_limiters: Dict[asyncio.AbstractEventLoop, TokenBucket] = {}
+
+    @staticmethod
+    def _loop_local(instances: Dict[asyncio.AbstractEventLoop, Any], factory: Callable[[], Any]) -> Any:
+        loop = asyncio.get_event_loop()
+        instance = instances.get(loop)
+        if instance is None:
+            for stale_loop in [l for l in instances if l.is_closed()]:
+                del instances[stale_loop]
+            instance = instances[loop] = factory()
+        return instance
+
+    @property
+    def limiter(self) -> Optional[ConcurrencyLimiter]:
+        if self.config.limiter_factory is None:
+            return None
+        return ConnectionPool._loop_local(self._limiters, self.config.limiter_factory)
+
+    @property
+    def rate_limiter(self) -> Optional[TokenBucket]:
+        if self.config.rate_limiter_factory is None:
+            return None
+        return ConnectionPool._loop_local(self._rate_limiters, self.config.rate_limiter_factory)
+
+    @property
+    def socket_path(self) -> Optional[str]:
+        unix_url = split_unix_url(self.host)
+        if unix_url is None:
+            return None
+        return unix_url[0]
+
+    def request_url(self, url: str) -> str:
+        # Requests over a UNIX socket still need an http URL for aiohttp,
+        # the host part is ignored by the connector
+        unix_url = split_unix_url(url)
+        if unix_url is None:
+            return url
+        return "http://localhost" + unix_url[1]
+
+    def create_connector(self) -> BaseConnector:
+        if self.socket_path is not None:
+            return UnixConnector(
+                self.socket_path,
+                limit=self.config.limit,
+                limit_per_host=self.config.limit_per_host,
+                keepalive_timeout=self.config.keepalive_timeout,
+            )
+        return TCPConnector(
+            limit=self.config.limit,
+            limit_per_host=self.config.limit_per_host,
+            keepalive_timeout=self.config.keepalive_timeout,
+            use_dns_cache=self.config.use_dns_cache,
+            ttl_dns_cache=self.config.ttl_dns_cache,
+        )
+
+    @property
+    def session(self) -> ClientSession:
+        loop = asyncio.get_event_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            for stale_loop in [l for l in self._sessions if l.is_closed()]:
+                ConnectionPool._discard_session(self._sessions.pop(stale_loop))
+                self._users.pop(stale_loop, None)
+            session = ClientSession(connector=self.create_connector())
+            self._sessions[loop] = session
+        return session
+
+    @staticmethod
+    def _discard_session(session: ClientSession) -> None:
+        # Left behind by a loop that was closed first, its connections can
+        # not be closed through the dead loop so their sockets are closed
+        # directly before the connector is marked closed
+        connector = session.connector
+        if connector is None or connector.closed:
+            return
+        for connections in list(getattr(connector, "_conns", {}).values()):
+            for protocol, _ in connections:
+                if protocol.transport is not None:
+                    sock = protocol.transport.get_extra_info("socket")
+                    if sock is not None:
+                        sock.close()
+        # Synchronous part of close(), the rest would need the loop
+        connector._close()
+
+    def retain(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._users[loop] = self._users.get(loop, 0) + 1
+
+    async def release(self, loop: asyncio.AbstractEventLoop) -> None:
+        users = self._users.get(loop, 0) - 1
+        if users > 0:
+            self._users[loop] = users
+            return
+        self._users.pop(loop, None)
+        session = self._sessions.pop(loop, None)
+        if session is None:
+            return
+        if loop is asyncio.get_event_loop():
+            await session.close()
+        elif loop.is_running():
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+        else:
+            ConnectionPool._discard_session(session)
+
+    async def prewarm(self, count: Optional[int] = None) -> None:
+        if count is None:
+            count = self.config.prewarm
+        if count <= 0:
+            return
+
+        # Concurrent requests cannot share a connection, so each one
+        # leaves an open keep-alive connection behind in the pool
+        async def open_connection():
+            async with self.session.head(self.request_url(self.host) + "/") as resp:
+                await resp.read()
+
+        results = await asyncio.gather(
+            *[open_connection() for _ in range(count)], return_exceptions=True
+        )
+        failed = sum(1 for res in results if isinstance(res, Exception))
+        if failed:
+            logging.getLogger(__name__).debug(
+                f"Failed to prewarm {failed} of {count} connections to {self.host}"
+            )
+
+    async def renew(self) -> None:
+        session = self._sessions.pop(asyncio.get_event_loop(), None)
+        if session is not None:
+            metrics.record_session_renewal(self.host)
+            await session.close()
+
+    async def close_loop_session(self) -> None:
+        # Closes only the session of the running loop, before it stops
+        self._users.pop(asyncio.get_event_loop(), None)
+        session = self._sessions.pop(asyncio.get_event_loop(), None)
+        if session is not None:
+            await session.close()
+
+    async def close(self) -> None:
+        sessions = list(self._sessions.items())
+        self._sessions.clear()
+        self._users.clear()
+        for loop, session in sessions:
+            if loop.is_closed():
+                ConnectionPool._discard_session(session)
+            else:
+                await session.close()
+
+
+class ConnectionPoolRegistry(object):
+    def __init__(self, config: Optional[PoolConfig] = None):
+        self.config = config or PoolConfig()
+        self._configs: Dict[str, PoolConfig] = {}
+        self._pools: Dict[str, ConnectionPool] = {}
+
+    @staticmethod
+    def host_key(url: str) -> str:
+        unix_url = split_unix_url(url)
+        if unix_url is not None:
+            return url[:len(url) - len(unix_url[1])]
+        return str(URL(url).origin())
+
+    def configure(self, config: PoolConfig, url: Optional[str] = None) -> None:
+        # Applies to sessions created after the call, already open
+        # sessions keep their connectors until renewed
+        if url is None:
+            self.config = config
+            for key, pool in self._pools.items():
+                if key not in self._configs:
+                    pool.reconfigure(config)
+        else:
+            key = ConnectionPoolRegistry.host_key(url)
+            self._configs[key] = config
+            if key in self._pools:
+                self._pools[key].reconfigure(config)
+
+    def get(self, url: str) -> ConnectionPool:
+        key = ConnectionPoolRegistry.host_key(url)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(key, self._configs.get(key, self.config))
+            self._pools[key] = pool
+        return pool
+
+    async def close_loop_sessions(self) -> None:
+        for pool in list(self._pools.values()):
+            await pool.close_loop_session()
+
+    async def close(self) -> None:
+        for pool in self._pools.values():
+            await pool.close()
+
+
+# Process-wide registry, every client borrows its session from here
+connection_pools = ConnectionPoolRegistry()
 
 
 class ApiInstance(object):
     def __init__(
         self,
         base_url: str,
-        timeout: int = 5000,
+        timeout: Union[float, RequestTimeout] = 5000,
         headers: dict = {},
         *,
-        logger: logging.Logger
+        logger: logging.Logger,
+        pool: Optional[ConnectionPool] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        codec: Optional[JsonCodec] = None,
+        coalesce_gets: bool = True,
+        stream_timeout: Optional[RequestTimeout] = None
     ):
-        self.base_url = base_url
+        self.pool = pool or connection_pools.get(base_url)
+        self.base_url = self.pool.request_url(base_url)
         self.headers = headers
-        self.timeout = timeout
-        self.session = ClientSession(timeout=ClientTimeout(total=timeout))
+        # Default for requests which do not specify their own timeout,
+        # plain numbers are taken as milliseconds
+        self.timeout = RequestTimeout.from_value(timeout)
+        # Default for streamed responses, without a total of its own
+        self.stream_timeout = stream_timeout or self.timeout.for_stream()
+        self._retry_policy = retry_policy
+        self._codec = codec
+        # Concurrent identical GETs to the same host share one request
+        self.coalesce_gets = coalesce_gets
         self.logger = logger
+        # Loops this client holds the pool's session open on
+        self._loops: Set[asyncio.AbstractEventLoop] = set()
+
+    @property
+    def retry_policy(self) -> RetryPolicy:
+        return self._retry_policy or self.pool.config.retry_policy
+
+    @property
+    def codec(self) -> JsonCodec:
+        return self._codec or get_codec()
+
+    @property
+    def session(self) -> ClientSession:
+        loop = asyncio.get_event_loop()
+        if loop not in self._loops:
+            self._loops.add(loop)
+            self.pool.retain(loop)
+        return self.pool.session
 
     async def __aenter__(self) -> "ApiInstance":
         return self
@@ -40,118 +396,360 @@ class ApiInstance(object):
     ) -> None:
         await self.close()
 
-    def check_result(self, res: Any) -> Any:
-        if res == "":
+    def check_result(self, res: bytes, lazy: bool = False) -> Any:
+        if not res:
             return None
-        return json_loads_attrs(res)
+        if lazy:
+            return self.codec.loads_view(res)
+        return self.codec.loads_attrs(res)
 
-    async def call(self, method: str, prefix: str, data: dict, headers: dict = {}):
+    def prepare_request(self, data: Optional[dict], headers: dict) -> Tuple[Optional[bytes], CIMultiDict]:
         new_headers = CIMultiDict()
         new_headers.update(self.headers)
         new_headers.update(headers)
-        data_binary = json.dumps(data).encode("utf-8")
-        # TODO: this is too much code duplication but I cannot think of
-        # a way outside macros that could abstract async with block
-        # and sadly there are no macro in python
-        if method == "get":
-            async with self.session.get(
-                self.base_url + "/" + prefix, headers=new_headers
-            ) as resp:
-                await check_response(resp, self.logger)
-                res = await resp.text()
-            return self.check_result(res)
-        elif method == "post":
-            async with self.session.post(
-                self.base_url + "/" + prefix, data=data_binary, headers=new_headers
-            ) as resp:
-                await check_response(resp, self.logger)
-                res = await resp.text()
-            return self.check_result(res)
-        elif method == "put":
-            async with self.session.put(
-                self.base_url + "/" + prefix, data=data_binary, headers=new_headers
-            ) as resp:
-                await check_response(resp, self.logger)
-                res = await resp.text()
-            return self.check_result(res)
-        elif method == "patch":
-            async with self.session.patch(
-                self.base_url + "/" + prefix, data=data_binary, headers=new_headers
-            ) as resp:
-                await check_response(resp, self.logger)
-                res = await resp.text()
-            return self.check_result(res)
-        elif method == "delete":
-            async with self.session.delete(
-                self.base_url + "/" + prefix, headers=new_headers
-            ) as resp:
-                await check_response(resp, self.logger)
-                res = await resp.text()
-            return self.check_result(res)
+        if data is None:
+            return None, new_headers
+        data_binary = self.codec.dumps(data)
+        compression = self.pool.config.compression
+        if compression is not None:
+            new_headers["Accept-Encoding"] = compression.accept_encoding
+            data_binary, encoding = compression.compress(data_binary)
+            if encoding is not None:
+                new_headers["Content-Encoding"] = encoding
+        return data_binary, new_headers
 
-    async def post(self, prefix: str, data: dict, headers: dict = {}) -> Any:
-        try:
-            return await self.call("post", prefix, data, headers)
-        except PapieaBaseException as papiea_exception:
-            raise papiea_exception
-        except ApiException as api_exception:
-            raise api_exception
-        except Exception as e:
-            self.logger.debug("RENEWING SESSION")
-            await self.renew_session()
-            return await self.call("post", prefix, data, headers)
+    def client_timeout(self, timeout: Optional[RequestTimeout] = None) -> ClientTimeout:
+        # Capped by the deadline of the callback being handled, if any
+        return (timeout or self.timeout).client_timeout()
 
-    async def put(self, prefix: str, data: dict, headers: dict = {}) -> Any:
+    async def send(
+        self,
+        method: str,
+        url: str,
+        data_binary: Optional[bytes],
+        headers: CIMultiDict,
+        timeout: Optional[RequestTimeout] = None,
+        attempt: int = 1,
+    ) -> bytes:
+        request_timeout = self.client_timeout(timeout)
+        if method not in ("post", "put", "patch"):
+            data_binary = None
+        span = None
+        route = metrics.route_template(URL(url).path)
+        if tracing.is_active():
+            span = tracing.new_span(
+                f"{method.upper()} {route}",
+                kind="client",
+                attributes={"http.method": method.upper(), "http.url": url, "attempt": attempt},
+            )
+            span.context.inject(headers)
+        start = time.monotonic()
+        status = None
+        res = b""
+        error = None
         try:
-            return await self.call("put", prefix, data, headers)
-        except PapieaBaseException as papiea_exception:
-            raise papiea_exception
-        except ApiException as api_exception:
-            raise api_exception
+            async with self.session.request(
+                method.upper(), url, data=data_binary, headers=headers, timeout=request_timeout
+            ) as resp:
+                status = resp.status
+                await check_response(resp, self.logger)
+                res = await resp.read()
+                return res
         except Exception as e:
-            self.logger.debug("RENEWING SESSION")
-            await self.renew_session()
-            return await self.call("put", prefix, data, headers)
+            error = type(e).__name__
+            if span is not None:
+                span.end(e)
+            raise
+        finally:
+            if span is not None:
+                span.set_attribute("http.status_code", status)
+                span.end()
+            if metrics.get_sinks():
+                metrics.record_request(metrics.RequestSample(
+                    self.pool.host,
+                    method,
+                    route,
+                    status,
+                    time.monotonic() - start,
+                    len(data_binary) if data_binary else 0,
+                    len(res),
+                    attempt=attempt,
+                    error=error,
+                ))
 
-    async def patch(self, prefix: str, data: dict, headers: dict = {}) -> Any:
+    async def send_limited(
+        self,
+        method: str,
+        url: str,
+        data_binary: Optional[bytes],
+        headers: CIMultiDict,
+        timeout: Optional[RequestTimeout] = None,
+        attempt: int = 1,
+    ) -> bytes:
+        if self.pool.rate_limiter is not None:
+            await self.pool.rate_limiter.acquire()
+        limiter = self.pool.limiter
+        if limiter is None:
+            return await self.send(method, url, data_binary, headers, timeout, attempt)
+        await limiter.acquire()
+        start = time.monotonic()
+        failed = False
         try:
-            return await self.call("patch", prefix, data, headers)
-        except PapieaBaseException as papiea_exception:
-            raise papiea_exception
-        except ApiException as api_exception:
-            raise api_exception
+            return await self.send(method, url, data_binary, headers, timeout, attempt)
         except Exception as e:
-            self.logger.debug("RENEWING SESSION")
-            await self.renew_session()
-            return await self.call("patch", prefix, data, headers)
+            failed = self.retry_policy.is_failure(e)
+            raise
+        finally:
+            limiter.release(time.monotonic() - start, failed)
 
-    async def get(self, prefix: str, headers: dict = {}) -> Any:
-        try:
-            return await self.call("get", prefix, {}, headers)
-        except PapieaBaseException as papiea_exception:
-            raise papiea_exception
-        except ApiException as api_exception:
-            raise api_exception
-        except Exception as e:
-            self.logger.debug("RENEWING SESSION")
-            await self.renew_session()
-            return await self.call("get", prefix, {}, headers)
+    async def call(
+        self, method: str, prefix: str, data: dict, headers: dict = {}, timeout: Optional[RequestTimeout] = None
+    ):
+        data_binary, new_headers = self.prepare_request(data, headers)
+        res = await self.send(method, self.base_url + "/" + prefix, data_binary, new_headers, timeout)
+        return self.check_result(res)
+
+    async def send_with_retry(
+        self,
+        method: str,
+        url: str,
+        data_binary: Optional[bytes],
+        headers: CIMultiDict,
+        idempotent: Optional[bool] = None,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> bytes:
+        breaker = self.pool.circuit_breaker
+        budget = self.pool.retry_budget
+        budget.deposit()
+        attempt = 0
+        last_error: Optional[BaseException] = None
+        while True:
+            attempt += 1
+            try:
+                breaker.check()
+            except CircuitOpenException as e:
+                # Opened by the failure of the previous attempt
+                if last_error is not None:
+                    raise e from last_error
+                raise
+            try:
+                res = await self.send_limited(method, url, data_binary, headers, timeout, attempt)
+            except (DeadlineExceededException, ConcurrencyLimitException):
+                breaker.record_release()
+                raise
+            except Exception as e:
+                remaining = remaining_time()
+                if isinstance(e, asyncio.TimeoutError) and remaining is not None and remaining <= 0:
+                    # Cut short by the callback deadline, engine may be fine
+                    breaker.record_release()
+                    raise DeadlineExceededException() from e
+                if self.retry_policy.is_failure(e):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                if not self.retry_policy.should_retry(method, e, attempt, idempotent) or not budget.withdraw():
+                    raise
+                last_error = e
+                delay = self.retry_policy.backoff(attempt)
+                if remaining is not None and remaining <= delay:
+                    raise
+                self.logger.debug(
+                    f"Retrying {method.upper()} {url} in {delay:.3f}s after attempt {attempt} failed: {e!r}"
+                )
+                if metrics.get_sinks():
+                    metrics.record_retry(
+                        self.pool.host, method, metrics.route_template(URL(url).path), attempt, type(e).__name__
+                    )
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                breaker.record_release()
+                raise
+            breaker.record_success()
+            return res
+
+    async def request(
+        self,
+        method: str,
+        prefix: str,
+        data: dict,
+        headers: dict = {},
+        idempotent: Optional[bool] = None,
+        coalesce: Optional[bool] = None,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> Any:
+        res = await self.request_raw(method, prefix, data, headers, idempotent, coalesce, timeout)
+        return self.check_result(res)
+
+    async def request_raw(
+        self,
+        method: str,
+        prefix: str,
+        data: dict,
+        headers: dict = {},
+        idempotent: Optional[bool] = None,
+        coalesce: Optional[bool] = None,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> bytes:
+        # Same as request, but returns the undecoded response body
+        data_binary, new_headers = self.prepare_request(data, headers)
+        url = self.base_url + "/" + prefix
+        if coalesce is None:
+            coalesce = method == "get" and self.coalesce_gets
+        if coalesce:
+            # Callers sharing the request decode the body separately,
+            # so none of them sees objects mutated by another
+            key = (method, url, data_binary, new_headers.get("Authorization"), timeout or self.timeout)
+            res = await self.pool.single_flight.do(
+                key, lambda: self.send_with_retry(method, url, data_binary, new_headers, idempotent, timeout)
+            )
+        else:
+            res = await self.send_with_retry(method, url, data_binary, new_headers, idempotent, timeout)
+        return res
+
+    async def post(
+        self,
+        prefix: str,
+        data: dict,
+        headers: dict = {},
+        idempotent: Optional[bool] = None,
+        coalesce: bool = False,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> Any:
+        return await self.request(
+            "post", prefix, data, headers, idempotent=idempotent, coalesce=coalesce, timeout=timeout
+        )
 
-    async def delete(self, prefix: str, headers: dict = {}) -> Any:
+    async def put(
+        self,
+        prefix: str,
+        data: dict,
+        headers: dict = {},
+        idempotent: Optional[bool] = None,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> Any:
+        return await self.request("put", prefix, data, headers, idempotent=idempotent, timeout=timeout)
+
+    async def patch(
+        self,
+        prefix: str,
+        data: dict,
+        headers: dict = {},
+        idempotent: Optional[bool] = None,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> Any:
+        return await self.request("patch", prefix, data, headers, idempotent=idempotent, timeout=timeout)
+
+    async def get(self, prefix: str, headers: dict = {}, timeout: Optional[RequestTimeout] = None) -> Any:
+        return await self.request("get", prefix, {}, headers, timeout=timeout)
+
+    async def delete(self, prefix: str, headers: dict = {}, timeout: Optional[RequestTimeout] = None) -> Any:
+        return await self.request("delete", prefix, {}, headers, timeout=timeout)
+
+    async def stream(
+        self,
+        method: str,
+        prefix: str,
+        data: Optional[dict] = None,
+        headers: dict = {},
+        field: str = "results",
+        chunk_size: int = 64 * 1024,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> AsyncGenerator[Any, None]:
+        # Yields the items of the array response field one at a time while
+        # the body is still being received. Requests are not retried since
+        # items may already have been handed out to the caller.
+        data_binary, new_headers = self.prepare_request(data, headers)
+        request_timeout = self.client_timeout(timeout or self.stream_timeout)
+        breaker = self.pool.circuit_breaker
+        breaker.check()
+        limiter = self.pool.limiter
+        acquired = False
+        failed = False
+        url = self.base_url + "/" + prefix
+        route = metrics.route_template(URL(url).path)
+        span = None
+        if tracing.is_active():
+            span = tracing.new_span(
+                f"{method.upper()} {route}",
+                kind="client",
+                attributes={"http.method": method.upper(), "http.url": url, "streamed": True},
+            )
+            span.context.inject(new_headers)
+        start = time.monotonic()
+        status = None
+        received = 0
+        error = None
         try:
-            return await self.call("delete", prefix, {}, headers)
-        except PapieaBaseException as papiea_exception:
-            raise papiea_exception
-        except ApiException as api_exception:
-            raise api_exception
+            if self.pool.rate_limiter is not None:
+                await self.pool.rate_limiter.acquire()
+            if limiter is not None:
+                await limiter.acquire()
+                acquired = True
+            async with self.session.request(
+                method.upper(),
+                url,
+                data=data_binary,
+                headers=new_headers,
+                timeout=request_timeout,
+            ) as resp:
+                status = resp.status
+                await check_response(resp, self.logger)
+                parser = ItemsStreamParser(field)
+                async for chunk in resp.content.iter_chunked(chunk_size):
+                    received += len(chunk)
+                    for item in parser.feed(chunk):
+                        yield self.codec.loads_attrs(item)
+                parser.close()
+        except (DeadlineExceededException, ConcurrencyLimitException) as e:
+            error = type(e).__name__
+            if span is not None:
+                span.end(e)
+            breaker.record_release()
+            raise
         except Exception as e:
-            self.logger.debug("RENEWING SESSION")
-            await self.renew_session()
-            return await self.call("delete", prefix, {}, headers)
+            error = type(e).__name__
+            if span is not None:
+                span.end(e)
+            failed = self.retry_policy.is_failure(e)
+            if failed:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            raise
+        except BaseException as e:
+            error = type(e).__name__
+            breaker.record_release()
+            raise
+        finally:
+            # Stream duration says nothing about engine latency, so only
+            # the outcome is reported to the limiter
+            if acquired:
+                limiter.release(None, failed)
+            if span is not None:
+                span.set_attribute("http.status_code", status)
+                span.set_attribute("response_bytes", received)
+                span.end()
+            if metrics.get_sinks():
+                metrics.record_request(metrics.RequestSample(
+                    self.pool.host,
+                    method,
+                    route,
+                    status,
+                    time.monotonic() - start,
+                    len(data_binary) if data_binary else 0,
+                    received,
+                    error=error,
+                ))
+        breaker.record_success()
 
     async def close(self):
-        await self.session.close()
+        # The session is shared with the other clients of the pool on the
+        # same loop and is only closed once the last of them is closed
+        loops = list(self._loops)
+        self._loops.clear()
+        for loop in loops:
+            await self.pool.release(loop)
 
     async def renew_session(self):
-        await self.close()
-        self.session = ClientSession(timeout=ClientTimeout(total=self.timeout))
+        await self.pool.renew()
@@ -0,0 +1,103 @@
+import asyncio
+from typing import Any, AsyncGenerator, AsyncIterable, Awaitable, Callable, Dict, Iterable, Optional, Union
+
+from .python_sdk_exceptions import ConflictingEntityException, EntityNotFoundException, ValidationException
+
+
+class ErrorPolicy(str):
+    # Keep going and report the failure with its item
+    Continue = "continue"
+    # Start no further items once one has failed, items in flight finish
+    Stop = "stop"
+
+
+class ItemResult(object):
+    # Outcome of a single item of a bulk operation, index is the position
+    # of the item in the input
+    def __init__(self, index: int, item: Any, value: Any = None, error: Optional[BaseException] = None):
+        self.index = index
+        self.item = item
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def not_found(self) -> bool:
+        return isinstance(self.error, EntityNotFoundException)
+
+    @property
+    def conflict(self) -> bool:
+        return isinstance(self.error, ConflictingEntityException)
+
+    @property
+    def validation_error(self) -> bool:
+        return isinstance(self.error, ValidationException)
+
+    def unwrap(self) -> Any:
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def __repr__(self) -> str:
+        if self.error is not None:
+            return f"ItemResult(index={self.index}, error={self.error!r})"
+        return f"ItemResult(index={self.index}, value={self.value!r})"
+
+
+async def run_bulk(
+    items: Union[Iterable[Any], AsyncIterable[Any]],
+    operation: Callable[[Any], Awaitable[Any]],
+    concurrency: int = 20,
+    on_error: str = ErrorPolicy.Continue,
+) -> AsyncGenerator[ItemResult, None]:
+    # Applies operation to every item with at most concurrency of them in
+    # flight and yields results as they complete. Items are only taken
+    # from the input when there is room, so a slow consumer of the
+    # results also slows down the reading of the input.
+    if isinstance(items, AsyncIterable):
+        async_items = items.__aiter__()
+        sync_items = None
+    else:
+        async_items = None
+        sync_items = iter(items)
+    running: Dict[asyncio.Future, ItemResult] = {}
+    index = 0
+    exhausted = False
+    stopped = False
+
+    async def run(res: ItemResult) -> ItemResult:
+        try:
+            res.value = await operation(res.item)
+        except Exception as e:
+            res.error = e
+        return res
+
+    try:
+        while True:
+            while not exhausted and not stopped and len(running) < concurrency:
+                try:
+                    if async_items is not None:
+                        item = await async_items.__anext__()
+                    else:
+                        item = next(sync_items)
+                except (StopIteration, StopAsyncIteration):
+                    exhausted = True
+                    break
+                res = ItemResult(index, item)
+                index += 1
+                running[asyncio.ensure_future(run(res))] = res
+            if not running:
+                return
+            done, _ = await asyncio.wait(running.keys(), return_when=asyncio.FIRST_COMPLETED)
+            for fut in sorted(done, key=lambda f: running[f].index):
+                res = running.pop(fut)
+                fut.result()
+                if res.error is not None and on_error == ErrorPolicy.Stop:
+                    stopped = True
+                yield res
+    finally:
+        for fut in running:
+            fut.cancel()
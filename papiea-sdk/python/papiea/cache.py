@@ -0,0 +1,261 @@
+import json
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set
+
+from .python_sdk_exceptions import EntityNotFoundException
+
+
+class CacheStats(object):
+    def __init__(self):
+        self.reset()
+
+    def snapshot(self) -> Dict[str, float]:
+        lookups = self.hits + self.negative_hits + self.misses
+        return dict(
+            hits=self.hits,
+            negative_hits=self.negative_hits,
+            misses=self.misses,
+            expired=self.expired,
+            evictions=self.evictions,
+            invalidations=self.invalidations,
+            hit_ratio=(self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        )
+
+    def reset(self) -> None:
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        # Entries found but too old for the ttl or the max_staleness asked
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+
+class CacheEntry(object):
+    def __init__(self, body: Optional[bytes], spec_version: Optional[int], ttl: float):
+        # None body marks an entity that was not found
+        self.body = body
+        self.spec_version = spec_version
+        self.stored_at = time.monotonic()
+        self.expires_at = self.stored_at + ttl
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.stored_at
+
+
+_entity_caches = weakref.WeakSet()
+_query_caches = weakref.WeakSet()
+# Other local copies of entities, with the same invalidate and
+# invalidate_kind methods
+_listeners = weakref.WeakSet()
+
+
+def add_invalidation_listener(listener: Any) -> None:
+    _listeners.add(listener)
+
+
+def remove_invalidation_listener(listener: Any) -> None:
+    _listeners.discard(listener)
+
+
+def invalidate_entity(uuid: str, kind: Optional[str] = None) -> None:
+    # Called for every write made by this process, whichever client made it
+    for cache in list(_entity_caches):
+        cache.invalidate(uuid)
+    for listener in list(_listeners):
+        listener.invalidate(uuid)
+    if kind is not None:
+        invalidate_kind(kind)
+
+
+def invalidate_kind(kind: str) -> None:
+    for cache in list(_query_caches):
+        cache.invalidate_kind(kind)
+    for listener in list(_listeners):
+        listener.invalidate_kind(kind)
+
+
+class BodyCache(object):
+    # LRU of response bodies with a ttl. Every entry belongs to a scope,
+    # invalidating a scope drops its entries, and reads of the scope that
+    # were in flight at that time do not get stored since they may
+    # predate the write.
+    def __init__(self, max_size: int, ttl: float, stats: Optional[CacheStats] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        # Not found results are only cached by subclasses that set this
+        self.negative_ttl = 0.0
+        self.stats = stats or CacheStats()
+        self._entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+        self._scopes: Dict[Hashable, Hashable] = {}
+        self._keys_by_scope: Dict[Hashable, Set[Hashable]] = {}
+        self._epoch = 0
+        self._invalidated: Dict[Hashable, int] = {}
+        self._cleared_epoch = 0
+        self._fetching = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, key: Hashable, max_staleness: Optional[float] = None) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() >= entry.expires_at:
+            self._remove(key)
+            self.stats.expired += 1
+            return None
+        if max_staleness is not None and entry.age > max_staleness:
+            self.stats.expired += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def store(
+        self,
+        key: Hashable,
+        scope: Hashable,
+        body: Optional[bytes],
+        spec_version: Optional[int],
+        ttl: float,
+        started_epoch: int,
+    ) -> None:
+        if started_epoch < self._cleared_epoch or self._invalidated.get(scope, -1) > started_epoch:
+            return
+        current = self._entries.get(key)
+        if (
+            current is not None
+            and current.spec_version is not None
+            and spec_version is not None
+            and current.spec_version > spec_version
+        ):
+            # Never go back to an older spec
+            return
+        if ttl <= 0:
+            return
+        self._entries[key] = CacheEntry(body, spec_version, ttl)
+        self._entries.move_to_end(key)
+        self._scopes[key] = scope
+        self._keys_by_scope.setdefault(scope, set()).add(key)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+            self.stats.evictions += 1
+
+    def _remove(self, key: Hashable) -> None:
+        del self._entries[key]
+        scope = self._scopes.pop(key)
+        keys = self._keys_by_scope[scope]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_scope[scope]
+
+    async def read_through(
+        self,
+        key: Hashable,
+        scope: Hashable,
+        fetch: Callable[[], Awaitable[bytes]],
+        decode: Callable[[bytes], Any],
+        max_staleness: Optional[float] = None,
+    ) -> Any:
+        # max_staleness of 0 always goes to the engine
+        entry = self.lookup(key, max_staleness)
+        if entry is not None:
+            if entry.body is None:
+                self.stats.negative_hits += 1
+                raise EntityNotFoundException(f"Entity {key} not found", None, None)
+            self.stats.hits += 1
+            return decode(entry.body)
+        self.stats.misses += 1
+        started_epoch = self._epoch
+        self._fetching += 1
+        try:
+            body = await fetch()
+            res = decode(body)
+            self.store(key, scope, body, self.spec_version(res), self.ttl, started_epoch)
+            return res
+        except EntityNotFoundException:
+            self.store(key, scope, None, None, self.negative_ttl, started_epoch)
+            raise
+        finally:
+            self._fetching -= 1
+            if self._fetching == 0:
+                self._invalidated.clear()
+
+    def spec_version(self, res: Any) -> Optional[int]:
+        return None
+
+    def invalidate_scope(self, scope: Hashable) -> None:
+        for key in list(self._keys_by_scope.get(scope, ())):
+            self._remove(key)
+            self.stats.invalidations += 1
+        if self._fetching > 0:
+            self._epoch += 1
+            self._invalidated[scope] = self._epoch
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._scopes.clear()
+        self._keys_by_scope.clear()
+        self._epoch += 1
+        self._cleared_epoch = self._epoch
+
+
+class EntityCache(BodyCache):
+    # Read-through cache of entity bodies keyed by uuid. Bodies are
+    # decoded on every hit, so callers never share mutable entities.
+    def __init__(
+        self,
+        max_size: int = 1024,
+        ttl: float = 30.0,
+        negative_ttl: float = 1.0,
+        stats: Optional[CacheStats] = None,
+    ):
+        super().__init__(max_size, ttl, stats)
+        self.negative_ttl = negative_ttl
+        _entity_caches.add(self)
+
+    def spec_version(self, res: Any) -> Optional[int]:
+        return res.get("metadata", {}).get("spec_version")
+
+    async def get(
+        self,
+        uuid: str,
+        fetch: Callable[[], Awaitable[bytes]],
+        decode: Callable[[bytes], Any],
+        max_staleness: Optional[float] = None,
+    ) -> Any:
+        return await self.read_through(uuid, uuid, fetch, decode, max_staleness)
+
+    def invalidate(self, uuid: str) -> None:
+        self.invalidate_scope(uuid)
+
+
+class QueryCache(BodyCache):
+    # Filter results keyed by provider, kind and normalized query, any
+    # write to a kind drops all of its results
+    def __init__(self, max_size: int = 256, ttl: float = 5.0, stats: Optional[CacheStats] = None):
+        super().__init__(max_size, ttl, stats)
+        _query_caches.add(self)
+
+    @staticmethod
+    def query_key(provider_prefix: str, provider_version: str, filter_obj: Any, query: str) -> Hashable:
+        # Kinds of the same name in different providers or provider
+        # versions are different collections
+        normalized = json.dumps(filter_obj, sort_keys=True, separators=(",", ":"), default=str)
+        return provider_prefix, provider_version, normalized, query
+
+    async def get(
+        self,
+        kind: str,
+        key: Hashable,
+        fetch: Callable[[], Awaitable[bytes]],
+        decode: Callable[[bytes], Any],
+        max_staleness: Optional[float] = None,
+    ) -> Any:
+        return await self.read_through((kind, key), kind, fetch, decode, max_staleness)
+
+    def invalidate_kind(self, kind: str) -> None:
+        self.invalidate_scope(kind)
@@ -1,13 +1,52 @@
-import time
+import asyncio
 import logging
+from urllib.parse import quote
 from types import TracebackType
-from typing import Any, Optional, List, Type, Callable, AsyncGenerator
+from typing import Any, Optional, List, Type, Callable, AsyncGenerator, AsyncIterable, Iterable, Tuple, Union
 
 from .api import ApiInstance
+from .bulk import ErrorPolicy, ItemResult, run_bulk
+from .cache import EntityCache, QueryCache, invalidate_entity, invalidate_kind
+from .conflicts import ConflictPolicy, ContentionStats, MutateFn, update_with
+from .intent_waiter import IntentWatcherWaiter
+from .pagination import PageSizer, Paginator, PaginationProgress
+from .replica import EntityReplica
+from .python_sdk_exceptions import BadRequestException, EntityNotFoundException, ValidationException
+from .timeouts import RequestTimeout
+from .watch import EntityWatcher, WatchCursor
 from .core import AttributeDict, Entity, EntityReference, EntitySpec, IntentfulStatus, IntentWatcher, Metadata, Secret, Spec
 FilterResults = AttributeDict
 
 BATCH_SIZE = 20
+# Page size of the concurrent full listings of iter_all
+FAN_OUT_PAGE_SIZE = 100
+# Most uuids looked up by get_many in a single filter request
+GET_MANY_CHUNK_SIZE = 200
+
+
+def pagination_query(
+    limit: Optional[int] = None,
+    offset: Optional[int] = None,
+    sort: Optional[str] = None,
+    exact: Optional[bool] = None,
+    deleted: Optional[bool] = None,
+) -> str:
+    params = []
+    if limit:
+        params.append(f"limit={limit}")
+    # Engine rejects zero offset, so the first page is requested without it
+    if offset:
+        params.append(f"offset={offset}")
+    # sort is "<field>:asc" or "<field>:desc"
+    if sort:
+        params.append(f"sort={quote(sort)}")
+    if exact is not None:
+        params.append(f"exact={str(exact).lower()}")
+    if deleted is not None:
+        params.append(f"deleted={str(deleted).lower()}")
+    if not params:
+        return ""
+    return "?" + "&".join(params)
 
 class EntityCRUD(object):
     def __init__(
@@ -18,6 +57,9 @@ class EntityCRUD(object):
         kind: str,
         s2skey: Optional[str] = None,
         logger: logging.Logger = logging.getLogger(__name__),
+        timeout: Union[float, RequestTimeout] = 5000,
+        cache: Optional[EntityCache] = None,
+        query_cache: Optional[QueryCache] = None,
     ):
         headers = {
             "Content-Type": "application/json",
@@ -25,8 +67,15 @@ class EntityCRUD(object):
         if s2skey is not None:
             headers["Authorization"] = f"Bearer {s2skey}"
         self.api_instance = ApiInstance(
-            f"{papiea_url}/services/{prefix}/{version}/{kind}", headers=headers, logger=logger
+            f"{papiea_url}/services/{prefix}/{version}/{kind}", timeout, headers=headers, logger=logger
         )
+        self.provider_prefix = prefix
+        self.provider_version = version
+        self.kind = kind
+        # Opt-in read-through caches for get and filter, a cache should
+        # only be shared by clients acting with the same credentials
+        self.cache = cache
+        self.query_cache = query_cache
 
     async def __aenter__(self) -> "EntityCRUD":
         return self
@@ -39,93 +88,426 @@ class EntityCRUD(object):
     ) -> None:
         await self.api_instance.close()
 
-    async def get(self, entity_reference: EntityReference) -> Entity:
+    async def get(
+        self,
+        entity_reference: EntityReference,
+        timeout: Optional[RequestTimeout] = None,
+        max_staleness: Optional[float] = None,
+    ) -> Entity:
+        # max_staleness bounds the age in seconds of a cached entity
         try:
-            return await self.api_instance.get(entity_reference.uuid)
+            if self.cache is None:
+                return await self.api_instance.get(entity_reference.uuid, timeout=timeout)
+            return await self.cache.get(
+                entity_reference.uuid,
+                lambda: self.api_instance.request_raw("get", entity_reference.uuid, {}, timeout=timeout),
+                self.api_instance.check_result,
+                max_staleness,
+            )
         except:
             raise
 
-    async def get_all(self) -> List[Entity]:
+    async def get_many(
+        self,
+        entity_references: List[EntityReference],
+        concurrency: int = 20,
+        use_filter: bool = True,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> List[ItemResult]:
+        # Results are in the order of entity_references, entities that do
+        # not exist have an EntityNotFoundException instead of failing
+        # the whole batch
+        results = [ItemResult(i, ref) for i, ref in enumerate(entity_references)]
+        by_uuid = {}
+        for res in results:
+            by_uuid.setdefault(res.item.uuid, []).append(res)
+        uuids = list(by_uuid.keys())
+        semaphore = asyncio.Semaphore(concurrency)
+
+        def resolve(uuid: str, value: Any = None, error: Optional[BaseException] = None):
+            for res in by_uuid[uuid]:
+                res.value = value
+                res.error = error
+
+        async def get_one(uuid: str):
+            async with semaphore:
+                try:
+                    resolve(uuid, value=await self.api_instance.get(uuid, timeout=timeout))
+                except Exception as e:
+                    resolve(uuid, error=e)
+
+        async def filter_chunk(chunk: List[str]):
+            try:
+                async with semaphore:
+                    res = await self.api_instance.post(
+                        "filter" + pagination_query(len(chunk)),
+                        {"metadata": {"uuid": {"$in": chunk}}},
+                        idempotent=True,
+                        timeout=timeout,
+                    )
+            except (BadRequestException, ValidationException):
+                # Engine did not accept the query, look entities up one by one
+                await asyncio.gather(*[get_one(uuid) for uuid in chunk])
+                return
+            except Exception as e:
+                for uuid in chunk:
+                    resolve(uuid, error=e)
+                return
+            found = {entity.metadata.uuid: entity for entity in res.results}
+            for uuid in chunk:
+                if uuid in found:
+                    resolve(uuid, value=found[uuid])
+                else:
+                    resolve(uuid, error=EntityNotFoundException(f"Entity {uuid} not found", None, None))
+
+        if use_filter and len(uuids) > 1:
+            chunks = [uuids[i:i + GET_MANY_CHUNK_SIZE] for i in range(0, len(uuids), GET_MANY_CHUNK_SIZE)]
+            await asyncio.gather(*[filter_chunk(chunk) for chunk in chunks])
+        else:
+            await asyncio.gather(*[get_one(uuid) for uuid in uuids])
+        return results
+
+    async def get_all(
+        self,
+        timeout: Optional[RequestTimeout] = None,
+        lazy: bool = False,
+        all_pages: bool = False,
+        page_size: int = FAN_OUT_PAGE_SIZE,
+        parallelism: int = 4,
+    ) -> List[Entity]:
+        # lazy returns AttrViews, decoded into plain containers and only
+        # wrapped for attribute access where accessed. Without all_pages
+        # only the engine's first page is returned.
         try:
-            res = await self.api_instance.get("")
-            return res.results
+            if all_pages:
+                return [
+                    entity async for entity in self.iter_all(None, page_size, parallelism, True, lazy, timeout)
+                ]
+            res = await self.api_instance.request_raw("get", "", {}, timeout=timeout)
+            return self.api_instance.check_result(res, lazy).results
+        except:
+            raise
+
+    async def count(self, filter_obj: Any = None, timeout: Optional[RequestTimeout] = None) -> int:
+        # Asks for a single entity, the engine reports the full count
+        try:
+            res = await self._fetch_page(filter_obj, 1, None, False, timeout)
+            return res.entity_count
         except:
             raise
 
+    async def _fetch_page(
+        self,
+        filter_obj: Any,
+        limit: int,
+        offset: Optional[int],
+        lazy: bool,
+        timeout: Optional[RequestTimeout],
+    ) -> FilterResults:
+        if filter_obj is None:
+            res = await self.api_instance.request_raw("get", pagination_query(limit, offset), {}, timeout=timeout)
+        else:
+            res = await self.api_instance.request_raw(
+                "post", "filter" + pagination_query(limit, offset), filter_obj, idempotent=True, timeout=timeout
+            )
+        return self.api_instance.check_result(res, lazy)
+
+    async def iter_all(
+        self,
+        filter_obj: Any = None,
+        page_size: int = FAN_OUT_PAGE_SIZE,
+        parallelism: int = 4,
+        ordered: bool = True,
+        lazy: bool = False,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> AsyncGenerator[Entity, None]:
+        # Reads the first page for the total count, then fetches all the
+        # remaining pages concurrently, at most parallelism at a time.
+        # Unordered output yields each page as soon as it arrives. A None
+        # filter_obj lists the kind. Entities created or deleted during the
+        # listing may shift the pages.
+        first = await self._fetch_page(filter_obj, page_size, None, lazy, timeout)
+        for entity in first.results:
+            yield entity
+        total = first.get("entity_count")
+        if len(first.results) < page_size:
+            return
+        if total is None:
+            # No count to plan with, read the rest page by page
+            async for entity in self.paginate(
+                filter_obj or {}, page_size, page_size, timeout=timeout, lazy=lazy
+            ):
+                yield entity
+            return
+        semaphore = asyncio.Semaphore(parallelism)
+
+        async def fetch(offset: int) -> FilterResults:
+            async with semaphore:
+                return await self._fetch_page(filter_obj, page_size, offset, lazy, timeout)
+
+        pages = [asyncio.ensure_future(fetch(offset)) for offset in range(page_size, total, page_size)]
+        try:
+            for page in (pages if ordered else asyncio.as_completed(pages)):
+                res = await page
+                for entity in res.results:
+                    yield entity
+        finally:
+            for page in pages:
+                if page.done():
+                    if not page.cancelled():
+                        page.exception()
+                else:
+                    page.cancel()
+
     async def create(
-        self, spec: Spec, metadata_extension: Optional[Any] = None
+        self, spec: Spec, metadata_extension: Optional[Any] = None, timeout: Optional[RequestTimeout] = None
     ) -> EntitySpec:
         try:
             payload = {"spec": spec}
             if metadata_extension is not None:
                 payload["metadata"] = {"extension": metadata_extension}
-            return await self.api_instance.post("", payload)
+            return await self.api_instance.post("", payload, timeout=timeout)
         except:
             raise
+        finally:
+            invalidate_kind(self.kind)
 
-    async def create_with_meta(self, metadata: Metadata, spec: Spec) -> EntitySpec:
+    async def create_with_meta(
+        self, metadata: Metadata, spec: Spec, timeout: Optional[RequestTimeout] = None
+    ) -> EntitySpec:
         try:
             payload = {"metadata": metadata, "spec": spec}
-            return await self.api_instance.post("", payload)
+            return await self.api_instance.post("", payload, timeout=timeout)
         except:
             raise
+        finally:
+            if metadata.get("uuid") is not None:
+                # Drops a cached not found result for the uuid
+                invalidate_entity(metadata.uuid)
+            invalidate_kind(self.kind)
 
-    async def update(self, metadata: Metadata, spec: Spec) -> EntitySpec:
+    async def update(self, metadata: Metadata, spec: Spec, timeout: Optional[RequestTimeout] = None) -> EntitySpec:
         try:
             payload = {"metadata": {"spec_version": metadata.spec_version}, "spec": spec}
-            return await self.api_instance.put(metadata.uuid, payload)
+            invalidate_entity(metadata.uuid, self.kind)
+            return await self.api_instance.put(metadata.uuid, payload, timeout=timeout)
         except:
             raise
+        finally:
+            invalidate_entity(metadata.uuid, self.kind)
 
-    async def delete(self, entity_reference: EntityReference) -> None:
+    async def update_with(
+        self,
+        entity_reference: Union[EntityReference, Entity],
+        mutate_fn: MutateFn,
+        policy: Optional[ConflictPolicy] = None,
+        stats: Optional[ContentionStats] = None,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> EntitySpec:
+        # Read-modify-write, mutate_fn is applied again to a fresh read
+        # whenever the update conflicts with another writer. Passing an
+        # entity instead of a reference skips the first read.
         try:
-            return await self.api_instance.delete(entity_reference.uuid)
+            return await update_with(self, entity_reference, mutate_fn, policy, stats, timeout)
         except:
             raise
 
-    async def filter(self, filter_obj: Any) -> FilterResults:
+    async def delete(self, entity_reference: EntityReference, timeout: Optional[RequestTimeout] = None) -> None:
         try:
-            res = await self.api_instance.post("filter", filter_obj)
-            return res
+            invalidate_entity(entity_reference.uuid, self.kind)
+            return await self.api_instance.delete(entity_reference.uuid, timeout=timeout)
         except:
             raise
+        finally:
+            invalidate_entity(entity_reference.uuid, self.kind)
+
+    def create_many(
+        self,
+        specs: Union[Iterable[Spec], AsyncIterable[Spec]],
+        metadata_extension: Optional[Any] = None,
+        concurrency: int = 20,
+        on_error: str = ErrorPolicy.Continue,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> AsyncGenerator[ItemResult, None]:
+        # Bulk variants yield an ItemResult per input item as soon as it
+        # completes, ItemResult.index gives the position in the input
+        return run_bulk(
+            specs, lambda spec: self.create(spec, metadata_extension, timeout=timeout), concurrency, on_error
+        )
+
+    def update_many(
+        self,
+        updates: Union[Iterable[Tuple[Metadata, Spec]], AsyncIterable[Tuple[Metadata, Spec]]],
+        concurrency: int = 20,
+        on_error: str = ErrorPolicy.Continue,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> AsyncGenerator[ItemResult, None]:
+        return run_bulk(
+            updates, lambda update: self.update(update[0], update[1], timeout=timeout), concurrency, on_error
+        )
+
+    def delete_many(
+        self,
+        entity_references: Union[Iterable[EntityReference], AsyncIterable[EntityReference]],
+        concurrency: int = 20,
+        on_error: str = ErrorPolicy.Continue,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> AsyncGenerator[ItemResult, None]:
+        return run_bulk(
+            entity_references, lambda ref: self.delete(ref, timeout=timeout), concurrency, on_error
+        )
+
+    def invoke_procedure_many(
+        self,
+        procedure_name: str,
+        invocations: Union[Iterable[Tuple[EntityReference, Any]], AsyncIterable[Tuple[EntityReference, Any]]],
+        concurrency: int = 20,
+        on_error: str = ErrorPolicy.Continue,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> AsyncGenerator[ItemResult, None]:
+        return run_bulk(
+            invocations,
+            lambda invocation: self.invoke_procedure(procedure_name, invocation[0], invocation[1], timeout=timeout),
+            concurrency,
+            on_error,
+        )
+
+    async def filter(
+        self,
+        filter_obj: Any,
+        coalesce: bool = False,
+        timeout: Optional[RequestTimeout] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        sort: Optional[str] = None,
+        exact: Optional[bool] = None,
+        deleted: Optional[bool] = None,
+        max_staleness: Optional[float] = None,
+        lazy: bool = False,
+    ) -> FilterResults:
+        # coalesce lets concurrent identical filters share one request,
+        # max_staleness=0 bypasses the query cache for consistent reads
+        try:
+            prefix = "filter" + pagination_query(limit, offset, sort, exact, deleted)
+            fetch = lambda: self.api_instance.request_raw(
+                "post", prefix, filter_obj, idempotent=True, coalesce=coalesce, timeout=timeout
+            )
+            decode = lambda res: self.api_instance.check_result(res, lazy)
+            if self.query_cache is None:
+                return decode(await fetch())
+            return await self.query_cache.get(
+                self.kind,
+                QueryCache.query_key(self.provider_prefix, self.provider_version, filter_obj, prefix),
+                fetch,
+                decode,
+                max_staleness,
+            )
+        except:
+            raise
+
+    def paginate(
+        self,
+        filter_obj: Any,
+        page_size: Optional[int] = None,
+        offset: Optional[int] = None,
+        prefetch: int = 1,
+        on_progress: Optional[Callable[[PaginationProgress], None]] = None,
+        timeout: Optional[RequestTimeout] = None,
+        lazy: bool = False,
+    ) -> Paginator:
+        # Without page_size, pages start at BATCH_SIZE entities and adapt
+        # to the observed latency and payload size
+        async def fetch_page(limit: int, offset: Optional[int]):
+            res = await self.api_instance.request_raw(
+                "post", "filter" + pagination_query(limit, offset), filter_obj, idempotent=True, timeout=timeout
+            )
+            return self.api_instance.check_result(res, lazy), len(res)
+        return Paginator(fetch_page, page_size, offset, prefetch, PageSizer(BATCH_SIZE), on_progress)
 
     async def filter_iter(self, filter_obj: Any) -> Callable[[Optional[int], Optional[int]], AsyncGenerator[Any, None]]:
-        async def iter_func(batch_size: Optional[int] = None, offset: Optional[int] = None):
-            if not batch_size:
-                batch_size = BATCH_SIZE
-            res = await self.api_instance.post(f"filter?limit={batch_size}&offset={offset or ''}", filter_obj)
-            if len(res.results) == 0:
-                return
-            else:
-                for entity in res.results:
-                    yield entity
-                offset = offset or 0
-                async for val in iter_func(batch_size, offset + batch_size):
-                    yield val
-                return
+        async def iter_func(
+            batch_size: Optional[int] = None,
+            offset: Optional[int] = None,
+            prefetch: int = 1,
+            on_progress: Optional[Callable[[PaginationProgress], None]] = None,
+            lazy: bool = False,
+        ):
+            async for entity in self.paginate(filter_obj, batch_size, offset, prefetch, on_progress, lazy=lazy):
+                yield entity
         return iter_func
 
+    async def filter_stream(
+        self,
+        filter_obj: Any,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> AsyncGenerator[Entity, None]:
+        # Same as filter, but entities are parsed and yielded as they
+        # arrive instead of reading the whole response first
+        async for entity in self.api_instance.stream(
+            "post", "filter" + pagination_query(limit, offset), filter_obj, timeout=timeout
+        ):
+            yield entity
+
+    async def list_stream(
+        self,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> AsyncGenerator[Entity, None]:
+        async for entity in self.api_instance.stream(
+            "get", pagination_query(limit, offset), timeout=timeout
+        ):
+            yield entity
+
     async def list_iter(self) -> Callable[[Optional[int], Optional[int]], AsyncGenerator[Any, None]]:
         return await self.filter_iter({})
 
+    def watch(
+        self,
+        filter_obj: Any = None,
+        cursor: Optional[WatchCursor] = None,
+        initial: bool = False,
+        track_updates: bool = False,
+        **kwargs,
+    ) -> EntityWatcher:
+        # Async iterator of WatchEvents, see EntityWatcher for the options
+        return EntityWatcher(self, filter_obj, cursor, initial, track_updates, **kwargs)
+
+    def replica(self, indexes: Iterable[str] = (), **kwargs) -> EntityReplica:
+        # In memory copy of the kind kept in sync once started, see
+        # EntityReplica for the options
+        return EntityReplica(self, indexes, **kwargs)
+
     async def invoke_procedure(
-        self, procedure_name: str, entity_reference: EntityReference, input_: Any
+        self,
+        procedure_name: str,
+        entity_reference: EntityReference,
+        input_: Any,
+        timeout: Optional[RequestTimeout] = None,
     ) -> Any:
         try:
             payload = {"input": input_}
             return await self.api_instance.post(
-                f"{entity_reference.uuid}/procedure/{procedure_name}", payload
+                f"{entity_reference.uuid}/procedure/{procedure_name}", payload, timeout=timeout
             )
         except:
             raise
+        finally:
+            # Procedures may change the entity, cached reads must not hide it
+            invalidate_entity(entity_reference.uuid, self.kind)
 
-    async def invoke_kind_procedure(self, procedure_name: str, input_: Any) -> Any:
+    async def invoke_kind_procedure(
+        self, procedure_name: str, input_: Any, timeout: Optional[RequestTimeout] = None
+    ) -> Any:
         try:
             payload = {"input": input_}
-            return await self.api_instance.post(f"procedure/{procedure_name}", payload)
+            return await self.api_instance.post(f"procedure/{procedure_name}", payload, timeout=timeout)
         except:
             raise
+        finally:
+            invalidate_kind(self.kind)
 
 class IntentWatcherClient(object):
     def __init__(
@@ -145,6 +527,7 @@ class IntentWatcherClient(object):
         )
 
         self.logger = logger
+        self.waiter = IntentWatcherWaiter(self, logger=logger)
 
     async def __aenter__(self) -> "IntentWatcherApi":
         return self
@@ -155,6 +538,7 @@ class IntentWatcherClient(object):
         exc_val: Optional[BaseException],
         exc_tb: Optional[TracebackType]
     ) -> None:
+        await self.waiter.close()
         await self.api_instance.close()
 
     async def get_intent_watcher(self, id: str) -> IntentWatcher:
@@ -173,24 +557,52 @@ class IntentWatcherClient(object):
     # filter_intent_watcher(AttributeDict(status=IntentfulStatus.Pending))
     async def filter_intent_watcher(self, filter_obj: Any) -> List[IntentWatcher]:
         try:
-            res = await self.api_instance.post("filter", filter_obj)
+            res = await self.api_instance.post("filter", filter_obj, idempotent=True)
             return res.results
         except:
             raise
 
+    async def filter_intent_watcher_page(
+        self, filter_obj: Any, limit: Optional[int] = None, offset: Optional[int] = None, sort: Optional[str] = None
+    ) -> FilterResults:
+        try:
+            return await self.api_instance.post(
+                "filter" + pagination_query(limit, offset, sort), filter_obj, idempotent=True
+            )
+        except:
+            raise
+
+    def wait(
+        self,
+        watcher_ref: AttributeDict,
+        watcher_status: str = IntentfulStatus.Completed_Successfully,
+        timeout_secs: Optional[float] = None,
+    ) -> asyncio.Future:
+        # Future of the watcher, all the waits of this client share one
+        # polling task, see IntentWatcherWaiter
+        return self.waiter.wait(watcher_ref, watcher_status, timeout_secs)
+
+    async def wait_all(
+        self,
+        watcher_refs: List[AttributeDict],
+        watcher_status: str = IntentfulStatus.Completed_Successfully,
+        timeout_secs: Optional[float] = None,
+    ) -> List[IntentWatcher]:
+        return await self.waiter.wait_all(watcher_refs, watcher_status, timeout_secs)
+
+    async def wait_any(
+        self,
+        watcher_refs: List[AttributeDict],
+        watcher_status: str = IntentfulStatus.Completed_Successfully,
+        timeout_secs: Optional[float] = None,
+    ) -> IntentWatcher:
+        return await self.waiter.wait_any(watcher_refs, watcher_status, timeout_secs)
+
     async def wait_for_watcher_status(self, watcher_ref: AttributeDict, watcher_status: IntentfulStatus, timeout_secs: float = 50, delay_millis: float = 500) -> bool:
+        # delay_millis is no longer used, polling is paced by the waiter
         try:
-            start_time = time.time()
-            delay_secs = delay_millis/1000
-            while True:
-                watcher = await self.get_intent_watcher(watcher_ref.uuid)
-                if watcher.status == watcher_status:
-                    return True
-                end_time = time.time()
-                time_elapsed = end_time - start_time
-                if time_elapsed > timeout_secs:
-                    raise Exception("Timeout waiting for intent watcher status")
-                time.sleep(delay_secs)
+            await self.waiter.wait(watcher_ref, watcher_status, timeout_secs)
+            return True
         except:
             raise
 
@@ -233,9 +645,11 @@ class ProviderClient(object):
             self.papiea_url, self.provider, self.version, kind, self.s2skey, self.logger
         )
 
-    async def invoke_procedure(self, procedure_name: str, input: Any) -> Any:
+    async def invoke_procedure(
+        self, procedure_name: str, input: Any, timeout: Optional[RequestTimeout] = None
+    ) -> Any:
         try:
             payload = {"input": input}
-            return await self.api_instance.post(f"procedure/{procedure_name}", payload)
+            return await self.api_instance.post(f"procedure/{procedure_name}", payload, timeout=timeout)
         except:
             raise
\ No newline at end of file
@@ -0,0 +1,210 @@
+import json
+import re
+from typing import Any, List, Optional
+
+from .utils import json_loads_attrs
+from .views import AttrView, ListView, unwrap, wrap
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _encode_view(obj: Any) -> Any:
+    # Views handed back to the SDK, e.g. a lazy entity's spec in update
+    if isinstance(obj, (AttrView, ListView)):
+        return unwrap(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class JsonCodec(object):
+    name = "json"
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":"), default=_encode_view).encode("utf-8")
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+    def loads_attrs(self, data: bytes) -> Any:
+        return json_loads_attrs(data)
+
+    def loads_view(self, data: bytes) -> Any:
+        # Plain containers are decoded far faster than AttributeDicts,
+        # attribute access is provided by views created on access
+        return wrap(self.loads(data))
+
+
+class OrjsonCodec(JsonCodec):
+    name = "orjson"
+
+    def dumps(self, obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj, default=_encode_view, option=orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            # e.g. integers wider than 64 bits, which json handles
+            return super().dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return orjson.loads(data)
+
+    # orjson can only produce plain dicts and converting them afterwards
+    # is slower than letting the json scanner build AttributeDict directly,
+    # so loads_attrs is inherited from JsonCodec
+
+
+_codec: JsonCodec = OrjsonCodec() if orjson is not None else JsonCodec()
+
+
+def get_codec() -> JsonCodec:
+    return _codec
+
+
+def set_codec(codec: JsonCodec) -> None:
+    global _codec
+    _codec = codec
+
+
+_STRUCTURAL_CHARS = re.compile(rb'["{}\[\]]')
+_STRING_END_CHARS = re.compile(rb'["\\]')
+_WHITESPACE = b" \t\r\n"
+
+
+class ItemsStreamParser(object):
+    # Incrementally splits the object items of a top level array field
+    # (e.g. "results" of a filter response) out of a JSON document fed in
+    # chunks. Only the item currently being read is kept in memory. Items
+    # must be objects or arrays, scalar items raise an exception.
+    Seek = 0
+    AfterKey = 1
+    Items = 2
+    Done = 3
+
+    def __init__(self, field: str = "results"):
+        self.key = json.dumps(field).encode("utf-8")
+        self.state = ItemsStreamParser.Seek
+        self._buf = bytearray()
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._string_start: Optional[int] = None
+        self._item_start: Optional[int] = None
+        self._items_depth = 0
+
+    def _is_key_position(self, index: int) -> bool:
+        index -= 1
+        while index >= 0 and self._buf[index] in _WHITESPACE:
+            index -= 1
+        return index >= 0 and self._buf[index] in b"{,"
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        items = []
+        if self.state == ItemsStreamParser.Done:
+            return items
+        buf = self._buf
+        buf += chunk
+        while True:
+            if self._in_string:
+                m = _STRING_END_CHARS.search(buf, self._pos)
+                if m is None:
+                    self._pos = len(buf)
+                    break
+                if buf[m.start()] == ord("\\"):
+                    if m.end() >= len(buf):
+                        self._pos = m.start()
+                        break
+                    self._pos = m.end() + 1
+                    continue
+                self._in_string = False
+                self._pos = m.end()
+                if self._string_start is not None:
+                    if buf[self._string_start:self._pos] == self.key:
+                        self.state = ItemsStreamParser.AfterKey
+                    self._string_start = None
+                continue
+            m = _STRUCTURAL_CHARS.search(buf, self._pos)
+            if m is None:
+                self._check_between_items(self._pos, len(buf))
+                self._pos = len(buf)
+                break
+            self._check_between_items(self._pos, m.start())
+            char = buf[m.start()]
+            self._pos = m.end()
+            if self.state == ItemsStreamParser.AfterKey:
+                if char == ord("["):
+                    self.state = ItemsStreamParser.Items
+                    self._depth += 1
+                    self._items_depth = self._depth
+                    continue
+                self.state = ItemsStreamParser.Seek
+            if char == ord('"'):
+                if self._between_items():
+                    raise Exception(f"Items of {self.key.decode()} must be objects, got a string")
+                self._in_string = True
+                if (
+                    self.state == ItemsStreamParser.Seek
+                    and self._depth == 1
+                    and self._is_key_position(m.start())
+                ):
+                    self._string_start = m.start()
+            elif char == ord("{") or char == ord("["):
+                if (
+                    self.state == ItemsStreamParser.Items
+                    and self._depth == self._items_depth
+                ):
+                    self._item_start = m.start()
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self.state == ItemsStreamParser.Items:
+                    if self._depth == self._items_depth and self._item_start is not None:
+                        items.append(bytes(buf[self._item_start:self._pos]))
+                        self._item_start = None
+                    elif self._depth < self._items_depth:
+                        self.state = ItemsStreamParser.Done
+                        break
+        self._compact()
+        return items
+
+    def _between_items(self) -> bool:
+        return (
+            self.state == ItemsStreamParser.Items
+            and self._depth == self._items_depth
+            and self._item_start is None
+        )
+
+    def _check_between_items(self, start: int, end: int) -> None:
+        # Only separators may come between items, anything else is a
+        # number, boolean or null item
+        if self._between_items() and self._buf[start:end].strip(b" \t\r\n,"):
+            raise Exception(f"Items of {self.key.decode()} must be objects, got {bytes(self._buf[start:end]).strip()!r}")
+
+    def close(self) -> None:
+        # Raises if the document ended within the array or any other value
+        truncated = self.state in (ItemsStreamParser.AfterKey, ItemsStreamParser.Items) or (
+            self.state == ItemsStreamParser.Seek and (self._depth > 0 or self._in_string)
+        )
+        if truncated:
+            raise Exception("Response ended before the end of the JSON document")
+
+    def _compact(self) -> None:
+        if self.state == ItemsStreamParser.Done:
+            self._buf = bytearray()
+            self._pos = 0
+            return
+        keep_from = self._pos
+        if self._item_start is not None:
+            keep_from = self._item_start
+        elif self._string_start is not None:
+            keep_from = self._string_start
+        elif self.state == ItemsStreamParser.Seek:
+            # Key position check needs to look back at the previous token
+            keep_from = max(0, keep_from - 64)
+        if keep_from > 0:
+            del self._buf[:keep_from]
+            self._pos -= keep_from
+            if self._item_start is not None:
+                self._item_start -= keep_from
+            if self._string_start is not None:
+                self._string_start -= keep_from
@@ -0,0 +1,125 @@
+import time
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+# zlib wbits producing the framing expected for each content encoding
+ENCODING_WBITS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+SIZE_BUCKETS = [1024, 4 * 1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024]
+
+
+class CompressionStats(object):
+    # Payload counters grouped by uncompressed size, meant for tuning
+    # CompressionConfig.threshold
+    def __init__(self, buckets: List[int] = SIZE_BUCKETS):
+        self.buckets = buckets
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def _bucket(self, size: int) -> str:
+        for bound in self.buckets:
+            if size <= bound:
+                return f"<={bound}"
+        return f">{self.buckets[-1]}"
+
+    def _entry(self, size: int) -> Dict[str, float]:
+        name = self._bucket(size)
+        entry = self._stats.get(name)
+        if entry is None:
+            entry = self._stats[name] = dict(
+                count=0, compressed_count=0, original_bytes=0, compressed_bytes=0, compress_secs=0.0
+            )
+        return entry
+
+    def record_skipped(self, size: int) -> None:
+        entry = self._entry(size)
+        entry["count"] += 1
+        entry["original_bytes"] += size
+        entry["compressed_bytes"] += size
+
+    def record_compressed(self, size: int, compressed_size: int, elapsed: float) -> None:
+        entry = self._entry(size)
+        entry["count"] += 1
+        entry["compressed_count"] += 1
+        entry["original_bytes"] += size
+        entry["compressed_bytes"] += compressed_size
+        entry["compress_secs"] += elapsed
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        res = {}
+        for name, entry in self._stats.items():
+            entry = dict(entry)
+            if entry["original_bytes"]:
+                entry["ratio"] = entry["compressed_bytes"] / entry["original_bytes"]
+            res[name] = entry
+        return res
+
+    def reset(self) -> None:
+        self._stats = {}
+
+
+class CompressionConfig(object):
+    def __init__(
+        self,
+        threshold: int = 4 * 1024,
+        encoding: str = "gzip",
+        level: int = 6,
+        stats: Optional[CompressionStats] = None,
+    ):
+        if encoding not in ENCODING_WBITS:
+            raise Exception(f"Unsupported content encoding: {encoding}")
+        # Bodies smaller than threshold bytes are sent as is
+        self.threshold = threshold
+        self.encoding = encoding
+        self.level = level
+        self.stats = stats or CompressionStats()
+
+    @property
+    def accept_encoding(self) -> str:
+        return ", ".join(ENCODING_WBITS.keys())
+
+    def negotiate(self, accept_encoding: str) -> Optional[str]:
+        accepted = set()
+        for part in accept_encoding.split(","):
+            name, _, params = part.strip().partition(";")
+            if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+                continue
+            accepted.add(name.strip().lower())
+        if self.encoding in accepted or "*" in accepted:
+            return self.encoding
+        for encoding in ENCODING_WBITS:
+            if encoding in accepted:
+                return encoding
+        return None
+
+    def compress(self, body: bytes, encoding: Optional[str] = None) -> Tuple[bytes, Optional[str]]:
+        encoding = encoding or self.encoding
+        if len(body) < self.threshold:
+            self.stats.record_skipped(len(body))
+            return body, None
+        start = time.perf_counter()
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, ENCODING_WBITS[encoding])
+        compressed = compressor.compress(body) + compressor.flush()
+        self.stats.record_compressed(len(body), len(compressed), time.perf_counter() - start)
+        return compressed, encoding
+
+
+def compression_middleware(config: CompressionConfig) -> Callable:
+    @web.middleware
+    async def middleware(request: web.Request, handler):
+        resp = await handler(request)
+        if (
+            isinstance(resp, web.Response)
+            and isinstance(resp.body, bytes)
+            and "Content-Encoding" not in resp.headers
+        ):
+            encoding = config.negotiate(request.headers.get("Accept-Encoding", ""))
+            if encoding is not None:
+                body, encoding = config.compress(resp.body, encoding)
+                if encoding is not None:
+                    resp.body = body
+                    resp.headers["Content-Encoding"] = encoding
+                    resp.headers["Vary"] = "Accept-Encoding"
+        return resp
+
+    return middleware
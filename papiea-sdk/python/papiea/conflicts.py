@@ -0,0 +1,162 @@
+import asyncio
+import inspect
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional, Union
+
+from .core import AttributeDict, Entity, EntityReference, EntitySpec, Spec
+from .python_sdk_exceptions import ConflictingEntityException
+from .retry import RetryBudget, RetryPolicy
+from .views import materialize
+
+# Takes a copy of the current entity and returns the new spec, or None
+# when it changed entity.spec in place
+MutateFn = Callable[[Entity], Union[Optional[Spec], Awaitable[Optional[Spec]]]]
+
+
+class EntityContention(object):
+    def __init__(self, kind: Optional[str]):
+        self.kind = kind
+        self.updates = 0
+        self.conflicts = 0
+        # Updates given up on because of conflicts
+        self.exhausted = 0
+        self.backoff_secs = 0.0
+        self.last_conflict: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return dict(
+            kind=self.kind,
+            updates=self.updates,
+            conflicts=self.conflicts,
+            exhausted=self.exhausted,
+            backoff_secs=self.backoff_secs,
+            conflict_ratio=self.conflicts / (self.updates + self.conflicts) if self.updates + self.conflicts else 0.0,
+        )
+
+
+class ContentionStats(object):
+    # Conflict counters of read-modify-write updates per entity, to find
+    # hot spots. Only entities that saw a conflict are kept, the least
+    # recently conflicting ones are dropped past max_entities.
+    def __init__(self, max_entities: int = 1000):
+        self.max_entities = max_entities
+        self.reset()
+
+    def _entry(self, uuid: str, kind: Optional[str]) -> EntityContention:
+        entry = self._entities.get(uuid)
+        if entry is None:
+            entry = self._entities[uuid] = EntityContention(kind)
+            while len(self._entities) > self.max_entities:
+                self._entities.popitem(last=False)
+        self._entities.move_to_end(uuid)
+        return entry
+
+    def record_update(self, uuid: str, kind: Optional[str]) -> None:
+        self.updates += 1
+        entry = self._entities.get(uuid)
+        if entry is not None:
+            entry.updates += 1
+
+    def record_conflict(self, uuid: str, kind: Optional[str], backoff: float) -> None:
+        self.conflicts += 1
+        entry = self._entry(uuid, kind)
+        entry.conflicts += 1
+        entry.backoff_secs += backoff
+        entry.last_conflict = time.time()
+
+    def record_exhausted(self, uuid: str, kind: Optional[str]) -> None:
+        self.exhausted += 1
+        self._entry(uuid, kind).exhausted += 1
+
+    def hot_spots(self, top: int = 10) -> List[dict]:
+        entries = sorted(self._entities.items(), key=lambda item: item[1].conflicts, reverse=True)
+        return [dict(uuid=uuid, **entry.to_dict()) for uuid, entry in entries[:top]]
+
+    def snapshot(self, top: int = 10) -> dict:
+        return dict(
+            updates=self.updates,
+            conflicts=self.conflicts,
+            exhausted=self.exhausted,
+            hot_spots=self.hot_spots(top),
+        )
+
+    def reset(self) -> None:
+        self.updates = 0
+        self.conflicts = 0
+        self.exhausted = 0
+        self._entities: "OrderedDict[str, EntityContention]" = OrderedDict()
+
+
+_contention_stats = ContentionStats()
+
+
+def get_contention_stats() -> ContentionStats:
+    return _contention_stats
+
+
+class ConflictPolicy(RetryPolicy):
+    # Retries of a conflicting update start right away with a fresh read,
+    # so a short backoff is enough to spread the contending writers
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        backoff_base: float = 0.02,
+        backoff_max: float = 1.0,
+        jitter: bool = True,
+        budget: Optional[RetryBudget] = None,
+    ):
+        super().__init__(max_attempts, backoff_base, backoff_max, jitter)
+        # Shared between updates, caps the retries all of them make together
+        self.budget = budget
+
+
+async def update_with(
+    client,
+    entity_reference: Union[EntityReference, Entity],
+    mutate_fn: MutateFn,
+    policy: Optional[ConflictPolicy] = None,
+    stats: Optional[ContentionStats] = None,
+    timeout=None,
+) -> EntitySpec:
+    policy = policy or ConflictPolicy()
+    stats = stats or _contention_stats
+    uuid = entity_reference.uuid if "uuid" in entity_reference else entity_reference.metadata.uuid
+    kind = client.kind
+    if "spec" in entity_reference and "metadata" in entity_reference:
+        # An entity read earlier saves the first GET
+        entity = materialize(entity_reference)
+    else:
+        # A stale cached entity only costs a conflict
+        entity = await client.get(AttributeDict(uuid=uuid, kind=kind), timeout)
+    attempt = 1
+    while True:
+        current = materialize(entity)
+        spec = mutate_fn(current)
+        if inspect.isawaitable(spec):
+            spec = await spec
+        if spec is None:
+            spec = current.spec
+        if spec == entity.spec:
+            return AttributeDict(metadata=entity.metadata, spec=entity.spec, watcher=None)
+        try:
+            res = await client.update(entity.metadata, spec, timeout)
+        except ConflictingEntityException:
+            if attempt >= policy.max_attempts or (policy.budget is not None and not policy.budget.withdraw()):
+                stats.record_conflict(uuid, kind, 0.0)
+                stats.record_exhausted(uuid, kind)
+                raise
+            delay = policy.backoff(attempt)
+            stats.record_conflict(uuid, kind, delay)
+            attempt += 1
+            await asyncio.sleep(delay)
+            entity = await client.get(AttributeDict(uuid=uuid, kind=kind), timeout, max_staleness=0)
+            continue
+        if policy.budget is not None:
+            policy.budget.deposit()
+        stats.record_update(uuid, kind)
+        # The engine bumps spec_version by one on every update, so the
+        # entity can be carried on without reading it back
+        metadata = AttributeDict(entity.metadata)
+        metadata.spec_version = entity.metadata.spec_version + 1
+        return AttributeDict(metadata=metadata, spec=spec, watcher=res.get("watcher") if res else None)
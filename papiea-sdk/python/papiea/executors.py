@@ -0,0 +1,160 @@
+import asyncio
+import contextvars
+import inspect
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Coroutine, List, Optional, Tuple
+
+from multidict import CIMultiDict
+
+
+class ExecutionMode(str):
+    # On the event loop, for async handlers and quick plain functions
+    Loop = "loop"
+    # Plain functions in a thread pool, for blocking calls
+    Thread = "thread"
+    # Plain functions in a process pool, for CPU heavy work
+    Process = "process"
+
+
+EXECUTION_MODES = frozenset([ExecutionMode.Loop, ExecutionMode.Thread, ExecutionMode.Process])
+
+
+def check_handler(handler: Callable, mode: str) -> None:
+    if mode not in EXECUTION_MODES:
+        raise Exception(f"Unknown execution mode {mode}")
+    if mode != ExecutionMode.Loop and inspect.iscoroutinefunction(handler):
+        raise Exception(f"Handlers running in {mode} mode must be plain functions")
+
+
+class HandlerPools(object):
+    # Pools are only started once a handler uses them. mp_context picks
+    # how worker processes are started, e.g. multiprocessing.get_context("spawn").
+    def __init__(
+        self,
+        thread_workers: Optional[int] = None,
+        process_workers: Optional[int] = None,
+        mp_context: Any = None,
+    ):
+        self.thread_workers = thread_workers
+        self.process_workers = process_workers
+        self.mp_context = mp_context
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def thread_pool(self) -> ThreadPoolExecutor:
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(self.thread_workers, thread_name_prefix="papiea-handler")
+        return self._thread_pool
+
+    @property
+    def process_pool(self) -> ProcessPoolExecutor:
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(self.process_workers, mp_context=self.mp_context)
+        return self._process_pool
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait)
+            self._thread_pool = None
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait)
+            self._process_pool = None
+
+
+class ThreadCtx(object):
+    # Context given to handlers running in a worker thread. Async methods
+    # of the ProceduralCtx, like update_status, become blocking calls that
+    # run on the event loop of the callback.
+    def __init__(self, ctx, loop: asyncio.AbstractEventLoop):
+        self._ctx = ctx
+        self._loop = loop
+
+    def run(self, coro: Coroutine) -> Any:
+        # Runs any coroutine on the callback's loop, e.g. calls of an
+        # entity client, and waits for its result
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._ctx, name)
+        if inspect.iscoroutinefunction(attr):
+            return lambda *args, **kwargs: self.run(attr(*args, **kwargs))
+        return attr
+
+
+class ProcessCtx(object):
+    # Context given to handlers running in a worker process. Status
+    # updates are recorded and made on the event loop in order once the
+    # handler returns, calls that need an answer from the engine are not
+    # available.
+    def __init__(self, provider_prefix: str, provider_version: str, headers: CIMultiDict, remaining: Optional[float]):
+        self.provider_prefix = provider_prefix
+        self.provider_version = provider_version
+        self.headers = headers
+        self.operations: List[Tuple[str, tuple]] = []
+        # Wall clock since monotonic time is not shared between processes
+        self._deadline = time.time() + remaining if remaining is not None else None
+
+    @staticmethod
+    def from_ctx(ctx) -> "ProcessCtx":
+        return ProcessCtx(ctx.provider_prefix, ctx.provider_version, CIMultiDict(ctx.headers), ctx.remaining_time())
+
+    def __getattr__(self, name: str) -> Any:
+        raise AttributeError(f"ctx.{name} is not available to handlers running in a process")
+
+    def update_status(self, entity_reference, status) -> None:
+        self.operations.append(("update_status", (entity_reference, status)))
+
+    def replace_status(self, entity_reference, status) -> None:
+        self.operations.append(("replace_status", (entity_reference, status)))
+
+    def remaining_time(self) -> Optional[float]:
+        if self._deadline is None:
+            return None
+        return self._deadline - time.time()
+
+    def get_headers(self) -> CIMultiDict:
+        return self.headers
+
+    def get_invoking_token(self) -> str:
+        if "authorization" in self.headers:
+            parts = self.headers["authorization"].split(" ")
+            if parts[0] == "Bearer":
+                return parts[1]
+        raise Exception("No invoking user")
+
+
+def _call_in_process(
+    handler: Callable, ctx: ProcessCtx, args: tuple
+) -> Tuple[Any, Optional[Exception], List[Tuple[str, tuple]]]:
+    # Status updates made before a failure are sent back with the error,
+    # like in the other modes where they are already made
+    try:
+        return handler(ctx, *args), None, ctx.operations
+    except Exception as e:
+        return None, e, ctx.operations
+
+
+async def execute(handler: Callable, ctx, args: tuple, mode: str, pools: HandlerPools) -> Any:
+    # Workers can not be interrupted, a handler running past the
+    # callback deadline keeps its worker until it returns
+    if mode == ExecutionMode.Loop:
+        result = handler(ctx, *args)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+    loop = asyncio.get_running_loop()
+    if mode == ExecutionMode.Thread:
+        # Deadline and tracing context follow the handler to the thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(pools.thread_pool, context.run, handler, ThreadCtx(ctx, loop), *args)
+    process_ctx = ProcessCtx.from_ctx(ctx)
+    result, error, operations = await loop.run_in_executor(
+        pools.process_pool, _call_in_process, handler, process_ctx, args
+    )
+    for name, operation_args in operations:
+        await getattr(ctx, name)(*operation_args)
+    if error is not None:
+        raise error
+    return result
@@ -0,0 +1,267 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+from .core import AttributeDict, IntentfulStatus, IntentWatcher
+from .python_sdk_exceptions import IntentWatcherStatusException, IntentWatcherTimeoutException
+
+LIVE_STATUSES = [IntentfulStatus.Pending, IntentfulStatus.Active]
+FINAL_STATUSES = frozenset([
+    IntentfulStatus.Completed_Successfully,
+    IntentfulStatus.Completed_Partially,
+    IntentfulStatus.Failed,
+    IntentfulStatus.Outdated,
+])
+
+
+class WaiterStats(object):
+    def __init__(self):
+        self.reset()
+
+    def snapshot(self) -> Dict[str, int]:
+        return dict(
+            polls=self.polls,
+            filter_requests=self.filter_requests,
+            get_requests=self.get_requests,
+            resolved=self.resolved,
+            failed=self.failed,
+            timeouts=self.timeouts,
+            errors=self.errors,
+        )
+
+    def reset(self) -> None:
+        self.polls = 0
+        self.filter_requests = 0
+        self.get_requests = 0
+        self.resolved = 0
+        # Watchers ending with another final status than the one waited for
+        self.failed = 0
+        self.timeouts = 0
+        self.errors = 0
+
+
+class _Wait(object):
+    def __init__(self, uuid: str, status: str, future: asyncio.Future, deadline: Optional[float]):
+        self.uuid = uuid
+        self.status = status
+        self.future = future
+        self.deadline = deadline
+
+
+class IntentWatcherWaiter(object):
+    # Waits on any number of intent watchers with a single polling task.
+    # Up to filter_threshold waited watchers are read one by one, the
+    # filter can't select by uuid and would page through every watcher in
+    # progress on the engine. Above it every tick reads the watchers still
+    # in progress with one paged filter, waited watchers missing from it
+    # have reached a final status and are read once each. The tick
+    # interval doubles up to max_interval while nothing changes.
+    def __init__(
+        self,
+        client,
+        min_interval: float = 0.2,
+        max_interval: float = 5.0,
+        page_size: int = 1000,
+        concurrency: int = 20,
+        filter_threshold: int = 20,
+        logger: logging.Logger = logging.getLogger(__name__),
+    ):
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.filter_threshold = filter_threshold
+        self.logger = logger
+        self.stats = WaiterStats()
+        self._waits: Dict[str, List[_Wait]] = {}
+        self._statuses: Dict[str, str] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._interval = min_interval
+
+    def __len__(self) -> int:
+        return sum(len(waits) for waits in self._waits.values())
+
+    def wait(
+        self,
+        watcher_ref: AttributeDict,
+        status: str = IntentfulStatus.Completed_Successfully,
+        timeout: Optional[float] = None,
+    ) -> asyncio.Future:
+        # Future of the watcher once it has the status, fails with
+        # IntentWatcherStatusException if it ends with another one
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        wait = _Wait(watcher_ref.uuid, status, future, deadline)
+        self._waits.setdefault(wait.uuid, []).append(wait)
+        future.add_done_callback(lambda _: self._forget(wait))
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        self._interval = self.min_interval
+        self._wake.set()
+        return future
+
+    async def wait_all(
+        self,
+        watcher_refs: List[AttributeDict],
+        status: str = IntentfulStatus.Completed_Successfully,
+        timeout: Optional[float] = None,
+    ) -> List[IntentWatcher]:
+        futures = [self.wait(ref, status, timeout) for ref in watcher_refs]
+        try:
+            return await asyncio.gather(*futures)
+        finally:
+            for future in futures:
+                future.cancel()
+
+    async def wait_any(
+        self,
+        watcher_refs: List[AttributeDict],
+        status: str = IntentfulStatus.Completed_Successfully,
+        timeout: Optional[float] = None,
+    ) -> IntentWatcher:
+        # First watcher to get the status, fails only once all of them did
+        if not watcher_refs:
+            raise Exception("No intent watchers to wait for")
+        futures = [self.wait(ref, status, timeout) for ref in watcher_refs]
+        pending = set(futures)
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        return future.result()
+                    error = future.exception()
+            raise error
+        finally:
+            for future in futures:
+                future.cancel()
+
+    async def close(self) -> None:
+        for waits in list(self._waits.values()):
+            for wait in waits:
+                wait.future.cancel()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _forget(self, wait: _Wait) -> None:
+        waits = self._waits.get(wait.uuid)
+        if waits is None:
+            return
+        if wait in waits:
+            waits.remove(wait)
+        if not waits:
+            del self._waits[wait.uuid]
+            self._statuses.pop(wait.uuid, None)
+
+    async def _run(self) -> None:
+        while self._waits:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self._sleep_time())
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            self._expire()
+            if not self._waits:
+                break
+            try:
+                changed = await self._tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats.errors += 1
+                self.logger.warning(f"Failed to poll intent watchers: {e}")
+                changed = False
+            if changed:
+                self._interval = self.min_interval
+            else:
+                self._interval = min(self.max_interval, self._interval * 2)
+
+    def _sleep_time(self) -> float:
+        deadlines = [wait.deadline for waits in self._waits.values() for wait in waits if wait.deadline is not None]
+        if not deadlines:
+            return self._interval
+        return max(0.0, min(self._interval, min(deadlines) - time.monotonic()))
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        for waits in list(self._waits.values()):
+            for wait in list(waits):
+                if wait.deadline is not None and wait.deadline <= now and not wait.future.done():
+                    self.stats.timeouts += 1
+                    wait.future.set_exception(IntentWatcherTimeoutException())
+
+    async def _tick(self) -> bool:
+        uuids = {uuid for uuid, waits in self._waits.items() if any(not wait.future.done() for wait in waits)}
+        if not uuids:
+            return False
+        self.stats.polls += 1
+        if len(uuids) <= self.filter_threshold:
+            watchers = await self._get_watchers(uuids)
+            return self._settle_all(watchers)
+        live_filter = {"status": {"$in": LIVE_STATUSES}}
+        res = await self.client.filter_intent_watcher_page(live_filter, self.page_size, None, "uuid:asc")
+        self.stats.filter_requests += 1
+        watchers = {watcher.uuid: watcher for watcher in res.results if watcher.uuid in uuids}
+        offsets = list(range(self.page_size, res.entity_count, self.page_size))
+        unknown = uuids - set(watchers)
+        # Reading the rest of a big in progress set can take more requests
+        # than reading the waited watchers one by one
+        if offsets and len(offsets) < len(unknown):
+            pages = await asyncio.gather(*[
+                self.client.filter_intent_watcher_page(live_filter, self.page_size, offset, "uuid:asc")
+                for offset in offsets
+            ])
+            self.stats.filter_requests += len(pages)
+            for page in pages:
+                watchers.update((watcher.uuid, watcher) for watcher in page.results if watcher.uuid in uuids)
+            unknown = uuids - set(watchers)
+        watchers.update(await self._get_watchers(unknown))
+        return self._settle_all(watchers)
+
+    async def _get_watchers(self, uuids) -> Dict[str, IntentWatcher]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def get(uuid: str) -> Optional[IntentWatcher]:
+            async with semaphore:
+                self.stats.get_requests += 1
+                try:
+                    return await self.client.get_intent_watcher(uuid)
+                except Exception as e:
+                    # Retried on the next tick, the waits' timeouts bound it
+                    self.stats.errors += 1
+                    self.logger.warning(f"Failed to read intent watcher {uuid}: {e}")
+                    return None
+
+        watchers = await asyncio.gather(*[get(uuid) for uuid in uuids])
+        return {watcher.uuid: watcher for watcher in watchers if watcher is not None}
+
+    def _settle_all(self, watchers: Dict[str, IntentWatcher]) -> bool:
+        changed = False
+        for watcher in watchers.values():
+            changed = self._settle(watcher) or changed
+        return changed
+
+    def _settle(self, watcher: IntentWatcher) -> bool:
+        # Whether anything moved, which keeps the polling fast
+        settled = self._statuses.get(watcher.uuid) != watcher.status
+        self._statuses[watcher.uuid] = watcher.status
+        for wait in list(self._waits.get(watcher.uuid, ())):
+            if wait.future.done():
+                continue
+            if watcher.status == wait.status:
+                self.stats.resolved += 1
+                wait.future.set_result(watcher)
+                settled = True
+            elif watcher.status in FINAL_STATUSES:
+                self.stats.failed += 1
+                wait.future.set_exception(IntentWatcherStatusException(watcher))
+                settled = True
+        return settled
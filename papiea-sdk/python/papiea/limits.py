@@ -0,0 +1,203 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Optional
+
+from .python_sdk_exceptions import ConcurrencyLimitException
+from .timeouts import remaining_time
+
+
+def _wait_budget(max_wait: Optional[float]) -> Optional[float]:
+    # Waiting never outlives the deadline of the callback being handled
+    remaining = remaining_time()
+    if remaining is None:
+        return max_wait
+    if max_wait is None:
+        return max(0.0, remaining)
+    return max(0.0, min(max_wait, remaining))
+
+
+class ConcurrencyLimiter(object):
+    # Caps the number of requests in flight, excess requests wait in a
+    # bounded FIFO queue for at most max_wait seconds
+    def __init__(self, limit: int = 100, max_queue: int = 1000, max_wait: Optional[float] = 30):
+        self._limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.rejected = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> None:
+        if self.in_flight < self._limit and not self._waiters:
+            self.in_flight += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise ConcurrencyLimitException(
+                f"Request queue is full ({self.max_queue} waiting, limit {self._limit})"
+            )
+        fut = asyncio.get_event_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await asyncio.wait_for(fut, _wait_budget(self.max_wait))
+        except BaseException as e:
+            if fut.done() and not fut.cancelled():
+                # Slot was handed over right as we gave up waiting
+                self._release_slot()
+            elif fut in self._waiters:
+                self._waiters.remove(fut)
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected += 1
+                raise ConcurrencyLimitException(
+                    f"Timed out waiting for a request slot (limit {self._limit})"
+                )
+            raise
+
+    def release(self, latency: Optional[float] = None, failed: bool = False) -> None:
+        self.on_sample(latency, failed)
+        self._release_slot()
+
+    def on_sample(self, latency: Optional[float], failed: bool) -> None:
+        pass
+
+    def _release_slot(self) -> None:
+        self.in_flight -= 1
+        self._wake_waiters()
+
+    def _wake_waiters(self) -> None:
+        while self._waiters and self.in_flight < self._limit:
+            fut = self._waiters.popleft()
+            if fut.done():
+                continue
+            self.in_flight += 1
+            fut.set_result(None)
+
+
+class AIMDLimiter(ConcurrencyLimiter):
+    # Additive increase, multiplicative decrease: the limit grows by one
+    # after a full window of healthy requests and is cut by backoff_ratio
+    # when a request fails or latencies rise above their baseline
+    def __init__(
+        self,
+        initial_limit: int = 10,
+        min_limit: int = 1,
+        max_limit: int = 200,
+        backoff_ratio: float = 0.5,
+        latency_threshold: Optional[float] = None,
+        latency_tolerance: float = 2.0,
+        deviation_tolerance: float = 4.0,
+        max_queue: int = 1000,
+        max_wait: Optional[float] = 30,
+        short_window: int = 50,
+        long_window: int = 1000,
+    ):
+        super().__init__(initial_limit, max_queue, max_wait)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        # Without an explicit threshold the average latency of about the
+        # last short_window requests is compared to that of the last
+        # long_window ones, so a mix of fast and slow routes is not taken
+        # for overload and the baseline follows lasting changes
+        self.latency_threshold = latency_threshold
+        self.latency_tolerance = latency_tolerance
+        self.deviation_tolerance = deviation_tolerance
+        self._short_alpha = 2 / (short_window + 1)
+        self._long_alpha = 2 / (long_window + 1)
+        self.short_latency: Optional[float] = None
+        self.long_latency: Optional[float] = None
+        self.latency_deviation = 0.0
+        self._samples = 0
+        self._successes = 0
+        self._ignore_drops = 0
+
+    def is_overloaded(self, latency: Optional[float]) -> bool:
+        if latency is None:
+            return False
+        if self.latency_threshold is not None:
+            return latency > self.latency_threshold
+        self._samples += 1
+        if self.short_latency is None:
+            self.short_latency = self.long_latency = latency
+            return False
+        # Plain means until the windows fill up, so that the first
+        # requests do not skew the baseline
+        long_alpha = max(self._long_alpha, 1 / self._samples)
+        self.short_latency += max(self._short_alpha, 1 / self._samples) * (latency - self.short_latency)
+        self.latency_deviation += long_alpha * (abs(latency - self.long_latency) - self.latency_deviation)
+        self.long_latency += long_alpha * (latency - self.long_latency)
+        # A few rare slow routes make the average jumpy, their spread
+        # widens the margin
+        threshold = max(
+            self.long_latency * self.latency_tolerance,
+            self.long_latency + self.deviation_tolerance * self.latency_deviation,
+        )
+        return self.short_latency > threshold
+
+    def on_sample(self, latency: Optional[float], failed: bool) -> None:
+        if self._ignore_drops > 0:
+            self._ignore_drops -= 1
+        if failed or self.is_overloaded(latency):
+            self._successes = 0
+            # Requests started before the last decrease saw the old limit,
+            # their drops must not shrink the limit once more
+            if self._ignore_drops == 0:
+                self._limit = max(self.min_limit, int(self._limit * self.backoff_ratio))
+                self._ignore_drops = self.in_flight
+            return
+        # Only grow while the current limit is actually being used
+        if self.in_flight * 2 >= self._limit:
+            self._successes += 1
+            if self._successes >= self._limit:
+                self._successes = 0
+                self._limit = min(self.max_limit, self._limit + 1)
+                self._wake_waiters()
+
+
+class TokenBucket(object):
+    # Static rate limit of rate requests per second with bursts of up to
+    # burst requests
+    def __init__(self, rate: float, burst: Optional[float] = None, max_wait: Optional[float] = 30):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.max_wait = max_wait
+        self.rejected = 0
+        self._tokens = self.burst
+        self._last_refill = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    @property
+    def tokens(self) -> float:
+        self._refill()
+        return self._tokens
+
+    async def acquire(self) -> None:
+        self._refill()
+        # Tokens go negative to reserve a turn, which keeps waiters in order
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return
+        wait = -self._tokens / self.rate
+        budget = _wait_budget(self.max_wait)
+        if budget is not None and wait > budget:
+            self._tokens += 1
+            self.rejected += 1
+            raise ConcurrencyLimitException(f"Rate limit of {self.rate} requests/s exceeded")
+        try:
+            await asyncio.sleep(wait)
+        except BaseException:
+            self._tokens += 1
+            raise
@@ -0,0 +1,194 @@
+import bisect
+import logging
+import re
+from typing import Dict, List, Optional
+
+# Latency histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = [
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+]
+
+_UUID_SEGMENT = re.compile(
+    r"/[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}(?=/|$)"
+)
+
+
+def route_template(path: str) -> str:
+    # Keeps route cardinality bounded, entity and watcher ids become {uuid}
+    path = path.split("?", 1)[0]
+    return _UUID_SEGMENT.sub("/{uuid}", path)
+
+
+class RequestSample(object):
+    def __init__(
+        self,
+        host: str,
+        method: str,
+        route: str,
+        status: Optional[int],
+        latency: float,
+        request_bytes: int,
+        response_bytes: int,
+        attempt: int = 1,
+        error: Optional[str] = None,
+    ):
+        self.host = host
+        self.method = method
+        self.route = route
+        # None when no response was received at all
+        self.status = status
+        self.latency = latency
+        self.request_bytes = request_bytes
+        self.response_bytes = response_bytes
+        self.attempt = attempt
+        self.error = error
+
+
+class MetricsSink(object):
+    # Receives a call for every HTTP exchange with the engine, the
+    # methods run inline with the request and should not block
+    def on_request(self, sample: RequestSample) -> None:
+        pass
+
+    def on_retry(self, host: str, method: str, route: str, attempt: int, error: str) -> None:
+        pass
+
+    def on_session_renewal(self, host: str) -> None:
+        pass
+
+
+class Histogram(object):
+    def __init__(self, buckets: List[float] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> Optional[float]:
+        # Upper bound of the bucket holding the q-th value
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self) -> dict:
+        return dict(
+            count=self.count,
+            sum=self.sum,
+            max=self.max,
+            mean=self.sum / self.count if self.count else None,
+            p50=self.percentile(0.5),
+            p90=self.percentile(0.9),
+            p99=self.percentile(0.99),
+            buckets={str(bound): count for bound, count in zip(self.buckets + ["inf"], self.counts)},
+        )
+
+
+class RouteStats(object):
+    def __init__(self):
+        self.latency = Histogram()
+        self.statuses: Dict[str, int] = {}
+        self.errors = 0
+        self.retries = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+    def to_dict(self) -> dict:
+        return dict(
+            latency=self.latency.to_dict(),
+            statuses=dict(self.statuses),
+            errors=self.errors,
+            retries=self.retries,
+            request_bytes=self.request_bytes,
+            response_bytes=self.response_bytes,
+        )
+
+
+class MetricsAggregator(MetricsSink):
+    # In memory per route aggregation, constant memory per route
+    def __init__(self):
+        self.routes: Dict[str, RouteStats] = {}
+        self.session_renewals: Dict[str, int] = {}
+
+    def _route(self, method: str, route: str) -> RouteStats:
+        key = f"{method.upper()} {route}"
+        stats = self.routes.get(key)
+        if stats is None:
+            stats = self.routes[key] = RouteStats()
+        return stats
+
+    def on_request(self, sample: RequestSample) -> None:
+        stats = self._route(sample.method, sample.route)
+        stats.latency.observe(sample.latency)
+        status = str(sample.status) if sample.status is not None else "none"
+        stats.statuses[status] = stats.statuses.get(status, 0) + 1
+        if sample.error is not None:
+            stats.errors += 1
+        stats.request_bytes += sample.request_bytes
+        stats.response_bytes += sample.response_bytes
+
+    def on_retry(self, host: str, method: str, route: str, attempt: int, error: str) -> None:
+        self._route(method, route).retries += 1
+
+    def on_session_renewal(self, host: str) -> None:
+        self.session_renewals[host] = self.session_renewals.get(host, 0) + 1
+
+    def snapshot(self) -> dict:
+        return dict(
+            routes={key: stats.to_dict() for key, stats in self.routes.items()},
+            session_renewals=dict(self.session_renewals),
+        )
+
+    def reset(self) -> None:
+        self.routes = {}
+        self.session_renewals = {}
+
+
+_sinks: List[MetricsSink] = []
+
+
+def add_sink(sink: MetricsSink) -> MetricsSink:
+    _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink: MetricsSink) -> None:
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+def get_sinks() -> List[MetricsSink]:
+    return _sinks
+
+
+def _emit(method: str, *args) -> None:
+    for sink in _sinks:
+        try:
+            getattr(sink, method)(*args)
+        except Exception:
+            logging.getLogger(__name__).exception(f"Metrics sink {sink!r} failed")
+
+
+def record_request(sample: RequestSample) -> None:
+    _emit("on_request", sample)
+
+
+def record_retry(host: str, method: str, route: str, attempt: int, error: str) -> None:
+    _emit("on_retry", host, method, route, attempt, error)
+
+
+def record_session_renewal(host: str) -> None:
+    _emit("on_session_renewal", host)
@@ -0,0 +1,145 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, Awaitable, Callable, Deque, Optional, Tuple
+
+# Response of one page request and the size of its body in bytes
+FetchPage = Callable[[int, Optional[int]], Awaitable[Tuple[Any, int]]]
+
+
+class PaginationProgress(object):
+    def __init__(self):
+        self.pages = 0
+        self.entities = 0
+        self.bytes = 0
+        # Entity count reported by the engine for the whole query
+        self.total: Optional[int] = None
+        self.page_size: Optional[int] = None
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def to_dict(self) -> dict:
+        return dict(
+            pages=self.pages,
+            entities=self.entities,
+            bytes=self.bytes,
+            total=self.total,
+            page_size=self.page_size,
+            elapsed=self.elapsed,
+        )
+
+
+class PageSizer(object):
+    # Pages grow while they come back fast and shrink when they get slow,
+    # never exceeding max_page_bytes at the observed size per entity
+    def __init__(
+        self,
+        initial_size: int = 20,
+        min_size: int = 10,
+        max_size: int = 1000,
+        target_latency: float = 0.2,
+        max_page_bytes: int = 1024 * 1024,
+    ):
+        self.size = initial_size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.max_page_bytes = max_page_bytes
+
+    def observe(self, count: int, nbytes: int, latency: float) -> None:
+        if count == 0:
+            return
+        size = self.size
+        if latency < self.target_latency / 2:
+            size *= 2
+        elif latency > self.target_latency:
+            size = int(size * self.target_latency / latency)
+        size = min(size, self.max_page_bytes * count // max(nbytes, 1))
+        self.size = max(self.min_size, min(self.max_size, size))
+
+
+class Paginator(object):
+    # Iterates the results of a paginated query without recursion, with up
+    # to prefetch further pages requested while the current one is consumed
+    def __init__(
+        self,
+        fetch_page: FetchPage,
+        page_size: Optional[int] = None,
+        offset: Optional[int] = None,
+        prefetch: int = 1,
+        sizer: Optional[PageSizer] = None,
+        on_progress: Optional[Callable[[PaginationProgress], None]] = None,
+    ):
+        self.fetch_page = fetch_page
+        # A fixed page size disables adaptive sizing
+        self.page_size = page_size
+        self.offset = offset or 0
+        self.prefetch = prefetch
+        self.sizer = sizer or PageSizer()
+        self.on_progress = on_progress
+        self.progress = PaginationProgress()
+
+    def __aiter__(self) -> AsyncGenerator[Any, None]:
+        return self.iterate()
+
+    def next_page_size(self) -> int:
+        return self.page_size or self.sizer.size
+
+    async def _fetch(self, limit: int, offset: int) -> Tuple[Any, int, float]:
+        start = time.monotonic()
+        res, nbytes = await self.fetch_page(limit, offset)
+        return res, nbytes, time.monotonic() - start
+
+    async def iterate(self) -> AsyncGenerator[Any, None]:
+        pending: Deque[Tuple[int, asyncio.Future]] = deque()
+        next_offset = self.offset
+
+        def schedule() -> None:
+            nonlocal next_offset
+            limit = self.next_page_size()
+            pending.append((limit, asyncio.ensure_future(self._fetch(limit, next_offset))))
+            next_offset += limit
+
+        try:
+            schedule()
+            while pending:
+                limit, fut = pending.popleft()
+                res, nbytes, latency = await fut
+                results = res.results if res else []
+                last = len(results) < limit
+                if last:
+                    # Short page is the last one, nothing to read ahead
+                    _discard(pending)
+                else:
+                    if self.page_size is None:
+                        self.sizer.observe(len(results), nbytes, latency)
+                    while len(pending) < self.prefetch:
+                        schedule()
+                self.progress.pages += 1
+                self.progress.entities += len(results)
+                self.progress.bytes += nbytes
+                self.progress.page_size = limit
+                if res and res.get("entity_count") is not None:
+                    self.progress.total = res.entity_count
+                if self.on_progress is not None:
+                    self.on_progress(self.progress)
+                for entity in results:
+                    yield entity
+                if not last and not pending:
+                    schedule()
+        finally:
+            _discard(pending)
+
+
+def _discard(pending: Deque[Tuple[int, asyncio.Future]]) -> None:
+    for _, fut in pending:
+        if fut.done():
+            if not fut.cancelled():
+                # Nobody will look at errors of pages read ahead for nothing
+                fut.exception()
+        else:
+            fut.cancel()
+    pending.clear()
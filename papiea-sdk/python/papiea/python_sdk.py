@@ -1,11 +1,18 @@
+import asyncio
 import logging
+import time
 from types import TracebackType
 from typing import Any, Callable, List, NoReturn, Optional, Type
 
 from aiohttp import web
 
-from .api import ApiInstance
+from . import tracing
+from .admission import AdmissionControl
+from .api import ApiInstance, PoolConfig, connection_pools
 from .client import IntentWatcherClient
+from .codec import get_codec
+from .compression import CompressionConfig, compression_middleware
+from .executors import ExecutionMode, HandlerPools, check_handler, execute
 from .core import (
     DataDescription,
     Entity,
@@ -22,23 +29,56 @@ from .core import (
     Version, ProcedureDescription,
 )
 from .python_sdk_context import IntentfulCtx, ProceduralCtx
-from .python_sdk_exceptions import ApiException, InvocationError, PapieaBaseException, SecurityApiError
-from .utils import json_loads_attrs, validate_error_codes
+from .python_sdk_exceptions import (
+    ApiException,
+    DeadlineExceededException,
+    InvocationError,
+    PapieaBaseException,
+    SecurityApiError,
+)
+from .timeouts import deadline_scope
+from .utils import validate_error_codes
+
+
+def json_response(data: Any, status: int = 200) -> web.Response:
+    return web.Response(
+        body=get_codec().dumps(data), status=status, content_type="application/json"
+    )
 
 
 class ProviderServerManager(object):
-    def __init__(self, public_host: str = "127.0.0.1", public_port: int = 9000):
+    def __init__(
+        self,
+        public_host: str = "127.0.0.1",
+        public_port: int = 9000,
+        compression: Optional[CompressionConfig] = None,
+        unix_socket_path: Optional[str] = None,
+        admission: Optional[AdmissionControl] = None,
+    ):
         self.public_host = public_host
         self.public_port = public_port
+        # Additional listener for clients running on the same host
+        self.unix_socket_path = unix_socket_path
         self.should_run = False
-        self.app = web.Application()
+        # Responses above the threshold are compressed if the engine accepts it
+        self.compression = compression
+        # Limits the callbacks handled at once, the healthcheck is not limited
+        self.admission = admission
+        middlewares = []
+        if compression is not None:
+            middlewares.append(compression_middleware(compression))
+        self.app = web.Application(middlewares=middlewares)
         self._runner = None
 
     def register_handler(
-        self, route: str, handler: Callable[[web.Request], web.Response]
+        self, route: str, handler: Callable[[web.Request], web.Response], timeout: Optional[float] = None
     ) -> None:
+        # timeout is the callback_timeout of the handler, time spent in the
+        # admission queue is part of it
         if not self.should_run:
             self.should_run = True
+        if self.admission is not None:
+            handler = self.admission.wrap(handler, timeout)
         self.app.add_routes([web.post(route, handler)])
 
     def register_healthcheck(self) -> None:
@@ -46,7 +86,10 @@ class ProviderServerManager(object):
             self.should_run = True
 
         async def healthcheck_callback_fn(req):
-            return web.json_response({"status": "Available"}, status=200)
+            body = {"status": "Available"}
+            if self.admission is not None:
+                body["admission"] = self.admission.snapshot()
+            return json_response(body, status=200)
 
         self.app.add_routes([web.get("/healthcheck", healthcheck_callback_fn)])
 
@@ -57,6 +100,9 @@ class ProviderServerManager(object):
             self._runner = runner
             site = web.TCPSite(runner, self.public_host, self.public_port)
             await site.start()
+            if self.unix_socket_path is not None:
+                unix_site = web.UnixSite(runner, self.unix_socket_path)
+                await unix_site.start()
 
     async def close(self) -> None:
         if self._runner is not None:
@@ -135,7 +181,13 @@ class ProviderSdk(object):
         s2skey: Secret,
         server_manager: Optional[ProviderServerManager] = None,
         allow_extra_props: bool = False,
-        logger: logging.Logger = None
+        logger: logging.Logger = None,
+        pool_config: Optional[PoolConfig] = None,
+        callback_timeout: Optional[float] = None,
+        handler_pools: Optional[HandlerPools] = None,
+        compression: Optional[CompressionConfig] = None,
+        unix_socket_path: Optional[str] = None,
+        admission: Optional[AdmissionControl] = None,
     ):
         self._version = None
         self._prefix = None
@@ -144,10 +196,19 @@ class ProviderSdk(object):
         self.logger = logger
         self.papiea_url = papiea_url
         self._s2skey = s2skey
+        # Time budget in seconds of a single callback handler, should be
+        # below the engine's own invocation timeout
+        self.callback_timeout = callback_timeout
+        # Workers of the handlers registered in thread or process mode
+        self.handler_pools = handler_pools or HandlerPools()
+        if pool_config is not None:
+            connection_pools.configure(pool_config, papiea_url)
         if server_manager is not None:
             self._server_manager = server_manager
         else:
-            self._server_manager = ProviderServerManager()
+            self._server_manager = ProviderServerManager(
+                compression=compression, unix_socket_path=unix_socket_path, admission=admission
+            )
         self._procedures = {}
         self.meta_ext = {}
         self.allow_extra_props = allow_extra_props
@@ -174,6 +235,7 @@ class ProviderSdk(object):
         exc_val: Optional[BaseException],
         exc_tb: Optional[TracebackType],
     ) -> None:
+        self.handler_pools.shutdown(wait=False)
         await self._provider_api.close()
 
     @property
@@ -266,7 +328,9 @@ class ProviderSdk(object):
         name: str,
         procedure_description: ProcedureDescription,
         handler: Callable[[ProceduralCtx, Any], Any],
+        execution_mode: str = ExecutionMode.Loop,
     ) -> "ProviderSdk":
+        check_handler(handler, execution_mode)
         procedure_callback_url = self._server_manager.procedure_callback_url(name)
         callback_url = self._server_manager.callback_url()
         validate_error_codes(procedure_description.get("errors_schemas"))
@@ -286,18 +350,18 @@ class ProviderSdk(object):
 
         async def procedure_callback_fn(req):
             try:
-                body_obj = json_loads_attrs(await req.text())
-                result = await handler(
-                    ProceduralCtx(self, prefix, version, req.headers), body_obj
+                body_obj = get_codec().loads_attrs(await req.read())
+                result = await self.run_handler(
+                    handler, ProceduralCtx(self, prefix, version, req.headers), body_obj, mode=execution_mode
                 )
-                return web.json_response(result)
+                return json_response(result)
             except InvocationError as e:
-                return web.json_response(e.to_response(), status=e.status_code)
+                return json_response(e.to_response(), status=e.status_code)
             except Exception as e:
                 e = InvocationError.from_error(e)
-                return web.json_response(e.to_response(), status=e.status_code)
+                return json_response(e.to_response(), status=e.status_code)
 
-        self._server_manager.register_handler("/" + name, procedure_callback_fn)
+        self._server_manager.register_handler("/" + name, procedure_callback_fn, self.callback_timeout)
         return self
 
     async def register(self) -> None:
@@ -320,6 +384,7 @@ class ProviderSdk(object):
                 self._provider.oauth2 = self._oauth2
             if self._authModel is not None:
                 self._provider.authModel = self._authModel
+            await self._provider_api.pool.prewarm()
             await self._provider_api.post("/", self._provider)
             await self._server_manager.start_server()
         elif self._prefix is None:
@@ -329,6 +394,41 @@ class ProviderSdk(object):
         elif len(self._kind) == 0:
             ProviderSdk._provider_description_error("kind")
 
+    async def run_handler(
+        self, handler: Callable, ctx: ProceduralCtx, *args, mode: str = ExecutionMode.Loop
+    ) -> Any:
+        parent = ctx.trace_context
+        if parent is None and not tracing.is_active():
+            return await self._run_handler(handler, ctx, *args, mode=mode)
+        # Engine calls made by the handler become children of this span
+        with tracing.start_span(
+            f"callback {getattr(handler, '__name__', 'handler')}",
+            kind="server",
+            parent=parent,
+            attributes={"provider.prefix": ctx.provider_prefix, "provider.version": ctx.provider_version},
+        ) as span:
+            ctx.span = span
+            ctx.spans.append(span)
+            return await self._run_handler(handler, ctx, *args, mode=mode)
+
+    async def _run_handler(
+        self, handler: Callable, ctx: ProceduralCtx, *args, mode: str = ExecutionMode.Loop
+    ) -> Any:
+        # Engine calls made while handling the callback, through the
+        # context or any other client, are bounded by its deadline
+        with deadline_scope(self.callback_timeout) as deadline:
+            ctx.deadline = deadline
+            if deadline is None:
+                return await execute(handler, ctx, args, mode, self.handler_pools)
+            try:
+                return await asyncio.wait_for(
+                    execute(handler, ctx, args, mode, self.handler_pools), deadline - time.monotonic()
+                )
+            except asyncio.TimeoutError:
+                raise DeadlineExceededException(
+                    f"Handler did not finish within {self.callback_timeout}s"
+                )
+
     def power(self, state: ProviderPower) -> ProviderPower:
         raise Exception("Unimplemented")
 
@@ -343,10 +443,31 @@ class ProviderSdk(object):
         public_host: Optional[str],
         public_port: Optional[int],
         allow_extra_props: bool = False,
-        logger: logging.Logger = logging.getLogger(__name__)
+        logger: logging.Logger = logging.getLogger(__name__),
+        pool_config: Optional[PoolConfig] = None,
+        callback_timeout: Optional[float] = None,
+        admission: Optional[AdmissionControl] = None,
+        handler_pools: Optional[HandlerPools] = None,
+        compression: Optional[CompressionConfig] = None,
+        unix_socket_path: Optional[str] = None,
     ) -> "ProviderSdk":
-        server_manager = ProviderServerManager(public_host, public_port)
-        return ProviderSdk(papiea_url, s2skey, server_manager, allow_extra_props, logger)
+        server_manager = ProviderServerManager(
+            public_host,
+            public_port,
+            compression=compression,
+            unix_socket_path=unix_socket_path,
+            admission=admission,
+        )
+        return ProviderSdk(
+            papiea_url,
+            s2skey,
+            server_manager,
+            allow_extra_props,
+            logger,
+            pool_config,
+            callback_timeout,
+            handler_pools,
+        )
 
     def secure_with(
         self, oauth_config: Any, casbin_model: str, casbin_initial_policy: str
@@ -396,7 +517,9 @@ class KindBuilder(object):
         name: str,
         procedure_description: ProcedureDescription,
         handler: Callable[[ProceduralCtx, Entity, Any], Any],
+        execution_mode: str = ExecutionMode.Loop,
     ) -> "KindBuilder":
+        check_handler(handler, execution_mode)
         procedure_callback_url = self.server_manager.procedure_callback_url(
             name, self.kind.name
         )
@@ -418,8 +541,9 @@ class KindBuilder(object):
 
         async def procedure_callback_fn(req):
             try:
-                body_obj = json_loads_attrs(await req.text())
-                result = await handler(
+                body_obj = get_codec().loads_attrs(await req.read())
+                result = await self.provider.run_handler(
+                    handler,
                     ProceduralCtx(self.provider, prefix, version, req.headers),
                     Entity(
                         metadata=body_obj.metadata,
@@ -427,16 +551,17 @@ class KindBuilder(object):
                         status=body_obj.get("status", {}),
                     ),
                     body_obj.input,
+                    mode=execution_mode,
                 )
-                return web.json_response(result)
+                return json_response(result)
             except InvocationError as e:
-                return web.json_response(e.to_response(), status=e.status_code)
+                return json_response(e.to_response(), status=e.status_code)
             except Exception as e:
                 e = InvocationError.from_error(e)
-                return web.json_response(e.to_response(), status=e.status_code)
+                return json_response(e.to_response(), status=e.status_code)
 
         self.server_manager.register_handler(
-            f"/{self.kind.name}/{name}", procedure_callback_fn
+            f"/{self.kind.name}/{name}", procedure_callback_fn, self.provider.callback_timeout
         )
         return self
 
@@ -445,7 +570,9 @@ class KindBuilder(object):
         name: str,
         procedure_description: ProcedureDescription,
         handler: Callable[[ProceduralCtx, Any], Any],
+        execution_mode: str = ExecutionMode.Loop,
     ) -> "KindBuilder":
+        check_handler(handler, execution_mode)
         procedure_callback_url = self.server_manager.procedure_callback_url(
             name, self.kind.name
         )
@@ -467,26 +594,32 @@ class KindBuilder(object):
 
         async def procedure_callback_fn(req):
             try:
-                body_obj = json_loads_attrs(await req.text())
-                result = await handler(
+                body_obj = get_codec().loads_attrs(await req.read())
+                result = await self.provider.run_handler(
+                    handler,
                     ProceduralCtx(self.provider, prefix, version, req.headers),
                     body_obj.input,
+                    mode=execution_mode,
                 )
-                return web.json_response(result)
+                return json_response(result)
             except InvocationError as e:
-                return web.json_response(e.to_response(), status=e.status_code)
+                return json_response(e.to_response(), status=e.status_code)
             except Exception as e:
                 e = InvocationError.from_error(e)
-                return web.json_response(e.to_response(), status=e.status_code)
+                return json_response(e.to_response(), status=e.status_code)
 
         self.server_manager.register_handler(
-            f"/{self.kind.name}/{name}", procedure_callback_fn
+            f"/{self.kind.name}/{name}", procedure_callback_fn, self.provider.callback_timeout
         )
         return self
 
     def on(
-        self, sfs_signature: str, handler: Callable[[IntentfulCtx, Entity, Any], Any],
+        self,
+        sfs_signature: str,
+        handler: Callable[[IntentfulCtx, Entity, Any], Any],
+        execution_mode: str = ExecutionMode.Loop,
     ) -> "KindBuilder":
+        check_handler(handler, execution_mode)
         procedure_callback_url = self.server_manager.procedure_callback_url(
             sfs_signature, self.kind.name
         )
@@ -529,8 +662,9 @@ class KindBuilder(object):
 
         async def procedure_callback_fn(req):
             try:
-                body_obj = json_loads_attrs(await req.text())
-                result = await handler(
+                body_obj = get_codec().loads_attrs(await req.read())
+                result = await self.provider.run_handler(
+                    handler,
                     ProceduralCtx(self.provider, prefix, version, req.headers),
                     Entity(
                         metadata=body_obj.metadata,
@@ -538,32 +672,36 @@ class KindBuilder(object):
                         status=body_obj.get("status", {}),
                     ),
                     body_obj.input,
+                    mode=execution_mode,
                 )
-                return web.json_response(result)
+                return json_response(result)
             except InvocationError as e:
-                return web.json_response(e.to_response(), status=e.status_code)
+                return json_response(e.to_response(), status=e.status_code)
             except Exception as e:
                 e = InvocationError.from_error(e)
-                return web.json_response(e.to_response(), status=e.status_code)
+                return json_response(e.to_response(), status=e.status_code)
         self.server_manager.register_handler(
-            f"/{self.kind.name}/{sfs_signature}", procedure_callback_fn
+            f"/{self.kind.name}/{sfs_signature}", procedure_callback_fn, self.provider.callback_timeout
         )
         self.server_manager.register_healthcheck()
         return self
 
-    def on_create(self, handler: Callable[[ProceduralCtx, Any], Any],) -> "KindBuilder":
+    def on_create(
+        self, handler: Callable[[ProceduralCtx, Any], Any], execution_mode: str = ExecutionMode.Loop
+    ) -> "KindBuilder":
         name = f"__{self.kind.name}_create"
         self.kind_procedure(
-            name, {}, handler
+            name, {}, handler, execution_mode
         )
         return self
 
     def on_delete(
         self,
         handler: Callable[[ProceduralCtx, Any], Any],
+        execution_mode: str = ExecutionMode.Loop,
     ) -> "KindBuilder":
         name = f"__{self.kind.name}_delete"
         self.kind_procedure(
-            name, {}, handler
+            name, {}, handler, execution_mode
         )
         return self
@@ -1,11 +1,17 @@
-import json
-from typing import List, Optional, Tuple
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-from aiohttp import ClientSession
 from multidict import CIMultiDict
 
+from . import tracing
+from .api import connection_pools
+from .cache import invalidate_entity
 from .client import EntityCRUD
+from .codec import get_codec
 from .core import Action, EntityReference, Secret, Status, Version
+from .timeouts import RequestTimeout, remaining_time
+from .tracing import Span, SpanContext, start_span
 
 
 class ProceduralCtx(object):
@@ -15,6 +21,7 @@ class ProceduralCtx(object):
         provider_prefix: str,
         provider_version: str,
         headers: CIMultiDict,
+        deadline: Optional[float] = None,
     ):
         self.provider_url = provider.provider_url
         self.base_url = provider.entity_url
@@ -23,6 +30,23 @@ class ProceduralCtx(object):
         self.provider_api = provider.provider_api
         self.provider = provider
         self.headers = headers
+        # time.monotonic() based deadline of the callback being handled
+        self.deadline = deadline
+        # Server span of the callback being handled and all spans started
+        # through the context, children of the engine's traceparent
+        self.span: Optional[Span] = None
+        self.spans: List[Span] = []
+
+    @property
+    def trace_context(self) -> Optional[SpanContext]:
+        return SpanContext.from_headers(self.headers)
+
+    @contextmanager
+    def start_span(self, name: str, attributes: Optional[Dict[str, Any]] = None) -> Iterator[Span]:
+        parent = self.span.context if self.span is not None else self.trace_context
+        with start_span(name, parent=parent, attributes=attributes) as span:
+            self.spans.append(span)
+            yield span
 
     def entity_client_for_user(self, entity_reference: EntityReference) -> EntityCRUD:
         return EntityCRUD(
@@ -64,36 +88,73 @@ class ProceduralCtx(object):
         headers: dict = {},
     ) -> bool:
         try:
-            data_binary = json.dumps(entity_action).encode("utf-8")
-            async with ClientSession() as session:
-                async with session.post(
-                    f"{ self.base_url }/{ provider_prefix }/{ provider_version }/check_permission",
+            codec = get_codec()
+            data_binary = codec.dumps(entity_action)
+            pool = connection_pools.get(self.base_url)
+            headers = dict(headers)
+            span = None
+            if tracing.is_active():
+                span = tracing.new_span(f"POST {provider_prefix}/{provider_version}/check_permission", kind="client")
+                span.context.inject(headers)
+            try:
+                async with pool.session.post(
+                    pool.request_url(f"{ self.base_url }/{ provider_prefix }/{ provider_version }/check_permission"),
                     data=data_binary,
                     headers=headers,
+                    timeout=RequestTimeout().client_timeout(),
                 ) as resp:
-                    res = await resp.text()
-            res = json.loads(res)
+                    if span is not None:
+                        span.set_attribute("http.status_code", resp.status)
+                    res = await resp.read()
+            except Exception as e:
+                if span is not None:
+                    span.end(e)
+                raise
+            finally:
+                if span is not None:
+                    span.end()
+            res = codec.loads(res)
             return res["success"] == "Ok"
         except Exception as e:
             return False
 
+    def _invalidate_cached(self, entity_reference: EntityReference) -> None:
+        # References may be plain dicts, e.g. coming back from a worker process
+        uuid = entity_reference.get("uuid")
+        if uuid is not None:
+            invalidate_entity(uuid, entity_reference.get("kind"))
+
     async def update_status(
         self, entity_reference: EntityReference, status: Status
     ):
         url = f"{self.provider.get_prefix()}/{self.provider.get_version()}"
-        await self.provider_api.patch(
-            f"{url}/update_status",
-            {"entity_ref": entity_reference, "status": status},
-        )
+        try:
+            await self.provider_api.patch(
+                f"{url}/update_status",
+                {"entity_ref": entity_reference, "status": status},
+                idempotent=True,
+            )
+        except BaseException:
+            # A failed request may still have reached the engine
+            self._invalidate_cached(entity_reference)
+            raise
+        self._invalidate_cached(entity_reference)
 
     async def replace_status(
         self, entity_reference: EntityReference, status: Status
     ):
         url = f"{self.provider.get_prefix()}/{self.provider.get_version()}"
-        await self.provider_api.post(
-            f"{url}/update_status",
-            {"entity_ref": entity_reference, "status": status},
-        )
+        try:
+            await self.provider_api.post(
+                f"{url}/update_status",
+                {"entity_ref": entity_reference, "status": status},
+                idempotent=True,
+            )
+        except BaseException:
+            # A failed request may still have reached the engine
+            self._invalidate_cached(entity_reference)
+            raise
+        self._invalidate_cached(entity_reference)
 
     def update_progress(self, message: str, done_percent: int) -> bool:
         raise Exception("Unimplemented")
@@ -104,6 +165,11 @@ class ProceduralCtx(object):
     def get_user_security_api(self, user_s2skey: Secret):
         return self.provider.new_security_api(user_s2skey)
 
+    def remaining_time(self) -> Optional[float]:
+        if self.deadline is None:
+            return remaining_time()
+        return self.deadline - time.monotonic()
+
     def get_headers(self) -> CIMultiDict:
         return self.headers
 
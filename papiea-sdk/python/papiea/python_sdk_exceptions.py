@@ -16,6 +16,34 @@ class ApiException(Exception):
         self.details = details
 
 
+class CircuitOpenException(Exception):
+    def __init__(self, host: str, retry_after: float):
+        super().__init__(f"Circuit breaker for {host} is open, retry in {retry_after:.1f}s")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class DeadlineExceededException(Exception):
+    def __init__(self, message: str = "Deadline of the current callback exceeded"):
+        super().__init__(message)
+
+
+class ConcurrencyLimitException(Exception):
+    pass
+
+
+class IntentWatcherTimeoutException(Exception):
+    def __init__(self, message: str = "Timeout waiting for intent watcher status"):
+        super().__init__(message)
+
+
+class IntentWatcherStatusException(Exception):
+    # Watcher reached a final status other than the one waited for
+    def __init__(self, watcher: Any):
+        super().__init__(f"Intent watcher {watcher.uuid} ended with status {watcher.status}")
+        self.watcher = watcher
+
+
 async def check_response(resp: ClientResponse, logger: logging.Logger):
     if resp.status >= 400:
         await PapieaBaseException.raise_error(resp, logger)
@@ -0,0 +1,521 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from .cache import add_invalidation_listener, remove_invalidation_listener
+from .core import AttributeDict, Entity
+from .python_sdk_exceptions import EntityNotFoundException
+from .views import AttrView, materialize, unwrap
+from .watch import EntityWatcher, WatchEventType
+
+# Engine page size when filter is called without a limit
+DEFAULT_LIMIT = 30
+
+Path = Tuple[str, ...]
+Condition = Tuple[Path, Any]
+
+COMPARISON_OPERATORS = frozenset(["$gt", "$gte", "$lt", "$lte"])
+SUPPORTED_OPERATORS = frozenset(["$eq", "$ne", "$in", "$nin", "$exists"]) | COMPARISON_OPERATORS
+
+
+class UnsupportedFilter(Exception):
+    pass
+
+
+def _is_operator(cond: Any) -> bool:
+    return isinstance(cond, dict) and bool(cond) and all(key.startswith("$") for key in cond)
+
+
+def _check_operators(cond: dict) -> None:
+    for op, value in cond.items():
+        if op not in SUPPORTED_OPERATORS:
+            raise UnsupportedFilter(f"Operator {op} is not supported")
+        if op in ("$in", "$nin") and not isinstance(value, list):
+            raise UnsupportedFilter(f"Operator {op} takes a list")
+
+
+def _flatten(value: dict, prefix: Path, conditions: List[Condition]) -> None:
+    # Same as the dot notation the engine turns spec and status filters
+    # into, nested objects match field by field and lists as a whole
+    for key, item in value.items():
+        if key.startswith("$"):
+            raise UnsupportedFilter(f"Operator {key} is not supported here")
+        path = prefix + tuple(key.split("."))
+        if isinstance(item, dict):
+            if _is_operator(item):
+                _check_operators(item)
+                conditions.append((path, item))
+            elif any(key.startswith("$") for key in item):
+                raise UnsupportedFilter(f"Mixed operators and fields under {'.'.join(path)}")
+            else:
+                _flatten(item, path, conditions)
+        else:
+            conditions.append((path, item))
+
+
+def compile_filter(filter_obj: Any, exact: bool = False) -> List[Condition]:
+    filter_obj = filter_obj or {}
+    conditions: List[Condition] = []
+    metadata = filter_obj.get("metadata") or {}
+    if "deleted_at" in metadata:
+        raise UnsupportedFilter("Deleted entities are not replicated")
+    # Metadata fields go to the engine's database as given
+    for key, cond in metadata.items():
+        if key.startswith("$"):
+            raise UnsupportedFilter(f"Operator {key} is not supported")
+        if _is_operator(cond):
+            _check_operators(cond)
+        conditions.append((("metadata",) + tuple(key.split(".")), cond))
+    for part in ("spec", "status"):
+        value = filter_obj.get(part)
+        if not value:
+            continue
+        if exact:
+            conditions.append(((part,), value))
+        else:
+            _flatten(value, (part,), conditions)
+    return conditions
+
+
+def resolve(doc: Any, path: Path) -> List[Any]:
+    # Values found at a path, lists on the way are looked into like the
+    # database does
+    if not path:
+        return [doc]
+    if isinstance(doc, list):
+        values = []
+        if path[0].isdigit() and int(path[0]) < len(doc):
+            values.extend(resolve(doc[int(path[0])], path[1:]))
+        for item in doc:
+            if isinstance(item, dict):
+                values.extend(resolve(item, path))
+        return values
+    if isinstance(doc, dict) and path[0] in doc:
+        return resolve(doc[path[0]], path[1:])
+    return []
+
+
+def _equal(a: Any, b: Any) -> bool:
+    # True is not 1 for the database
+    if isinstance(a, bool) != isinstance(b, bool):
+        return False
+    return a == b
+
+
+def _matches_value(values: List[Any], expected: Any) -> bool:
+    if not values:
+        return expected is None
+    for value in values:
+        if _equal(value, expected):
+            return True
+        if isinstance(value, list) and not isinstance(expected, list):
+            if any(_equal(item, expected) for item in value):
+                return True
+    return False
+
+
+def _compare(values: List[Any], op: str, expected: Any) -> bool:
+    for value in values:
+        candidates = value if isinstance(value, list) else [value]
+        for candidate in candidates:
+            if candidate is None or isinstance(candidate, bool) != isinstance(expected, bool):
+                continue
+            try:
+                if (
+                    (op == "$gt" and candidate > expected)
+                    or (op == "$gte" and candidate >= expected)
+                    or (op == "$lt" and candidate < expected)
+                    or (op == "$lte" and candidate <= expected)
+                ):
+                    return True
+            except TypeError:
+                continue
+    return False
+
+
+def matches(entity: Any, conditions: List[Condition]) -> bool:
+    for path, cond in conditions:
+        values = resolve(entity, path)
+        if not _is_operator(cond):
+            if not _matches_value(values, cond):
+                return False
+            continue
+        for op, expected in cond.items():
+            if op == "$eq":
+                ok = _matches_value(values, expected)
+            elif op == "$ne":
+                ok = not _matches_value(values, expected)
+            elif op == "$in":
+                ok = any(_matches_value(values, item) for item in expected)
+            elif op == "$nin":
+                ok = not any(_matches_value(values, item) for item in expected)
+            elif op == "$exists":
+                ok = bool(values) == bool(expected)
+            else:
+                ok = _compare(values, op, expected)
+            if not ok:
+                return False
+    return True
+
+
+def _index_key(value: Any) -> Hashable:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True, default=str)
+    return value
+
+
+def _sort(entities: List[Any], sort: str) -> List[Any]:
+    fields = []
+    for field_query in sort.split(","):
+        field, _, order = field_query.partition(":")
+        if order not in ("", "asc", "desc"):
+            raise UnsupportedFilter(f"Invalid sort order {order}")
+        fields.append((tuple(field.split(".")), order == "desc"))
+    # Stable sorts from the last key to the first
+    for path, descending in reversed(fields):
+        def key(entity):
+            values = resolve(entity, path)
+            value = values[0] if values else None
+            return (value is not None, value)
+        try:
+            entities = sorted(entities, key=key, reverse=descending)
+        except TypeError:
+            raise UnsupportedFilter(f"Values of {'.'.join(path)} can not be ordered")
+    return entities
+
+
+class ReplicaStats(object):
+    def __init__(self):
+        self.reset()
+
+    def snapshot(self) -> Dict[str, float]:
+        return dict(
+            polls=self.polls,
+            full_syncs=self.full_syncs,
+            created=self.created,
+            updated=self.updated,
+            deleted=self.deleted,
+            refreshes=self.refreshes,
+            errors=self.errors,
+            local_queries=self.local_queries,
+            index_queries=self.index_queries,
+            remote_queries=self.remote_queries,
+        )
+
+    def reset(self) -> None:
+        self.polls = 0
+        self.full_syncs = 0
+        self.created = 0
+        self.updated = 0
+        self.deleted = 0
+        # Entities read again after a write made by this process
+        self.refreshes = 0
+        self.errors = 0
+        self.local_queries = 0
+        self.index_queries = 0
+        # Filters the replica can not answer and sends to the engine
+        self.remote_queries = 0
+
+
+class EntityReplica(object):
+    # Local copy of all entities of a kind, answering filter queries in
+    # memory. Creations and deletions are picked up by polling an
+    # EntityWatcher. The engine keeps no modification timestamp, so
+    # updates made by other processes show up on the full sync done
+    # every full_sync_interval seconds. Writes made by this process are
+    # read back right away.
+    def __init__(
+        self,
+        client,
+        indexes: Iterable[str] = (),
+        full_sync_interval: float = 60.0,
+        min_interval: float = 0.5,
+        max_interval: float = 5.0,
+        page_size: int = 100,
+        parallelism: int = 4,
+        logger: logging.Logger = logging.getLogger(__name__),
+    ):
+        self.client = client
+        self.kind = client.kind
+        self.full_sync_interval = full_sync_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.page_size = page_size
+        self.parallelism = parallelism
+        self.logger = logger
+        self.stats = ReplicaStats()
+        self.watcher = EntityWatcher(
+            client, min_interval=min_interval, max_interval=max_interval, page_size=page_size
+        )
+        self._entities: Dict[str, Any] = {}
+        self._indexes: Dict[Path, Dict[Hashable, Set[str]]] = {tuple(path.split(".")): {} for path in indexes}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._refreshing: Dict[str, bool] = {}
+        # time.monotonic() of the last poll and full sync, these drive the
+        # syncing and are not reset with the stats
+        self.last_poll: Optional[float] = None
+        self.last_full_sync: Optional[float] = None
+        self._refresh_tasks: Set[asyncio.Task] = set()
+
+    async def __aenter__(self) -> "EntityReplica":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.stop()
+
+    def __len__(self) -> int:
+        return len(self._entities)
+
+    @property
+    def ready(self) -> bool:
+        return self.last_full_sync is not None
+
+    def snapshot(self) -> Dict[str, float]:
+        now = time.monotonic()
+        snapshot = self.stats.snapshot()
+        # Seconds since the replica last caught up with creations and
+        # deletions, and since it last compared every spec_version
+        snapshot["lag"] = now - self.last_poll if self.last_poll is not None else None
+        snapshot["full_sync_age"] = now - self.last_full_sync if self.last_full_sync is not None else None
+        return snapshot
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        add_invalidation_listener(self)
+        # Position the watcher before reading everything, anything created
+        # during the read is reported again by the next poll
+        await self._poll()
+        await self._full_sync()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        remove_invalidation_listener(self)
+        tasks = list(self._refresh_tasks)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self) -> None:
+        interval = self.min_interval
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                if time.monotonic() - self.last_full_sync >= self.full_sync_interval:
+                    await self._full_sync()
+                changes = await self._poll()
+                interval = self.min_interval if changes else min(self.max_interval, interval * 2)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats.errors += 1
+                self.logger.warning(f"Replica of {self.kind} failed to sync: {e}")
+                interval = self.max_interval
+
+    async def _poll(self) -> int:
+        events, cursor = await self.watcher.poll()
+        for event in events:
+            if event.type == WatchEventType.Deleted:
+                self.stats.deleted += self._remove(event.entity.metadata.uuid)
+            else:
+                self.stats.created += self._upsert(event.entity)
+        self.watcher.cursor = cursor
+        self.stats.polls += 1
+        self.last_poll = time.monotonic()
+        return len(events)
+
+    async def _full_sync(self) -> None:
+        entities = {}
+        async for entity in self.client.iter_all(None, self.page_size, self.parallelism, lazy=True):
+            entity = unwrap(entity)
+            entities[entity["metadata"]["uuid"]] = entity
+        for uuid, entity in entities.items():
+            current = self._entities.get(uuid)
+            if current is None:
+                continue
+            # Read back by a refresh while the listing was in progress
+            if _spec_version(current) > _spec_version(entity):
+                entities[uuid] = current
+            elif _spec_version(current) < _spec_version(entity):
+                self.stats.updated += 1
+        self._entities = entities
+        for path, index in self._indexes.items():
+            index.clear()
+            for uuid, entity in entities.items():
+                self._index(path, index, uuid, entity)
+        self.stats.full_syncs += 1
+        self.last_full_sync = time.monotonic()
+
+    def _index(self, path: Path, index: Dict[Hashable, Set[str]], uuid: str, entity: Any) -> None:
+        for key in self._index_keys(entity, path):
+            index.setdefault(key, set()).add(uuid)
+
+    def _unindex(self, uuid: str, entity: Any) -> None:
+        for path, index in self._indexes.items():
+            for key in self._index_keys(entity, path):
+                uuids = index.get(key)
+                if uuids is not None:
+                    uuids.discard(uuid)
+                    if not uuids:
+                        del index[key]
+
+    @staticmethod
+    def _index_keys(entity: Any, path: Path) -> Set[Hashable]:
+        keys = set()
+        for value in resolve(entity, path):
+            keys.add(_index_key(value))
+            # Equality with a list field matches its items too
+            if isinstance(value, list):
+                keys.update(_index_key(item) for item in value)
+        return keys
+
+    def _upsert(self, entity: Any) -> int:
+        entity = unwrap(entity)
+        uuid = entity["metadata"]["uuid"]
+        current = self._entities.get(uuid)
+        if current is not None:
+            if _spec_version(current) > _spec_version(entity):
+                return 0
+            self._unindex(uuid, current)
+        self._entities[uuid] = entity
+        for path, index in self._indexes.items():
+            self._index(path, index, uuid, entity)
+        return 1
+
+    def _remove(self, uuid: str) -> int:
+        entity = self._entities.pop(uuid, None)
+        if entity is None:
+            return 0
+        self._unindex(uuid, entity)
+        return 1
+
+    def invalidate(self, uuid: str) -> None:
+        # Called on every local write, possibly from another thread
+        if self._loop is None or uuid not in self._entities:
+            return
+        self._loop.call_soon_threadsafe(self._schedule_refresh, uuid)
+
+    def invalidate_kind(self, kind: str) -> None:
+        # Local creations only tell the kind, poll for them right away
+        if kind == self.kind and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def _schedule_refresh(self, uuid: str) -> None:
+        # A single read per entity in flight, repeated if the entity was
+        # written again meanwhile, so the last read follows the last write
+        if uuid in self._refreshing:
+            self._refreshing[uuid] = True
+            return
+        self._refreshing[uuid] = False
+        task = self._loop.create_task(self._refresh(uuid))
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+
+    async def _refresh(self, uuid: str) -> None:
+        try:
+            while True:
+                self.stats.refreshes += 1
+                try:
+                    entity = await self.client.get(AttributeDict(uuid=uuid, kind=self.kind), max_staleness=0)
+                    self._upsert(entity)
+                except EntityNotFoundException:
+                    self._remove(uuid)
+                if not self._refreshing[uuid]:
+                    return
+                self._refreshing[uuid] = False
+        except Exception as e:
+            self.stats.errors += 1
+            self.logger.warning(f"Replica of {self.kind} failed to read {uuid} back: {e}")
+        finally:
+            del self._refreshing[uuid]
+
+    def get(self, uuid: str, lazy: bool = False) -> Optional[Entity]:
+        entity = self._entities.get(uuid)
+        if entity is None:
+            return None
+        return _result(entity, lazy)
+
+    def find(self, filter_obj: Any, exact: bool = False) -> List[Any]:
+        # All the replicated entities matching, as the replica's own
+        # objects which must not be changed, in no particular order like
+        # an unsorted engine filter. Raises UnsupportedFilter for filters
+        # only the engine can answer.
+        conditions = compile_filter(filter_obj, exact)
+        candidates = None
+        for path, cond in conditions:
+            index = self._indexes.get(path)
+            if index is None:
+                continue
+            if _is_operator(cond):
+                if set(cond) == {"$in"}:
+                    expected = cond["$in"]
+                elif set(cond) == {"$eq"}:
+                    expected = [cond["$eq"]]
+                else:
+                    continue
+            else:
+                expected = [cond]
+            # Missing fields equal null but are not in the index
+            if any(item is None for item in expected):
+                continue
+            uuids = set()
+            for item in expected:
+                uuids.update(index.get(_index_key(item), ()))
+            candidates = uuids if candidates is None else candidates & uuids
+        if candidates is None:
+            entities = self._entities.values()
+        else:
+            self.stats.index_queries += 1
+            entities = [self._entities[uuid] for uuid in candidates]
+        return [entity for entity in entities if matches(entity, conditions)]
+
+    async def filter(
+        self,
+        filter_obj: Any,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        sort: Optional[str] = None,
+        exact: Optional[bool] = None,
+        deleted: Optional[bool] = None,
+        lazy: bool = False,
+    ) -> AttributeDict:
+        # Same arguments and results as EntityCRUD.filter, filters the
+        # replica can not answer go to the engine
+        if self.ready and not deleted:
+            try:
+                results = self.find(filter_obj, bool(exact))
+                if sort:
+                    results = _sort(results, sort)
+                self.stats.local_queries += 1
+                start = offset or 0
+                page = results[start:start + (limit or DEFAULT_LIMIT)]
+                return AttributeDict(results=[_result(entity, lazy) for entity in page], entity_count=len(results))
+            except UnsupportedFilter as e:
+                self.logger.debug(f"Replica of {self.kind} sends filter to the engine: {e}")
+        self.stats.remote_queries += 1
+        return await self.client.filter(
+            filter_obj, limit=limit, offset=offset, sort=sort, exact=exact, deleted=deleted, lazy=lazy
+        )
+
+
+def _spec_version(entity: Any) -> int:
+    return entity["metadata"].get("spec_version") or 0
+
+
+def _result(entity: Any, lazy: bool) -> Any:
+    # Copies by default so that callers can change what they get
+    if lazy:
+        return AttrView(entity) if type(entity) is dict else entity
+    return materialize(entity)
@@ -0,0 +1,144 @@
+import asyncio
+import random
+import time
+from typing import FrozenSet, Optional, Tuple, Type
+
+from aiohttp import ClientConnectionError, ClientConnectorError, ClientPayloadError
+
+from papiea.python_sdk_exceptions import (
+    ApiException,
+    CircuitOpenException,
+    PapieaBaseException,
+    PapieaServerException,
+)
+
+# PUT is left out, a repeated update that had already gone through
+# fails on its stale spec_version
+IDEMPOTENT_METHODS = frozenset(["get", "head", "options", "delete"])
+RETRYABLE_STATUSES = frozenset([502, 503, 504])
+
+
+class RetryPolicy(object):
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        backoff_base: float = 0.1,
+        backoff_max: float = 5.0,
+        jitter: bool = True,
+        idempotent_methods: FrozenSet[str] = IDEMPOTENT_METHODS,
+        retryable_errors: Tuple[Type[PapieaBaseException], ...] = (PapieaServerException,),
+        retryable_statuses: FrozenSet[int] = RETRYABLE_STATUSES,
+    ):
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.idempotent_methods = idempotent_methods
+        # Papiea error types from EXCEPTION_MAP which are worth retrying,
+        # all the other ones are caused by the request itself
+        self.retryable_errors = retryable_errors
+        self.retryable_statuses = retryable_statuses
+
+    def is_idempotent(self, method: str) -> bool:
+        return method.lower() in self.idempotent_methods
+
+    def is_failure(self, e: BaseException) -> bool:
+        # Whether the error says something about engine health
+        if isinstance(e, PapieaBaseException):
+            return isinstance(e, PapieaServerException)
+        if isinstance(e, ApiException):
+            return e.status >= 500
+        return isinstance(e, (ClientConnectionError, ClientPayloadError, asyncio.TimeoutError))
+
+    def should_retry(self, method: str, e: BaseException, attempt: int, idempotent: Optional[bool] = None) -> bool:
+        if attempt >= self.max_attempts:
+            return False
+        # Connection was never established, so the request did not reach the engine
+        if isinstance(e, ClientConnectorError):
+            return True
+        if idempotent is None:
+            idempotent = self.is_idempotent(method)
+        if not idempotent:
+            return False
+        if isinstance(e, PapieaBaseException):
+            return isinstance(e, self.retryable_errors)
+        if isinstance(e, ApiException):
+            return e.status in self.retryable_statuses
+        return isinstance(e, (ClientConnectionError, ClientPayloadError, asyncio.TimeoutError))
+
+    def backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+
+# Caps retries to a fraction of the requests made to a host, so that
+# a struggling engine does not get its load multiplied by retries
+class RetryBudget(object):
+    def __init__(self, ratio: float = 0.2, min_retries_per_sec: float = 5, max_tokens: float = 100):
+        self.ratio = ratio
+        self.min_retries_per_sec = min_retries_per_sec
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._last_refill = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._last_refill) * self.min_retries_per_sec)
+        self._last_refill = now
+
+    def deposit(self) -> None:
+        self._refill()
+        self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+
+class CircuitBreaker(object):
+    Closed = "closed"
+    Open = "open"
+    HalfOpen = "half_open"
+
+    def __init__(self, host: str, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitBreaker.Closed
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    def check(self) -> None:
+        if self.state == CircuitBreaker.Closed:
+            return
+        if self.state == CircuitBreaker.Open:
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                raise CircuitOpenException(self.host, remaining)
+            self.state = CircuitBreaker.HalfOpen
+        # Half open lets a single probe request through
+        if self._probe_in_flight:
+            raise CircuitOpenException(self.host, self.reset_timeout)
+        self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._probe_in_flight = False
+        self.state = CircuitBreaker.Closed
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probe_in_flight = False
+        if self.state == CircuitBreaker.HalfOpen or self._failures >= self.failure_threshold:
+            self.state = CircuitBreaker.Open
+            self._opened_at = time.monotonic()
+
+    def record_release(self) -> None:
+        # The request finished without telling anything about engine health
+        self._probe_in_flight = False
@@ -0,0 +1,280 @@
+import asyncio
+import atexit
+import logging
+import threading
+from typing import Any, AsyncIterator, Awaitable, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .api import connection_pools
+from .bulk import ErrorPolicy, ItemResult
+from .cache import EntityCache, QueryCache
+from .client import FAN_OUT_PAGE_SIZE, EntityCRUD, FilterResults, ProviderClient
+from .conflicts import ConflictPolicy, ContentionStats, MutateFn
+from .core import Entity, EntityReference, EntitySpec, Metadata, Spec
+from .timeouts import RequestTimeout
+
+# Items moved from the loop thread to the caller per round trip while
+# iterating
+ITER_CHUNK_SIZE = 100
+
+
+class BackgroundLoop(object):
+    # Event loop running in a daemon thread. Coroutines can be submitted
+    # from any number of threads and share the loop's connection pools.
+    def __init__(self, name: str = "papiea-sdk-loop"):
+        self._name = name
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name=self._name, daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        if self._thread is threading.current_thread():
+            raise Exception("Blocking call made from the background loop itself")
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def iterate(self, iterator: AsyncIterator[Any], chunk_size: int = ITER_CHUNK_SIZE) -> Iterator[Any]:
+        async def take() -> Tuple[List[Any], bool]:
+            items = []
+            try:
+                while len(items) < chunk_size:
+                    items.append(await iterator.__anext__())
+            except StopAsyncIteration:
+                return items, True
+            return items, False
+
+        done = False
+        try:
+            while not done:
+                items, done = self.run(take())
+                yield from items
+        finally:
+            if not done and hasattr(iterator, "aclose"):
+                self.run(iterator.aclose())
+
+    def stop(self) -> None:
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(connection_pools.close_loop_sessions(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+_default_loop = BackgroundLoop()
+atexit.register(_default_loop.stop)
+
+
+def get_background_loop() -> BackgroundLoop:
+    return _default_loop
+
+
+class SyncEntityCRUD(object):
+    # Blocking counterpart of EntityCRUD for threaded code, calls run on a
+    # shared background loop and can be made from many threads at once
+    def __init__(
+        self,
+        papiea_url: str,
+        prefix: str,
+        version: str,
+        kind: str,
+        s2skey: Optional[str] = None,
+        logger: logging.Logger = logging.getLogger(__name__),
+        timeout: Union[float, RequestTimeout] = 5000,
+        cache: Optional[EntityCache] = None,
+        query_cache: Optional[QueryCache] = None,
+        background_loop: Optional[BackgroundLoop] = None,
+    ):
+        self.client = EntityCRUD(
+            papiea_url, prefix, version, kind, s2skey, logger, timeout, cache=cache, query_cache=query_cache
+        )
+        self.background_loop = background_loop or get_background_loop()
+
+    def __enter__(self) -> "SyncEntityCRUD":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        pass
+
+    def run(self, coro: Awaitable[Any]) -> Any:
+        return self.background_loop.run(coro)
+
+    def get(
+        self,
+        entity_reference: EntityReference,
+        timeout: Optional[RequestTimeout] = None,
+        max_staleness: Optional[float] = None,
+    ) -> Entity:
+        return self.run(self.client.get(entity_reference, timeout, max_staleness))
+
+    def get_many(
+        self, entity_references: List[EntityReference], concurrency: int = 20, timeout: Optional[RequestTimeout] = None
+    ) -> List[ItemResult]:
+        return self.run(self.client.get_many(entity_references, concurrency, timeout=timeout))
+
+    def get_all(
+        self,
+        timeout: Optional[RequestTimeout] = None,
+        lazy: bool = False,
+        all_pages: bool = False,
+        page_size: int = FAN_OUT_PAGE_SIZE,
+        parallelism: int = 4,
+    ) -> List[Entity]:
+        return self.run(self.client.get_all(timeout, lazy, all_pages, page_size, parallelism))
+
+    def count(self, filter_obj: Any = None, timeout: Optional[RequestTimeout] = None) -> int:
+        return self.run(self.client.count(filter_obj, timeout))
+
+    def iter_all(
+        self,
+        filter_obj: Any = None,
+        page_size: int = FAN_OUT_PAGE_SIZE,
+        parallelism: int = 4,
+        ordered: bool = True,
+        lazy: bool = False,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> Iterator[Entity]:
+        return self.background_loop.iterate(
+            self.client.iter_all(filter_obj, page_size, parallelism, ordered, lazy, timeout)
+        )
+
+    def create(
+        self, spec: Spec, metadata_extension: Optional[Any] = None, timeout: Optional[RequestTimeout] = None
+    ) -> EntitySpec:
+        return self.run(self.client.create(spec, metadata_extension, timeout))
+
+    def create_with_meta(self, metadata: Metadata, spec: Spec, timeout: Optional[RequestTimeout] = None) -> EntitySpec:
+        return self.run(self.client.create_with_meta(metadata, spec, timeout))
+
+    def update(self, metadata: Metadata, spec: Spec, timeout: Optional[RequestTimeout] = None) -> EntitySpec:
+        return self.run(self.client.update(metadata, spec, timeout))
+
+    def update_with(
+        self,
+        entity_reference: Union[EntityReference, Entity],
+        mutate_fn: MutateFn,
+        policy: Optional[ConflictPolicy] = None,
+        stats: Optional[ContentionStats] = None,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> EntitySpec:
+        # mutate_fn runs on the background loop, so it must not block for long
+        return self.run(self.client.update_with(entity_reference, mutate_fn, policy, stats, timeout))
+
+    def delete(self, entity_reference: EntityReference, timeout: Optional[RequestTimeout] = None) -> None:
+        return self.run(self.client.delete(entity_reference, timeout))
+
+    def filter(self, filter_obj: Any, **kwargs) -> FilterResults:
+        # Takes the same keyword arguments as EntityCRUD.filter
+        return self.run(self.client.filter(filter_obj, **kwargs))
+
+    def filter_iter(
+        self,
+        filter_obj: Any,
+        batch_size: Optional[int] = None,
+        offset: Optional[int] = None,
+        prefetch: int = 1,
+        lazy: bool = False,
+    ) -> Iterator[Entity]:
+        # Pages keep being read ahead on the loop while the caller works
+        # through the current one
+        return self.background_loop.iterate(
+            self.client.paginate(filter_obj, batch_size, offset, prefetch, lazy=lazy).__aiter__()
+        )
+
+    def list_iter(
+        self, batch_size: Optional[int] = None, offset: Optional[int] = None, prefetch: int = 1, lazy: bool = False
+    ) -> Iterator[Entity]:
+        return self.filter_iter({}, batch_size, offset, prefetch, lazy)
+
+    def create_many(
+        self,
+        specs: Iterable[Spec],
+        metadata_extension: Optional[Any] = None,
+        concurrency: int = 20,
+        on_error: str = ErrorPolicy.Continue,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> Iterator[ItemResult]:
+        return self.background_loop.iterate(
+            self.client.create_many(specs, metadata_extension, concurrency, on_error, timeout)
+        )
+
+    def update_many(
+        self,
+        updates: Iterable[Tuple[Metadata, Spec]],
+        concurrency: int = 20,
+        on_error: str = ErrorPolicy.Continue,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> Iterator[ItemResult]:
+        return self.background_loop.iterate(self.client.update_many(updates, concurrency, on_error, timeout))
+
+    def delete_many(
+        self,
+        entity_references: Iterable[EntityReference],
+        concurrency: int = 20,
+        on_error: str = ErrorPolicy.Continue,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> Iterator[ItemResult]:
+        return self.background_loop.iterate(
+            self.client.delete_many(entity_references, concurrency, on_error, timeout)
+        )
+
+    def invoke_procedure(
+        self,
+        procedure_name: str,
+        entity_reference: EntityReference,
+        input_: Any,
+        timeout: Optional[RequestTimeout] = None,
+    ) -> Any:
+        return self.run(self.client.invoke_procedure(procedure_name, entity_reference, input_, timeout))
+
+    def invoke_kind_procedure(self, procedure_name: str, input_: Any, timeout: Optional[RequestTimeout] = None) -> Any:
+        return self.run(self.client.invoke_kind_procedure(procedure_name, input_, timeout))
+
+
+class SyncProviderClient(object):
+    def __init__(
+        self,
+        papiea_url: str,
+        provider: str,
+        version: str,
+        s2skey: Optional[str] = None,
+        logger: logging.Logger = logging.getLogger(__name__),
+        background_loop: Optional[BackgroundLoop] = None,
+    ):
+        self.client = ProviderClient(papiea_url, provider, version, s2skey, logger)
+        self.background_loop = background_loop or get_background_loop()
+
+    def __enter__(self) -> "SyncProviderClient":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        pass
+
+    def get_kind(self, kind: str) -> SyncEntityCRUD:
+        return SyncEntityCRUD(
+            self.client.papiea_url,
+            self.client.provider,
+            self.client.version,
+            kind,
+            self.client.s2skey,
+            self.client.logger,
+            background_loop=self.background_loop,
+        )
+
+    def invoke_procedure(self, procedure_name: str, input: Any, timeout: Optional[RequestTimeout] = None) -> Any:
+        return self.background_loop.run(self.client.invoke_procedure(procedure_name, input, timeout))
@@ -0,0 +1,86 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional, Union
+
+from aiohttp import ClientTimeout
+
+from .python_sdk_exceptions import DeadlineExceededException
+
+# Absolute time.monotonic() deadline of the callback being handled in
+# the current task, engine calls made within it cannot outlive it
+_current_deadline: ContextVar[Optional[float]] = ContextVar("papiea_deadline", default=None)
+
+
+def get_deadline() -> Optional[float]:
+    return _current_deadline.get()
+
+
+def remaining_time() -> Optional[float]:
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+@contextmanager
+def deadline_scope(timeout_secs: Optional[float]) -> Iterator[Optional[float]]:
+    # Nested scopes can only shorten the deadline, never extend it
+    deadline = _current_deadline.get()
+    if timeout_secs is not None:
+        new_deadline = time.monotonic() + timeout_secs
+        if deadline is None or new_deadline < deadline:
+            deadline = new_deadline
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+class RequestTimeout(object):
+    # All values are in seconds, None means no limit
+    def __init__(
+        self,
+        total: Optional[float] = 5,
+        connect: Optional[float] = None,
+        first_byte: Optional[float] = None,
+    ):
+        self.total = total
+        self.connect = connect
+        # Time to wait for the response to start (and for every following
+        # read), maps to the socket read timeout of aiohttp
+        self.first_byte = first_byte
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, RequestTimeout):
+            return NotImplemented
+        return (self.total, self.connect, self.first_byte) == (other.total, other.connect, other.first_byte)
+
+    def __hash__(self) -> int:
+        return hash((self.total, self.connect, self.first_byte))
+
+    @staticmethod
+    def from_value(timeout: Union[float, "RequestTimeout", None]) -> "RequestTimeout":
+        if isinstance(timeout, RequestTimeout):
+            return timeout
+        if timeout is None:
+            return RequestTimeout(total=None)
+        # Plain numbers are milliseconds, same as in the typescript SDK
+        return RequestTimeout(total=timeout / 1000)
+
+    def for_stream(self) -> "RequestTimeout":
+        # A streamed response takes as long as the result is big, so only
+        # every single read is bounded, by the request total if not given
+        first_byte = self.first_byte if self.first_byte is not None else self.total
+        return RequestTimeout(total=None, connect=self.connect, first_byte=first_byte)
+
+    def client_timeout(self) -> ClientTimeout:
+        total = self.total
+        remaining = remaining_time()
+        if remaining is not None:
+            if remaining <= 0:
+                raise DeadlineExceededException()
+            if total is None or remaining < total:
+                total = remaining
+        return ClientTimeout(total=total, connect=self.connect, sock_read=self.first_byte)
@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+TRACEPARENT_HEADER = "traceparent"
+TRACESTATE_HEADER = "tracestate"
+
+_TRACEPARENT = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(-.*)?$")
+_INVALID_TRACE_ID = "0" * 32
+_INVALID_SPAN_ID = "0" * 16
+
+
+class SpanContext(object):
+    # Identifies a span across process boundaries, as carried by the
+    # W3C traceparent and tracestate headers
+    def __init__(self, trace_id: str, span_id: str, sampled: bool = True, trace_state: Optional[str] = None):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+        self.trace_state = trace_state
+
+    @staticmethod
+    def from_headers(headers) -> Optional["SpanContext"]:
+        value = headers.get(TRACEPARENT_HEADER)
+        if not value:
+            return None
+        match = _TRACEPARENT.match(value.strip().lower())
+        if match is None:
+            return None
+        version, trace_id, span_id, flags, rest = match.groups()
+        # Version ff is forbidden, version 00 has nothing after the flags
+        if version == "ff" or (version == "00" and rest):
+            return None
+        if trace_id == _INVALID_TRACE_ID or span_id == _INVALID_SPAN_ID:
+            return None
+        return SpanContext(trace_id, span_id, bool(int(flags, 16) & 1), headers.get(TRACESTATE_HEADER))
+
+    def to_traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def inject(self, headers) -> None:
+        headers[TRACEPARENT_HEADER] = self.to_traceparent()
+        if self.trace_state:
+            headers[TRACESTATE_HEADER] = self.trace_state
+
+
+class Span(object):
+    def __init__(
+        self,
+        name: str,
+        context: SpanContext,
+        parent_id: Optional[str] = None,
+        kind: str = "internal",
+        attributes: Optional[Dict[str, Any]] = None,
+    ):
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        # One of internal, server (engine callbacks) or client (engine calls)
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.start_time = time.time()
+        self.end_time: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        if self.end_time is not None:
+            return
+        self.end_time = time.time()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        if self.context.sampled:
+            export_span(self)
+
+    def to_dict(self) -> dict:
+        return dict(
+            trace_id=self.context.trace_id,
+            span_id=self.context.span_id,
+            parent_id=self.parent_id,
+            name=self.name,
+            kind=self.kind,
+            start_time=self.start_time,
+            end_time=self.end_time,
+            duration=self.duration,
+            attributes=self.attributes,
+            error=self.error,
+        )
+
+
+class SpanExporter(object):
+    # Receives every finished sampled span, export runs inline with the
+    # traced code and should not block
+    def export(self, span: Span) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        pass
+
+
+class InMemorySpanExporter(SpanExporter):
+    def __init__(self, max_spans: int = 10000):
+        self.max_spans = max_spans
+        self.spans: List[Span] = []
+
+    def export(self, span: Span) -> None:
+        if len(self.spans) < self.max_spans:
+            self.spans.append(span)
+
+    def clear(self) -> None:
+        self.spans = []
+
+
+class JsonLinesSpanExporter(SpanExporter):
+    # Appends one JSON object per span to a file, which local collectors
+    # can tail
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a")
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+_exporters: List[SpanExporter] = []
+_current_span: ContextVar[Optional[Span]] = ContextVar("papiea_span", default=None)
+
+
+def add_exporter(exporter: SpanExporter) -> SpanExporter:
+    _exporters.append(exporter)
+    return exporter
+
+
+def remove_exporter(exporter: SpanExporter) -> None:
+    if exporter in _exporters:
+        _exporters.remove(exporter)
+
+
+def export_span(span: Span) -> None:
+    for exporter in _exporters:
+        try:
+            exporter.export(span)
+        except Exception:
+            logging.getLogger(__name__).exception(f"Span exporter {exporter!r} failed")
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def is_active() -> bool:
+    # Spans are only created within a trace or when someone collects them
+    return bool(_exporters) or _current_span.get() is not None
+
+
+def new_span(
+    name: str,
+    kind: str = "internal",
+    parent: Optional[SpanContext] = None,
+    attributes: Optional[Dict[str, Any]] = None,
+) -> Span:
+    if parent is None:
+        parent_span = _current_span.get()
+        parent = parent_span.context if parent_span is not None else None
+    if parent is None:
+        context = SpanContext(os.urandom(16).hex(), os.urandom(8).hex())
+        return Span(name, context, None, kind, attributes)
+    context = SpanContext(parent.trace_id, os.urandom(8).hex(), parent.sampled, parent.trace_state)
+    return Span(name, context, parent.span_id, kind, attributes)
+
+
+@contextmanager
+def start_span(
+    name: str,
+    kind: str = "internal",
+    parent: Optional[SpanContext] = None,
+    attributes: Optional[Dict[str, Any]] = None,
+) -> Iterator[Span]:
+    # Makes the span current for the enclosed code, so that engine calls
+    # made within it carry its context
+    span = new_span(name, kind, parent, attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.end(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
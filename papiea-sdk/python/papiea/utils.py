@@ -1,14 +1,13 @@
 import json
-from typing import Any, Optional
+from typing import Any, Optional, Union
 
 from .core import AttributeDict, ErrorSchemas
 
 
-def json_loads_attrs(s: str) -> Any:
-    def object_hook(obj):
-        return AttributeDict(obj)
-
-    return json.loads(s, object_hook=object_hook)
+def json_loads_attrs(s: Union[str, bytes]) -> Any:
+    # Passing the class itself lets the decoder build AttributeDict
+    # without going through a python level hook for every object
+    return json.loads(s, object_hook=AttributeDict)
 
 
 def validate_error_codes(error_schemas: Optional[ErrorSchemas]):
@@ -0,0 +1,115 @@
+from collections.abc import MutableMapping, MutableSequence
+from typing import Any, Iterator
+
+from .core import AttributeDict
+
+
+def wrap(value: Any) -> Any:
+    value_type = type(value)
+    if value_type is dict:
+        return AttrView(value)
+    if value_type is list:
+        return ListView(value)
+    return value
+
+
+def unwrap(value: Any) -> Any:
+    if isinstance(value, (AttrView, ListView)):
+        return value.data
+    return value
+
+
+def materialize(value: Any) -> Any:
+    # Deep copy into AttributeDicts and lists, same as json_loads_attrs
+    value = unwrap(value)
+    if isinstance(value, dict):
+        return AttributeDict((key, materialize(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [materialize(item) for item in value]
+    return value
+
+
+class AttrView(MutableMapping):
+    # Attribute access over a plain decoded dict. Nested dicts and lists
+    # are wrapped when accessed instead of all being converted upfront
+    # like json_loads_attrs does. Writes go to the underlying dict.
+    __slots__ = ("data",)
+
+    def __init__(self, data: dict):
+        object.__setattr__(self, "data", data)
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return wrap(self.data[name])
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        self.data[name] = unwrap(value)
+
+    def __getitem__(self, key: str) -> Any:
+        return wrap(self.data[key])
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.data[key] = unwrap(value)
+
+    def __delitem__(self, key: str) -> None:
+        del self.data[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.data
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.data)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __eq__(self, other: object) -> bool:
+        return self.data == unwrap(other)
+
+    def __repr__(self) -> str:
+        return f"AttrView({self.data!r})"
+
+    def materialize(self) -> AttributeDict:
+        return materialize(self.data)
+
+
+class ListView(MutableSequence):
+    __slots__ = ("data",)
+
+    def __init__(self, data: list):
+        self.data = data
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ListView(self.data[index])
+        return wrap(self.data[index])
+
+    def __setitem__(self, index, value: Any) -> None:
+        if isinstance(index, slice):
+            self.data[index] = [unwrap(item) for item in value]
+        else:
+            self.data[index] = unwrap(value)
+
+    def __delitem__(self, index) -> None:
+        del self.data[index]
+
+    def __iter__(self) -> Iterator[Any]:
+        for item in self.data:
+            yield wrap(item)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __eq__(self, other: object) -> bool:
+        return self.data == unwrap(other)
+
+    def __repr__(self) -> str:
+        return f"ListView({self.data!r})"
+
+    def insert(self, index: int, value: Any) -> None:
+        self.data.insert(index, unwrap(value))
+
+    def materialize(self) -> list:
+        return materialize(self.data)
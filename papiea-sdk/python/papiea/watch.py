@@ -0,0 +1,241 @@
+import asyncio
+import time
+from typing import Any, AsyncGenerator, Dict, List, Optional, Set, Tuple
+
+from .core import Entity
+
+
+class WatchEventType(str):
+    Created = "created"
+    Updated = "updated"
+    Deleted = "deleted"
+
+
+class WatchEvent(object):
+    def __init__(self, type: str, entity: Entity):
+        self.type = type
+        self.entity = entity
+
+    def __repr__(self) -> str:
+        return f"WatchEvent({self.type}, {self.entity.metadata.uuid})"
+
+
+class WatchCursor(object):
+    # Position of a watch, can be saved with to_dict and passed back to
+    # EntityCRUD.watch to resume. For each timestamp high-water mark the
+    # uuids sitting exactly on it are kept, so that entities sharing a
+    # timestamp are neither missed nor reported twice.
+    def __init__(
+        self,
+        created_at: Optional[str] = None,
+        created_uuids: Optional[List[str]] = None,
+        deleted_at: Optional[str] = None,
+        deleted_uuids: Optional[List[str]] = None,
+        versions: Optional[Dict[str, int]] = None,
+        initialized: bool = False,
+    ):
+        self.created_at = created_at
+        self.created_uuids: Set[str] = set(created_uuids or [])
+        self.deleted_at = deleted_at
+        self.deleted_uuids: Set[str] = set(deleted_uuids or [])
+        # spec_version of every entity, only kept when updates are tracked
+        self.versions = versions
+        self.initialized = initialized
+
+    def to_dict(self) -> dict:
+        return dict(
+            created_at=self.created_at,
+            created_uuids=sorted(self.created_uuids),
+            deleted_at=self.deleted_at,
+            deleted_uuids=sorted(self.deleted_uuids),
+            versions=self.versions,
+            initialized=self.initialized,
+        )
+
+    @staticmethod
+    def from_dict(data: dict) -> "WatchCursor":
+        return WatchCursor(**data)
+
+
+class EntityWatcher(object):
+    # Change feed over the entities of a kind matching a filter.
+    #
+    # Creations and deletions are found by reading entities sorted by
+    # metadata.created_at/deleted_at newest first, stopping at the
+    # cursor's high-water mark, so their cost follows the change rate.
+    # The engine keeps no modification timestamp, so updates can only be
+    # seen by comparing spec_versions over a full listing. That is done
+    # when track_updates is set, at most every update_scan_interval seconds.
+    def __init__(
+        self,
+        client,
+        filter_obj: Any = None,
+        cursor: Optional[WatchCursor] = None,
+        initial: bool = False,
+        track_updates: bool = False,
+        update_scan_interval: float = 60.0,
+        min_interval: float = 1.0,
+        max_interval: float = 30.0,
+        page_size: int = 100,
+    ):
+        self.client = client
+        self.filter_obj = filter_obj or {}
+        self.cursor = cursor or WatchCursor()
+        # Report the entities existing when the watch starts as created
+        self.initial = initial
+        self.track_updates = track_updates
+        self.update_scan_interval = update_scan_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.page_size = page_size
+        self.interval = min_interval
+        self.polls = 0
+        self._last_update_scan: Optional[float] = None
+
+    def __aiter__(self) -> AsyncGenerator[WatchEvent, None]:
+        return self.iterate()
+
+    async def iterate(self) -> AsyncGenerator[WatchEvent, None]:
+        while True:
+            events, cursor = await self.poll()
+            for event in events:
+                yield event
+            # Only moved once all events were handed out, a watch resumed
+            # from a cursor saved mid-batch sees the batch again
+            self.cursor = cursor
+            if events:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.max_interval, self.interval * 2)
+            await asyncio.sleep(self.interval)
+
+    async def poll(self) -> Tuple[List[WatchEvent], WatchCursor]:
+        self.polls += 1
+        old = self.cursor
+        cursor = WatchCursor(
+            old.created_at,
+            list(old.created_uuids),
+            old.deleted_at,
+            list(old.deleted_uuids),
+            dict(old.versions) if old.versions is not None else None,
+            True,
+        )
+        if not old.initialized and not self.initial:
+            cursor.created_at, cursor.created_uuids = await self._newest("created_at", False)
+            cursor.deleted_at, cursor.deleted_uuids = await self._newest("deleted_at", True)
+            if self.track_updates:
+                await self._scan_versions(cursor, [])
+            return [], cursor
+        if not old.initialized:
+            cursor.deleted_at, cursor.deleted_uuids = await self._newest("deleted_at", True)
+        events = []
+        created = await self._scan_new("created_at", False, cursor.created_at, cursor.created_uuids)
+        if created:
+            cursor.created_at, cursor.created_uuids = _advance(
+                created, "created_at", cursor.created_at, cursor.created_uuids
+            )
+        for entity in created:
+            events.append(WatchEvent(WatchEventType.Created, entity))
+            if cursor.versions is not None:
+                cursor.versions[entity.metadata.uuid] = entity.metadata.get("spec_version")
+        if old.initialized:
+            deleted = await self._scan_new("deleted_at", True, cursor.deleted_at, cursor.deleted_uuids)
+            if deleted:
+                cursor.deleted_at, cursor.deleted_uuids = _advance(
+                    deleted, "deleted_at", cursor.deleted_at, cursor.deleted_uuids
+                )
+            for entity in deleted:
+                events.append(WatchEvent(WatchEventType.Deleted, entity))
+                if cursor.versions is not None:
+                    cursor.versions.pop(entity.metadata.uuid, None)
+        if self.track_updates:
+            await self._scan_versions(cursor, events)
+        return events, cursor
+
+    async def _fetch(self, field: str, deleted: bool, offset: Optional[int]) -> List[Entity]:
+        res = await self.client.filter(
+            self.filter_obj,
+            limit=self.page_size,
+            offset=offset,
+            sort=f"metadata.{field}:desc",
+            deleted=True if deleted else None,
+            max_staleness=0,
+        )
+        return res.results
+
+    async def _newest(self, field: str, deleted: bool) -> Tuple[Optional[str], Set[str]]:
+        results = await self._fetch(field, deleted, None)
+        if not results:
+            return None, set()
+        newest = results[0].metadata.get(field)
+        uuids = set()
+        offset = 0
+        while True:
+            uuids.update(e.metadata.uuid for e in results if e.metadata.get(field) == newest)
+            # Rarely more than one page shares the newest timestamp
+            if len(results) < self.page_size or results[-1].metadata.get(field) != newest:
+                return newest, uuids
+            offset += self.page_size
+            results = await self._fetch(field, deleted, offset)
+
+    async def _scan_new(
+        self, field: str, deleted: bool, high_water_mark: Optional[str], boundary: Set[str]
+    ) -> List[Entity]:
+        found = []
+        seen = set()
+        offset = None
+        while True:
+            results = await self._fetch(field, deleted, offset)
+            reached = False
+            for entity in results:
+                uuid = entity.metadata.uuid
+                ts = entity.metadata.get(field)
+                # Pages shift while entities are added, which repeats
+                # entities but never skips any
+                if uuid in seen:
+                    continue
+                if high_water_mark is not None and (ts is None or ts <= high_water_mark):
+                    if ts is None or ts < high_water_mark:
+                        reached = True
+                        break
+                    if uuid in boundary:
+                        continue
+                seen.add(uuid)
+                found.append(entity)
+            if reached or len(results) < self.page_size:
+                return found
+            offset = (offset or 0) + self.page_size
+
+    async def _scan_versions(self, cursor: WatchCursor, events: List[WatchEvent]) -> None:
+        now = time.monotonic()
+        if self._last_update_scan is not None and now - self._last_update_scan < self.update_scan_interval:
+            return
+        self._last_update_scan = now
+        reported = {event.entity.metadata.uuid for event in events}
+        first_scan = cursor.versions is None
+        known_versions = cursor.versions or {}
+        # Rebuilt on every scan, which also forgets entities that are gone
+        versions = {}
+        async for entity in self.client.iter_all(self.filter_obj, self.page_size, lazy=True):
+            uuid = entity.metadata.uuid
+            spec_version = entity.metadata.get("spec_version")
+            known = known_versions.get(uuid)
+            versions[uuid] = spec_version
+            if first_scan or uuid in reported or known is None:
+                continue
+            if spec_version is not None and spec_version > known:
+                events.append(WatchEvent(WatchEventType.Updated, entity.materialize()))
+        cursor.versions = versions
+
+
+def _advance(entities: List[Entity], field: str, high_water_mark: Optional[str], boundary: Set[str]):
+    timestamps = [e.metadata.get(field) for e in entities if e.metadata.get(field) is not None]
+    if not timestamps:
+        return high_water_mark, boundary
+    newest = max(timestamps)
+    if high_water_mark is not None and newest < high_water_mark:
+        return high_water_mark, boundary
+    uuids = {e.metadata.uuid for e in entities if e.metadata.get(field) == newest}
+    if newest == high_water_mark:
+        uuids |= boundary
+    return newest, uuids
@@ -26,4 +26,5 @@ setuptools.setup(
     ],
     python_requires=">=3.7",
     install_requires=["aiohttp>=3.6.2"],
+    extras_require={"fast": ["orjson>=3.0"]},
 )